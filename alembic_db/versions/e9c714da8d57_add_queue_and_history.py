@@ -0,0 +1,53 @@
+"""add queue and history
+
+Revision ID: e9c714da8d57
+Revises:
+Create Date: 2026-10-16 21:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e9c714da8d57'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('queue_items',
+    sa.Column('prompt_id', sa.String(), nullable=False),
+    sa.Column('number', sa.Float(), nullable=False),
+    sa.Column('client_id', sa.String(), nullable=True),
+    sa.Column('prompt', sa.Text(), nullable=False),
+    sa.Column('extra_data', sa.Text(), nullable=False),
+    sa.Column('outputs_to_execute', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('prompt_id')
+    )
+    op.create_index('ix_queue_items_client_id', 'queue_items', ['client_id'], unique=False)
+    op.create_index('ix_queue_items_number', 'queue_items', ['number'], unique=False)
+    op.create_table('history_items',
+    sa.Column('prompt_id', sa.String(), nullable=False),
+    sa.Column('client_id', sa.String(), nullable=True),
+    sa.Column('entry', sa.Text(), nullable=False),
+    sa.Column('completed_at', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('prompt_id')
+    )
+    op.create_index('ix_history_items_client_id', 'history_items', ['client_id'], unique=False)
+    op.create_index('ix_history_items_completed_at', 'history_items', ['completed_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_history_items_completed_at', table_name='history_items')
+    op.drop_index('ix_history_items_client_id', table_name='history_items')
+    op.drop_table('history_items')
+    op.drop_index('ix_queue_items_number', table_name='queue_items')
+    op.drop_index('ix_queue_items_client_id', table_name='queue_items')
+    op.drop_table('queue_items')
@@ -1,3 +1,4 @@
+from sqlalchemy import Column, Float, Index, String, Text
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -11,4 +12,35 @@ def to_dict(obj):
         if (val := getattr(obj, field))
     }
 
-# TODO: Define models here
+
+class QueueItem(Base):
+    """A prompt that was queued and has not finished executing yet."""
+    __tablename__ = "queue_items"
+
+    prompt_id = Column(String, primary_key=True)
+    number = Column(Float, nullable=False)
+    client_id = Column(String, nullable=True)
+    prompt = Column(Text, nullable=False)
+    extra_data = Column(Text, nullable=False)
+    outputs_to_execute = Column(Text, nullable=False)
+    created_at = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_queue_items_number", "number"),
+        Index("ix_queue_items_client_id", "client_id"),
+    )
+
+
+class HistoryItem(Base):
+    """A finished prompt with its outputs and status, stored as the JSON of its history entry."""
+    __tablename__ = "history_items"
+
+    prompt_id = Column(String, primary_key=True)
+    client_id = Column(String, nullable=True)
+    entry = Column(Text, nullable=False)
+    completed_at = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_history_items_client_id", "client_id"),
+        Index("ix_history_items_completed_at", "completed_at"),
+    )
@@ -0,0 +1,131 @@
+import atexit
+import json
+import logging
+import threading
+import time
+
+from sqlalchemy import literal_column, select
+
+from app.database.db import create_session
+from app.database.models import HistoryItem, QueueItem
+
+
+class PromptStore:
+    """
+    Keeps the prompt queue and the history in the database.
+
+    Writes are done behind the back of the caller: they are collected, serialized and committed in
+    batches by a background thread so queueing or finishing a prompt never waits on the disk. The
+    queue items and history entries passed to it must not be modified afterwards. Reads first wait for
+    the pending writes so they always see the latest state.
+    """
+    def __init__(self, flush_interval=0.5):
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.written = 0
+        self.submitted = 0
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    def _submit(self, op):
+        with self.cond:
+            self.pending.append(op)
+            self.submitted += 1
+            self.cond.notify_all()
+
+    def _writer(self):
+        while True:
+            with self.cond:
+                while len(self.pending) == 0:
+                    self.cond.wait()
+                # Give more writes the chance to arrive so they are committed together.
+                self.cond.wait(timeout=self.flush_interval)
+                ops = self.pending
+                self.pending = []
+            try:
+                with create_session() as session:
+                    for op in ops:
+                        op(session)
+                    session.commit()
+            except Exception:
+                logging.exception("Error writing the queue and history to the database:")
+            with self.cond:
+                self.written += len(ops)
+                self.cond.notify_all()
+
+    def flush(self):
+        """Waits until every write submitted so far has been committed."""
+        with self.cond:
+            target = self.submitted
+            self.cond.notify_all()
+            while self.written < target:
+                self.cond.wait()
+
+    def queue_put(self, item):
+        # The items are immutable so they are serialized by the writer thread too.
+        def op(session):
+            number, prompt_id, prompt, extra_data, outputs_to_execute = item[:5]
+            session.merge(QueueItem(prompt_id=prompt_id, number=number, client_id=extra_data.get("client_id", None),
+                                    prompt=json.dumps(prompt), extra_data=json.dumps(extra_data),
+                                    outputs_to_execute=json.dumps(outputs_to_execute), created_at=created_at))
+        created_at = time.time()
+        self._submit(op)
+
+    def queue_remove(self, prompt_id):
+        self._submit(lambda session: session.query(QueueItem).filter(QueueItem.prompt_id == prompt_id).delete())
+
+    def history_put(self, prompt_id, entry):
+        def op(session):
+            client_id = entry["prompt"][3].get("client_id", None)
+            session.merge(HistoryItem(prompt_id=prompt_id, client_id=client_id, entry=json.dumps(entry), completed_at=completed_at))
+        completed_at = time.time()
+        self._submit(op)
+
+    def history_remove(self, prompt_id):
+        self._submit(lambda session: session.query(HistoryItem).filter(HistoryItem.prompt_id == prompt_id).delete())
+
+    def history_clear(self):
+        self._submit(lambda session: session.query(HistoryItem).delete())
+
+    def history_trim(self, max_items):
+        """Removes all but the max_items most recently completed history entries."""
+        def op(session):
+            keep = select(HistoryItem.prompt_id).order_by(HistoryItem.completed_at.desc(), literal_column("rowid").desc()).limit(max_items)
+            session.query(HistoryItem).filter(HistoryItem.prompt_id.not_in(keep)).delete(synchronize_session=False)
+        self._submit(op)
+
+    def load_queue(self):
+        """Returns the queue items that were queued or running when the store was last used."""
+        self.flush()
+        with create_session() as session:
+            rows = session.query(QueueItem).order_by(QueueItem.number).all()
+            return [(row.number, row.prompt_id, json.loads(row.prompt), json.loads(row.extra_data), json.loads(row.outputs_to_execute)) for row in rows]
+
+    def get_history(self, prompt_id=None, client_id=None, since=None, max_items=None, offset=-1):
+        """
+        Returns a dict of the history entries matching the given prompt_id, client_id and completion
+        time, oldest first. offset and max_items select a page like in PromptQueue.get_history.
+        """
+        self.flush()
+        with create_session() as session:
+            query = session.query(HistoryItem)
+            if prompt_id is not None:
+                query = query.filter(HistoryItem.prompt_id == prompt_id)
+            if client_id is not None:
+                query = query.filter(HistoryItem.client_id == client_id)
+            if since is not None:
+                query = query.filter(HistoryItem.completed_at >= since)
+            if offset < 0 and max_items is not None:
+                offset = query.count() - max_items
+            query = query.order_by(HistoryItem.completed_at, literal_column("rowid")).offset(max(offset, 0))
+            if max_items is not None:
+                query = query.limit(max_items)
+            return {row.prompt_id: self._load_entry(row.entry) for row in query.all()}
+
+    @staticmethod
+    def _load_entry(data):
+        entry = json.loads(data)
+        entry["prompt"] = tuple(entry["prompt"])
+        return entry
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+
+import safetensors.torch
+
+import comfy.utils
+
+
+def patches_key(patches_source, patches):
+    """
+    Hash identifying the weights of a patched model. patches_source describes the base model file and the
+    ordered list of patch files and strengths, the patched keys and strengths are added so patches that were
+    changed without going through ModelPatcher.add_patches don't reuse stale weights.
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps(patches_source, default=str).encode("utf-8"))
+    for k in sorted(patches.keys()):
+        h.update("{}:{};".format(k, [(p[0], p[2], p[3] is not None, p[4] is not None) for p in patches[k]]).encode("utf-8"))
+    return h.hexdigest()
+
+
+class BakedPatchCache:
+    """
+    Stores the weights of models with patches (LoRAs) applied as safetensors files, so loading the same model
+    with the same stack of patches again copies the baked weights instead of calculating the patches. The least
+    recently used files are removed when the directory grows over max_size bytes.
+    """
+    def __init__(self):
+        self.directory = None
+        self.max_size = 0
+        self.lock = threading.Lock()
+
+    def set_directory(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def enabled(self):
+        return self.directory is not None
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".safetensors")
+
+    def open(self, key):
+        """Returns a LazyStateDict with the baked weights for key, or None."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            sd = comfy.utils.load_torch_file(path, lazy=True)
+            os.utime(path)
+        except Exception as e:
+            logging.warning("Failed to open baked patches {}: {}".format(path, e))
+            return None
+        return sd
+
+    def save(self, key, weights, existing=None):
+        """
+        Writes weights (and the weights of existing not in it) in a background thread, returns the thread.
+        existing is closed once it was read.
+        """
+        def write():
+            out = {}
+            if existing is not None:
+                # existing reads from the file that is replaced, which fails on Windows while it is open. Its
+                # weights are copied to memory and it is closed first.
+                for k in existing:
+                    if k not in weights:
+                        out[k] = existing[k].clone()
+                comfy.utils.close_state_dict(existing)
+            out.update(weights)
+            path = self._path(key)
+            temp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+            try:
+                safetensors.torch.save_file(out, temp_path)
+                os.replace(temp_path, path)
+            except Exception as e:
+                logging.warning("Failed to write baked patches {}: {}".format(path, e))
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                return
+            logging.info("Baked {} patched weights to {}".format(len(out), path))
+            with self.lock:
+                self.evict()
+        thread = threading.Thread(target=write, daemon=True)
+        thread.start()
+        return thread
+
+    def evict(self):
+        files = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".safetensors"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+baked_patch_cache = BakedPatchCache()
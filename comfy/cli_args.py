@@ -105,6 +105,17 @@ cache_group = parser.add_mutually_exclusive_group()
 cache_group.add_argument("--cache-classic", action="store_true", help="Use the old style (aggressive) caching.")
 cache_group.add_argument("--cache-lru", type=int, default=0, help="Use LRU caching with a maximum of N node results cached. May use more RAM/VRAM.")
 cache_group.add_argument("--cache-none", action="store_true", help="Reduced RAM/VRAM usage at the expense of executing every node for each run.")
+cache_group.add_argument("--cache-budget", type=float, default=0, metavar="GB", help="Cache node results until they use more than GB gigabytes of RAM. When over budget the results that are cheapest to recompute for their size are evicted first.")
+parser.add_argument("--cache-budget-vram", type=float, default=None, metavar="GB", help="With --cache-budget, also limit the VRAM used by cached node results to GB gigabytes.")
+parser.add_argument("--prompt-workers", type=int, default=1, metavar="N", help="Execute up to N prompts at the same time. Each worker has its own node cache, workers are spread over the available devices and prompts are preferably given to a worker that already loaded their models.")
+parser.add_argument("--prompt-worker-devices", type=int, nargs="+", default=None, metavar="DEVICE_ID", help="Device id used by each of the --prompt-workers, in order.")
+parser.add_argument("--sampler-batch-size", type=int, default=1, metavar="N", help="Fuse up to N queued prompts that only differ in their KSampler seed and CLIPTextEncode text into one batched sampling run. Only used with samplers that don't add noise while sampling.")
+parser.add_argument("--sampler-batch-wait", type=float, default=0.0, metavar="SECONDS", help="How long to wait for more prompts to fuse with when --sampler-batch-size is used.")
+parser.add_argument("--coalesce-prompts", action="store_true", help="Don't execute a prompt again when an identical one is already queued or running, give it the results of that prompt instead.")
+parser.add_argument("--parallel-nodes", type=int, default=0, metavar="N", help="Run nodes that declare they only use the CPU in up to N background threads, at the same time as other independent nodes. Nodes that save or load files run one at a time in another background thread. 0 runs every node one after the other.")
+parser.add_argument("--disk-cache", type=str, default=None, metavar="PATH", help="Also store the results of the nodes listed in --disk-cache-nodes in this directory so they can be reused after a restart or by other ComfyUI instances sharing the directory.")
+parser.add_argument("--disk-cache-size", type=float, default=10.0, metavar="GB", help="Maximum size of the --disk-cache directory in GB, the least recently used results are removed when it is exceeded.")
+parser.add_argument("--disk-cache-nodes", type=str, nargs="+", default=["CLIPTextEncode", "VAEEncode"], metavar="CLASS_TYPE", help="Node classes whose results are stored in the --disk-cache directory. They should be deterministic.")
 
 attn_group = parser.add_mutually_exclusive_group()
 attn_group.add_argument("--use-split-cross-attention", action="store_true", help="Use the split cross attention optimization. Ignored when xformers is used.")
@@ -131,12 +142,19 @@ vram_group.add_argument("--cpu", action="store_true", help="To use the CPU for e
 parser.add_argument("--reserve-vram", type=float, default=None, help="Set the amount of vram in GB you want to reserve for use by your OS/other software. By default some amount is reserved depending on your OS.")
 
 parser.add_argument("--async-offload", action="store_true", help="Use async weight offloading.")
+parser.add_argument("--prefetch-modules", type=int, default=0, metavar="N", help="For models that don't fully fit in VRAM, start copying the weights of the next N layers while the current one runs. Uses extra VRAM for the copies.")
+parser.add_argument("--learn-memory-usage", action="store_true", help="Measure the peak VRAM used when running diffusion models and VAEs, store the measurements in the user directory and use them instead of the built-in estimates when deciding how much to load, batch or tile.")
 
 parser.add_argument("--force-non-blocking", action="store_true", help="Force ComfyUI to use non-blocking operations for all applicable tensors. This may improve performance on some non-Nvidia systems but can cause issues with some workflows.")
 
 parser.add_argument("--default-hashing-function", type=str, choices=['md5', 'sha1', 'sha256', 'sha512'], default='sha256', help="Allows you to choose the hash function to use for duplicate filename / contents comparison. Default is sha256.")
 
 parser.add_argument("--disable-smart-memory", action="store_true", help="Force ComfyUI to agressively offload to regular ram instead of keeping models in vram when it can.")
+parser.add_argument("--eviction-policy", type=str, choices=["default", "lru", "lookahead"], default="default", help="How to pick the models unloaded from VRAM when memory is needed. default: partially loaded and small models first. lru: least recently used first. lookahead: the models the queued prompts need last first.")
+parser.add_argument("--record-model-loads", type=str, default=None, metavar="PATH", help="Append every model load request to this json lines file, it can be replayed with tests-unit/comfy_test/eviction_benchmark.py to compare eviction policies.")
+parser.add_argument("--noise-seeding", type=str, choices=["legacy", "counter"], default="legacy", help="How the initial noise of the items of a latent batch is seeded. legacy: one generator for the whole batch, batch_index i needs the noise of all the items before it to be generated. counter: every item gets its own generator seeded from the seed and its index so any item is generated directly. Latents with a batch size of 1 get the same noise with both.")
+parser.add_argument("--sampler-checkpoint", type=str, default=None, metavar="PATH", help="Save the state of running samplers to this directory every --sampler-checkpoint-steps steps, so a prompt that is interrupted, runs out of memory or is killed with the process continues from the last saved step when it is queued again. Only samplers that step from one sigma to the next without keeping earlier steps (euler, euler_ancestral, heun, dpm_2, dpmpp_2s_ancestral, dpmpp_sde, ddpm, lcm and their variants) are saved.")
+parser.add_argument("--sampler-checkpoint-steps", type=int, default=5, metavar="N", help="Number of sampling steps between the --sampler-checkpoint saves.")
 parser.add_argument("--deterministic", action="store_true", help="Make pytorch use slower deterministic algorithms when it can. Note that this might not make images deterministic in all cases.")
 
 class PerformanceFeature(enum.Enum):
@@ -148,6 +166,16 @@ class PerformanceFeature(enum.Enum):
 parser.add_argument("--fast", nargs="*", type=PerformanceFeature, help="Enable some untested and potentially quality deteriorating optimizations. --fast with no arguments enables everything. You can pass a list specific optimizations if you only want to enable specific ones. Current valid optimizations: {}".format(" ".join(map(lambda c: c.value, PerformanceFeature))))
 
 parser.add_argument("--mmap-torch-files", action="store_true", help="Use mmap when loading ckpt/pt files.")
+parser.add_argument("--model-ram-cache", type=float, default=0, metavar="GB", help="Keep up to GB gigabytes of loaded checkpoints, diffusion models, text encoders and VAEs in RAM so loading them again doesn't read the file and detect the model type again. The least recently used models are dropped first.")
+parser.add_argument("--model-detection-cache", action="store_true", help="Store the detected type and config of the models loaded in the user directory so loading them again, also after a restart, skips model detection.")
+parser.add_argument("--conditioning-cache", type=float, default=0, metavar="GB", help="Keep up to GB gigabytes of text encoder outputs in RAM so encoding the same prompt with the same text encoder again doesn't run it. Disabled by default.")
+parser.add_argument("--conditioning-cache-dir", type=str, default=None, metavar="PATH", help="Also store the text encoder outputs in this directory so they survive restarts. Requires --conditioning-cache.")
+parser.add_argument("--lora-bake-cache", type=str, default=None, metavar="PATH", help="Store the weights of models with LoRAs applied in this directory so loading the same model with the same LoRAs and strengths again doesn't calculate the patches again. Baking a new LoRA stack temporarily uses extra RAM for a copy of the patched weights.")
+parser.add_argument("--lora-bake-cache-size", type=float, default=20.0, metavar="GB", help="Maximum size of the --lora-bake-cache directory in GB, the least recently used files are removed when it is exceeded.")
+parser.add_argument("--disk-offload", type=str, default=None, metavar="PATH", help="Offload model weights that don't fit in --disk-offload-ram to files in this directory. They are memory mapped and read from disk when the layers are used, for running models larger than the RAM.")
+parser.add_argument("--disk-offload-ram", type=float, default=16.0, metavar="GB", help="RAM in GB that offloaded model weights can use before the least recently used ones are offloaded to the --disk-offload directory.")
+parser.add_argument("--shared-weights", type=str, default=None, metavar="PATH", help="Keep the weights of the models loaded from files in RAM as copy-on-write memory mapped files in this directory (for example /dev/shm/comfyui), so several ComfyUI processes on the same machine that load the same models share one copy of the weights.")
+parser.add_argument("--shared-weights-size", type=float, default=64.0, metavar="GB", help="Maximum size of the --shared-weights directory in GB, the least recently used files are removed when it is exceeded.")
 parser.add_argument("--disable-mmap", action="store_true", help="Don't use mmap when loading safetensors.")
 
 parser.add_argument("--dont-print-server", action="store_true", help="Don't print server output.")
@@ -213,6 +241,7 @@ database_default_path = os.path.abspath(
     os.path.join(os.path.dirname(__file__), "..", "user", "comfyui.db")
 )
 parser.add_argument("--database-url", type=str, default=f"sqlite:///{database_default_path}", help="Specify the database URL, e.g. for an in-memory database you can use 'sqlite:///:memory:'.")
+parser.add_argument("--persist-queue", action="store_true", help="Store the queue and the history in the database so pending prompts are executed again and the history is kept after a restart.")
 
 if comfy.options.args_parsing:
     args = parser.parse_args()
@@ -316,6 +316,14 @@ class ComfyNodeABC(ABC):
 
     Comfy Docs: https://docs.comfy.org/custom-nodes/backend/server_overview#function
     """
+    EXECUTION_RESOURCE: Literal["GPU", "CPU", "IO"]
+    """The resource this node mostly uses, which decides what it may run at the same time with when ``--parallel-nodes`` is used.
+
+    ``"CPU"`` nodes run in background threads next to other nodes, ``"IO"`` nodes (e.g. saving files) run one at a time in a background thread
+    and ``"GPU"`` nodes run one at a time on the prompt worker thread.  Nodes that don't set it are treated as ``"GPU"``.  Usage::
+
+        EXECUTION_RESOURCE = "CPU"
+    """
 
 
 class CheckLazyMixin:
@@ -0,0 +1,198 @@
+import collections
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+
+import torch
+
+import comfy.baked_patches
+import comfy.model_cache
+
+
+def tensor_bytes(value):
+    if isinstance(value, torch.Tensor):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(tensor_bytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(tensor_bytes(v) for v in value)
+    return 0
+
+
+def update_hash(h, value):
+    """Hashes tokens: nested lists/tuples/dicts of numbers and strings with tensors for embeddings."""
+    if isinstance(value, torch.Tensor):
+        t = value.detach().cpu().contiguous()
+        h.update("tensor{}{}:".format(t.dtype, tuple(t.shape)).encode("utf-8"))
+        h.update(t.reshape(-1).view(torch.uint8).numpy().tobytes())
+    elif isinstance(value, dict):
+        h.update(b"{")
+        for k in sorted(value.keys(), key=str):
+            update_hash(h, k)
+            update_hash(h, value[k])
+        h.update(b"}")
+    elif isinstance(value, (list, tuple)):
+        h.update(b"[")
+        for v in value:
+            update_hash(h, v)
+        h.update(b"]")
+    else:
+        h.update("{}:{};".format(type(value).__name__, value).encode("utf-8"))
+
+
+def tokens_key(*values):
+    h = hashlib.sha256()
+    for value in values:
+        update_hash(h, value)
+    return h.hexdigest()
+
+
+def weights_key(patcher):
+    """
+    Identifies the weights of a text encoder with its patches. Returns (key, persistent), keys that are not
+    persistent are only valid in this process.
+    """
+    model_files = getattr(patcher, "model_files", ())
+    if len(model_files) > 0 and (len(patcher.patches) == 0 or patcher.patches_source is not None):
+        try:
+            files = [comfy.model_cache.file_key(p) for p in model_files]
+        except OSError:
+            files = None
+        if files is not None:
+            patches = comfy.baked_patches.patches_key(patcher.patches_source, patcher.patches) if len(patcher.patches) > 0 else None
+            data = json.dumps([files, type(patcher.model).__name__, patches], default=str)
+            return hashlib.sha256(data.encode("utf-8")).hexdigest(), True
+    # Every ModelPatcher gets a new uuid when patches are added, clones share it
+    return "memory:{}".format(patcher.patches_uuid), False
+
+
+def cacheable(patcher):
+    """Hooks and object patches can change the outputs in ways the weights key doesn't capture."""
+    return patcher.forced_hooks is None and len(patcher.hook_patches) == 0 and len(patcher.object_patches) == 0
+
+
+class ConditioningCache:
+    """
+    Keeps the outputs of text encoders keyed by the weights of the encoder, its options and the tokens, so
+    encoding the same prompt with the same text encoder again (from another CLIP clone or after something
+    unrelated upstream changed) doesn't run it. The least recently used outputs are dropped when their size
+    is over the budget. When a directory is set the outputs of text encoders loaded from files without patches
+    only known in this process are also stored there.
+
+    The per chunk cache of the token weight encoders uses the same entries, keyed by the weights key set with
+    encoder() around the encode.
+    """
+    def __init__(self, budget=0):
+        self.budget = budget
+        self.directory = None
+        self.entries = collections.OrderedDict()
+        self.sizes = {}
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        self.local = threading.local()
+
+    def set_budget(self, budget):
+        with self.lock:
+            self.budget = budget
+            self._evict()
+
+    def set_directory(self, directory):
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def enabled(self):
+        return self.budget > 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pt")
+
+    def get(self, key, persistent=False):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        if persistent and self.directory is not None:
+            path = self._path(key)
+            if os.path.exists(path):
+                try:
+                    value = torch.load(path, map_location="cpu", weights_only=True)
+                except Exception as e:
+                    logging.warning("Could not read the cached conditioning {}: {}".format(path, e))
+                else:
+                    self.put(key, value)
+                    with self.lock:
+                        self.hits += 1
+                    return value
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value, persistent=False):
+        size = tensor_bytes(value)
+        if size > self.budget:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.resident_bytes -= self.sizes[key]
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.sizes[key] = size
+            self.resident_bytes += size
+            self._evict()
+        if persistent and self.directory is not None:
+            path = self._path(key)
+            temp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+            try:
+                torch.save(value, temp_path)
+                os.replace(temp_path, path)
+            except Exception as e:
+                logging.warning("Could not write the cached conditioning {}: {}".format(path, e))
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    def _evict(self):
+        while self.resident_bytes > self.budget and len(self.entries) > 0:
+            key, _ = self.entries.popitem(last=False)
+            self.resident_bytes -= self.sizes.pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.resident_bytes = 0
+
+    @contextlib.contextmanager
+    def encoder(self, key):
+        """Sets the weights key used by the per chunk cache of the encodes run by this thread."""
+        previous = getattr(self.local, "key", None)
+        self.local.key = key
+        try:
+            yield
+        finally:
+            self.local.key = previous
+
+    def encoder_key(self):
+        if not self.enabled():
+            return None
+        return getattr(self.local, "key", None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "resident_bytes": self.resident_bytes,
+                "budget_bytes": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+conditioning_cache = ConditioningCache()
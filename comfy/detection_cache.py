@@ -0,0 +1,128 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import torch
+
+import comfy.utils
+
+MAX_ENTRIES = 1000
+
+
+def code_version():
+    """Detected configs are only valid for the detection code that produced them."""
+    h = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in ("model_detection.py", "supported_models.py", "supported_models_base.py"):
+        try:
+            with open(os.path.join(directory, name), "rb") as f:
+                h.update(f.read())
+        except OSError:
+            pass
+    return h.hexdigest()
+
+
+def state_dict_fingerprint(state_dict, *extra):
+    """Hash of the keys, shapes and dtypes of a state dict, the same data as its safetensors header."""
+    info = comfy.utils.state_dict_info(state_dict)
+    h = hashlib.sha256()
+    for k in sorted(info.keys()):
+        w = info[k]
+        h.update("{}:{}:{};".format(k, tuple(getattr(w, "shape", ())), getattr(w, "dtype", None)).encode("utf-8"))
+    h.update(json.dumps(extra, sort_keys=True, default=str).encode("utf-8"))
+    return h.hexdigest()
+
+
+def encode(value):
+    # JSON loses the difference between lists and tuples, the model configs are matched with ==
+    if isinstance(value, tuple):
+        return {"__tuple__": [encode(v) for v in value]}
+    if isinstance(value, list):
+        return [encode(v) for v in value]
+    if isinstance(value, dict):
+        return {"__dict__": [[encode(k), encode(v)] for k, v in value.items()]}
+    if isinstance(value, torch.dtype):
+        return {"__dtype__": str(value).split(".")[-1]}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    raise TypeError("Can't store {} in the detection cache".format(type(value)))
+
+
+def decode(value):
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    if isinstance(value, dict):
+        if "__tuple__" in value:
+            return tuple(decode(v) for v in value["__tuple__"])
+        if "__dtype__" in value:
+            return getattr(torch, value["__dtype__"])
+        return {decode(k): decode(v) for k, v in value["__dict__"]}
+    return value
+
+
+class DetectionCache:
+    """
+    Stores the results of model detection keyed by the fingerprint of the state dict so loading the same
+    model again skips detection. It is used once a path is set, the results are kept in that json file so
+    they survive restarts.
+    """
+    def __init__(self):
+        self.path = None
+        self.entries = {}
+        self.version = None
+        self.lock = threading.Lock()
+
+    def set_path(self, path):
+        with self.lock:
+            self.path = path
+            self.version = code_version()
+            self.entries = {}
+            if path is None or not os.path.exists(path):
+                return
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == self.version:
+                    self.entries = data.get("entries", {})
+            except Exception as e:
+                logging.warning("Could not read the model detection cache {}: {}".format(path, e))
+
+    def enabled(self):
+        return self.path is not None
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key, None)
+        if value is None:
+            return None
+        return decode(value)
+
+    def put(self, key, value):
+        try:
+            value = encode(value)
+        except TypeError as e:
+            logging.debug("Not caching detection result: {}".format(e))
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > MAX_ENTRIES:
+                del self.entries[next(iter(self.entries))]
+            self._save()
+
+    def _save(self):
+        if self.path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = "{}.tmp".format(self.path)
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": self.version, "entries": self.entries}, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logging.warning("Could not write the model detection cache {}: {}".format(self.path, e))
+
+
+detection_cache = DetectionCache()
@@ -0,0 +1,198 @@
+import contextlib
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+import weakref
+
+import torch
+
+import comfy.shared_weights
+
+
+def module_params(module):
+    return [(name, param) for name, param in module.named_parameters(recurse=False) if param is not None and param.numel() > 0]
+
+
+class DiskOffload:
+    """
+    Third weight tier below the offload device: when the model weights in RAM are over the budget, the weights
+    of the least recently used modules are written to files and replaced with tensors memory mapped from those
+    files. The pages are read from disk when the module is used (cast to the load device by comfy_cast_weights
+    or moved there) and can be dropped by the OS at any time, so the RAM used by them stays around the budget.
+
+    Models loaded in loading() are written out module by module while their state dict is loaded, so a model
+    that doesn't fit in the budget never has to be in RAM all at once.
+    """
+    def __init__(self):
+        self.directory = None
+        self.ram_budget = 0
+        self.models = weakref.WeakSet()
+        # module -> {parameter name: (data pointer, file)} of its memory mapped parameters
+        self.mapped = weakref.WeakKeyDictionary()
+        # model -> the modules that were loaded so far, for the models in loading()
+        self.loading_modules = weakref.WeakKeyDictionary()
+        self.lock = threading.RLock()
+
+    def set_directory(self, directory, ram_budget):
+        self.directory = directory
+        self.ram_budget = ram_budget
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def enabled(self):
+        return self.directory is not None
+
+    def register(self, model):
+        """
+        Adds the model to the models that are offloaded. Its weights are written out by the next enforce_budget(),
+        not by this call, because models are registered by their ModelPatcher which may be created before the
+        weights are loaded.
+        """
+        if not self.enabled():
+            return
+        with self.lock:
+            if model in self.models:
+                return
+            model.disk_offload_id = uuid.uuid4().hex
+            model.disk_offload_last_used = time.monotonic()
+            path = os.path.join(self.directory, model.disk_offload_id)
+            weakref.finalize(model, shutil.rmtree, path, True)
+            self.models.add(model)
+
+    @contextlib.contextmanager
+    def loading(self, model):
+        """
+        Context for loading the state dict of model: the modules are written out as soon as they are loaded
+        when the weights in RAM are over the budget, instead of once the whole model is in RAM.
+        """
+        if not self.enabled():
+            yield
+            return
+        self.register(model)
+        names = {module: name for name, module in model.named_modules()}
+        loaded = weakref.WeakSet()
+        with self.lock:
+            self.loading_modules[model] = loaded
+            state = {"resident": self.resident_bytes(), "enforced": False}
+
+        def loaded_hook(module, incompatible_keys):
+            params = module_params(module)
+            if len(params) == 0 or any(param.device.type != "cpu" for _, param in params):
+                return
+            with self.lock:
+                loaded.add(module)
+                mapped = self.mapped.get(module, {})
+                for param_name, (_, path) in mapped.items():
+                    # Loaded into the memory mapped copy, the weights are in RAM now
+                    mapped[param_name] = (None, path)
+                state["resident"] += sum(param.nbytes for _, param in params)
+                if state["resident"] <= self.ram_budget:
+                    return
+                if not state["enforced"]:
+                    # The first time the budget is reached the least recently used models are offloaded first,
+                    # after that only the modules of this model are left in RAM.
+                    state["enforced"] = True
+                    self.enforce_budget()
+                    state["resident"] = self.resident_bytes()
+                    return
+                try:
+                    self.map_module(model, names.get(module, ""), module)
+                    state["resident"] -= sum(param.nbytes for _, param in params)
+                except Exception as e:
+                    logging.warning("Failed to offload {} to disk: {}".format(names.get(module, ""), e))
+
+        handles = [module.register_load_state_dict_post_hook(loaded_hook) for module in names]
+        try:
+            yield
+        finally:
+            for handle in handles:
+                handle.remove()
+            with self.lock:
+                self.loading_modules.pop(model, None)
+            self.enforce_budget()
+
+    def touch(self, model):
+        model.disk_offload_last_used = time.monotonic()
+
+    def is_mapped(self, module, param_name=None):
+        mapped = self.mapped.get(module, {})
+        for name, param in module_params(module):
+            if param_name is not None and name != param_name:
+                continue
+            if mapped.get(name, (None, None))[0] != param.data_ptr():
+                return False
+        return len(mapped) > 0
+
+    def resident_modules(self, model):
+        """(size, name, module) of the modules of model with weights in RAM that are not memory mapped."""
+        out = []
+        loaded = self.loading_modules.get(model, None)
+        for name, module in model.named_modules():
+            params = module_params(module)
+            if len(params) == 0 or any(param.device.type != "cpu" for _, param in params):
+                continue
+            if loaded is not None and module not in loaded:
+                # Not loaded yet, writing it out would only save the uninitialized weights
+                continue
+            if self.is_mapped(module) or comfy.shared_weights.shared_weights.is_shared(model, module):
+                continue
+            out.append((sum(param.nbytes for _, param in params), name, module))
+        return out
+
+    def resident_bytes(self):
+        with self.lock:
+            return sum(sum(x[0] for x in self.resident_modules(model)) for model in list(self.models))
+
+    def map_module(self, model, name, module):
+        directory = os.path.join(self.directory, model.disk_offload_id)
+        os.makedirs(directory, exist_ok=True)
+        mapped = self.mapped.setdefault(module, {})
+        for param_name, param in module_params(module):
+            if self.is_mapped(module, param_name):
+                # Still memory mapped from its file
+                continue
+            # Every write gets a new file: the previous file of the parameter may still be mapped by a tensor
+            # that is in use, truncating it would crash the process when the tensor is read.
+            path = os.path.join(directory, "{}.{}.{}.bin".format(name, param_name, uuid.uuid4().hex[:8]))
+            data = param.data.detach().contiguous()
+            data.reshape(-1).view(torch.uint8).numpy().tofile(path)
+            param.data = torch.from_file(path, shared=False, size=data.numel(), dtype=data.dtype).reshape(data.shape)
+            previous = mapped.get(param_name, (None, None))[1]
+            mapped[param_name] = (param.data_ptr(), path)
+            if previous is not None:
+                try:
+                    os.remove(previous)
+                except OSError:
+                    # Still mapped on Windows, removed with the directory of the model
+                    pass
+
+    def enforce_budget(self):
+        """Memory maps the least recently used modules until the weights in RAM fit in the budget."""
+        if not self.enabled():
+            return 0
+        with self.lock:
+            models = sorted(self.models, key=lambda m: m.disk_offload_last_used)
+            resident = [(model, self.resident_modules(model)) for model in models]
+            total = sum(sum(x[0] for x in modules) for _, modules in resident)
+            mapped = 0
+            for model, modules in resident:
+                modules.sort(key=lambda x: x[0], reverse=True)
+                for size, name, module in modules:
+                    if total <= self.ram_budget:
+                        break
+                    try:
+                        self.map_module(model, name, module)
+                    except Exception as e:
+                        logging.warning("Failed to offload {} to disk: {}".format(name, e))
+                        continue
+                    total -= size
+                    mapped += size
+            if mapped > 0:
+                logging.info("Offloaded {:.2f} MB of weights to disk, {:.2f} MB left in RAM".format(mapped / (1024 * 1024), total / (1024 * 1024)))
+            return mapped
+
+
+disk_offload = DiskOffload()
@@ -0,0 +1,170 @@
+import json
+import logging
+import math
+import os
+import threading
+
+LOOKAHEAD_PROMPTS = 8
+
+
+class EvictionCandidate:
+    """A loaded model that free_memory can unload, index is its position in current_loaded_models (0 is the most recently used)."""
+    def __init__(self, index, model_memory, loaded_memory, refcount=0, model_files=()):
+        self.index = index
+        self.model_memory = model_memory
+        self.loaded_memory = loaded_memory
+        self.offloaded_memory = model_memory - loaded_memory
+        self.refcount = refcount
+        self.model_files = tuple(model_files)
+
+
+def uses_files(model_files, prompt_files):
+    """True if one of the model files (absolute paths) is one of the files selected in a prompt (relative to the model folders)."""
+    for path in model_files:
+        for name in prompt_files:
+            name = os.path.normpath(name)
+            if path == name or path.endswith(os.sep + name):
+                return True
+    return False
+
+
+class DefaultPolicy:
+    """Unloads partially loaded models first, then the least referenced and smallest ones."""
+    uses_lookahead = False
+
+    def order(self, candidates, upcoming):
+        return sorted(candidates, key=lambda c: (-c.offloaded_memory, c.refcount, c.model_memory, c.index))
+
+
+class LRUPolicy:
+    """Unloads the least recently used models first."""
+    uses_lookahead = False
+
+    def order(self, candidates, upcoming):
+        return sorted(candidates, key=lambda c: (-c.index, c.loaded_memory))
+
+
+class LookaheadPolicy:
+    """
+    Unloads the models that are needed furthest in the future first (Belady's algorithm) using the model files
+    selected by the running and queued prompts. Models that none of them use go first and models loaded from
+    unknown files are assumed to be needed right after the known prompts. Ties are broken by recency and then
+    by the cost of loading the model again.
+    """
+    uses_lookahead = True
+
+    def next_use(self, candidate, upcoming):
+        if len(candidate.model_files) == 0:
+            return len(upcoming)
+        for i, prompt_files in enumerate(upcoming):
+            if uses_files(candidate.model_files, prompt_files):
+                return i
+        return math.inf
+
+    def order(self, candidates, upcoming):
+        return sorted(candidates, key=lambda c: (-self.next_use(c, upcoming), -c.index, c.loaded_memory))
+
+
+POLICIES = {
+    "default": DefaultPolicy,
+    "lru": LRUPolicy,
+    "lookahead": LookaheadPolicy,
+}
+
+policy = DefaultPolicy()
+upcoming_provider = None
+
+
+def set_policy(name):
+    global policy
+    policy = POLICIES[name]()
+
+
+def set_upcoming_provider(provider):
+    """provider() returns the sets of model files used by the next prompts, in the order they will run."""
+    global upcoming_provider
+    upcoming_provider = provider
+
+
+def upcoming_model_files():
+    if upcoming_provider is None:
+        return []
+    try:
+        return upcoming_provider()
+    except Exception as e:
+        logging.warning("Could not get the models used by the queued prompts: {}".format(e))
+        return []
+
+
+def order_candidates(candidates):
+    return policy.order(candidates, upcoming_model_files() if policy.uses_lookahead else [])
+
+
+class LoadRecorder:
+    """Appends every load_models_gpu call to a json lines file that can be replayed with simulate()."""
+    def __init__(self):
+        self.path = None
+        self.lock = threading.Lock()
+
+    def set_path(self, path):
+        self.path = path
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def enabled(self):
+        return self.path is not None
+
+    def record(self, models, memory_required, total_memory, upcoming):
+        """models is a list of (id, size, model_files)."""
+        entry = {
+            "models": [{"id": str(i), "size": int(size), "files": list(files)} for i, size, files in models],
+            "memory_required": int(memory_required),
+            "total_memory": int(total_memory),
+            "upcoming": [sorted(files) for files in upcoming],
+        }
+        with self.lock:
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry) + "\n")
+            except OSError as e:
+                logging.warning("Could not record model loads to {}: {}".format(self.path, e))
+
+
+load_recorder = LoadRecorder()
+
+
+def read_trace(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def simulate(trace, policy, memory):
+    """
+    Replays a recorded sequence of load_models_gpu calls on a device with memory bytes and returns the bytes
+    that were loaded to it and the number of loads and unloads. Models are loaded and unloaded completely.
+    """
+    loaded = []  # [model id, size, files], most recently used first
+    stats = {"bytes_loaded": 0, "loads": 0, "unloads": 0}
+    for entry in trace:
+        ids = set(m["id"] for m in entry["models"])
+        required = entry.get("memory_required", 0)
+        missing = [m for m in entry["models"] if m["id"] not in [x[0] for x in loaded]]
+        required += sum(m["size"] for m in missing)
+
+        used = sum(x[1] for x in loaded)
+        if memory - used < required:
+            candidates = [EvictionCandidate(i, x[1], x[1], model_files=x[2]) for i, x in enumerate(loaded) if x[0] not in ids]
+            unloaded = set()
+            for c in policy.order(candidates, [set(files) for files in entry.get("upcoming", [])]):
+                if memory - used >= required:
+                    break
+                unloaded.add(c.index)
+                used -= c.model_memory
+                stats["unloads"] += 1
+            loaded = [x for i, x in enumerate(loaded) if i not in unloaded]
+
+        for m in missing:
+            stats["bytes_loaded"] += m["size"]
+            stats["loads"] += 1
+        loaded = [[m["id"], m["size"], m.get("files", [])] for m in entry["models"]] + [x for x in loaded if x[0] not in ids]
+    return stats
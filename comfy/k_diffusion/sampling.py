@@ -1,4 +1,5 @@
 import math
+import threading
 from functools import partial
 
 from scipy import integrate
@@ -72,10 +73,17 @@ def get_ancestral_step(sigma_from, sigma_to, eta=1.):
     return sigma_down, sigma_up
 
 
+# comfy.sampler_checkpoint sets current while sampling to save and restore the state of the noise samplers
+noise_sampler_tracker = threading.local()
+
+
 def default_noise_sampler(x, seed=None):
     if seed is not None:
         generator = torch.Generator(device=x.device)
         generator.manual_seed(seed)
+        tracker = getattr(noise_sampler_tracker, "current", None)
+        if tracker is not None:
+            tracker.add_generator(generator)
     else:
         generator = None
 
@@ -134,6 +142,9 @@ class BrownianTreeNoiseSampler:
     """
 
     def __init__(self, x, sigma_min, sigma_max, seed=None, transform=lambda x: x, cpu=False):
+        tracker = getattr(noise_sampler_tracker, "current", None)
+        if tracker is not None:
+            sigma_min, sigma_max = tracker.brownian_bounds(sigma_min, sigma_max)
         self.transform = transform
         t0, t1 = self.transform(torch.as_tensor(sigma_min)), self.transform(torch.as_tensor(sigma_max))
         self.tree = BatchedBrownianTree(x, t0, t1, seed, cpu=cpu)
@@ -349,6 +349,51 @@ def pad_tensor_to_shape(tensor: torch.Tensor, new_shape: list[int]) -> torch.Ten
 
     return padded_tensor
 
+def is_batchable_lora_patch(p):
+    v = p[1]
+    if not isinstance(v, weight_adapter.LoRAAdapter) or p[3] is not None or p[4] is not None:
+        return False
+    # No locon mid weights, dora or reshape
+    return v.weights[3] is None and v.weights[4] is None and v.weights[5] is None
+
+def batch_lora_patches(key_patches, weight_shapes, device, intermediate_dtype=torch.float32):
+    """
+    Calculates the up @ down products of the plain LoRA patches of many keys with one torch.bmm per group of
+    patches with the same shapes, instead of one small matmul per key.
+
+    key_patches: {key: patches} as in ModelPatcher.patches, weight_shapes: {key: shape of the weight}.
+    Returns {key: patches} with these LoRA patches replaced by "diff" patches holding the scaled products,
+    which calculate_weight adds to the weight in place.
+    """
+    groups = {}
+    for key, patches in key_patches.items():
+        for i, p in enumerate(patches):
+            if not is_batchable_lora_patch(p):
+                continue
+            mat1, mat2 = p[1].weights[0], p[1].weights[1]
+            if mat1.shape[0] * mat2[0].numel() != weight_shapes[key].numel():
+                continue
+            groups.setdefault((tuple(mat1.shape), tuple(mat2.shape)), []).append((key, i))
+
+    out = {}
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        mat1 = torch.stack([comfy.model_management.cast_to_device(key_patches[k][i][1].weights[0], device, intermediate_dtype).flatten(start_dim=1) for k, i in members])
+        mat2 = torch.stack([comfy.model_management.cast_to_device(key_patches[k][i][1].weights[1], device, intermediate_dtype).flatten(start_dim=1) for k, i in members])
+        diffs = torch.bmm(mat1, mat2)
+        del mat1, mat2
+        for j, (k, i) in enumerate(members):
+            p = key_patches[k][i]
+            v = p[1].weights
+            diff = diffs[j].reshape(weight_shapes[k])
+            if v[2] is not None:
+                diff.mul_(v[2] / v[1].shape[0])
+            if k not in out:
+                out[k] = list(key_patches[k])
+            out[k][i] = (p[0], (diff,), p[2], p[3], p[4])
+    return out
+
 def calculate_weight(patches, weight, key, intermediate_dtype=torch.float32, original_weights=None):
     for p in patches:
         strength = p[0]
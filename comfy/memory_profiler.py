@@ -0,0 +1,136 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+
+import comfy.model_management
+
+MAX_SAMPLES = 64
+MARGIN = 1.05
+# Don't trust the fit far outside of the sizes that were measured
+MAX_EXTRAPOLATION = 2.0
+
+
+def fit(samples):
+    """
+    Fits peak = a + b * size to the (size, peak) samples and moves the line up so it is above every sample.
+    Returns (a, b) or None when there are no samples.
+    """
+    if len(samples) == 0:
+        return None
+    xs = [s[0] for s in samples]
+    ys = [s[1] for s in samples]
+    n = len(samples)
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x == 0:
+        # Only one size measured, assume the memory is proportional to it
+        return (0.0, max(ys) / max(mean_x, 1))
+    b = max(0.0, sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x)
+    a = mean_y - b * mean_x
+    a += max(y - (a + b * x) for x, y in zip(xs, ys))
+    return (a, b)
+
+
+class MemoryProfiler:
+    """
+    Learns the memory used by running models from measurements. measure() records the peak memory allocated
+    on the device while running a model on inputs of some size, and estimate() returns the memory needed for
+    a new size from a line fitted to the measurements of the same key (the model architecture, dtype and
+    operation). Callers use their static estimate when estimate() returns None.
+
+    The measurements are kept in a json file when a path is set so they survive restarts.
+    """
+    def __init__(self):
+        self.path = None
+        # key -> {size: peak}
+        self.samples = {}
+        self.fits = {}
+        self.active = set()
+        self.lock = threading.Lock()
+
+    def set_path(self, path):
+        with self.lock:
+            self.path = path
+            self.samples = {}
+            self.fits = {}
+            if path is None or not os.path.exists(path):
+                return
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                for key, samples in data.get("samples", {}).items():
+                    self.samples[key] = {int(x): int(y) for x, y in samples}
+            except Exception as e:
+                logging.warning("Could not read the memory profile {}: {}".format(path, e))
+
+    def enabled(self):
+        return self.path is not None
+
+    def _fit(self, key):
+        if key not in self.fits:
+            self.fits[key] = fit(list(self.samples.get(key, {}).items()))
+        return self.fits[key]
+
+    def has_estimate(self, key):
+        with self.lock:
+            return len(self.samples.get(key, {})) > 0
+
+    def estimate(self, key, size):
+        """Memory in bytes needed to run key on inputs of size, or None if it wasn't measured."""
+        with self.lock:
+            samples = self.samples.get(key, None)
+            if not samples:
+                return None
+            if size > max(samples.keys()) * MAX_EXTRAPOLATION:
+                return None
+            a, b = self._fit(key)
+            return max(a + b * size, samples.get(size, 0)) * MARGIN
+
+    def record(self, key, size, peak):
+        with self.lock:
+            samples = self.samples.setdefault(key, {})
+            if samples.get(size, 0) >= peak:
+                return
+            samples.pop(size, None)
+            samples[size] = peak
+            while len(samples) > MAX_SAMPLES:
+                del samples[next(iter(samples))]
+            self.fits.pop(key, None)
+            self._save()
+
+    @contextlib.contextmanager
+    def measure(self, key, size, device):
+        """Records the peak memory allocated on device above what was allocated when entering."""
+        if not self.enabled() or device in self.active:
+            yield
+            return
+        start = comfy.model_management.memory_allocated(device)
+        if start is None:
+            yield
+            return
+        self.active.add(device)
+        try:
+            comfy.model_management.reset_peak_memory(device)
+            yield
+            peak = comfy.model_management.peak_memory_allocated(device) - start
+            self.record(key, int(size), int(peak))
+        finally:
+            self.active.discard(device)
+
+    def _save(self):
+        if self.path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = "{}.tmp".format(self.path)
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"samples": {k: list(v.items()) for k, v in self.samples.items()}}, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            logging.warning("Could not write the memory profile {}: {}".format(self.path, e))
+
+
+memory_profiler = MemoryProfiler()
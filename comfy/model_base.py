@@ -20,6 +20,7 @@ import comfy.ldm.hunyuan3dv2_1
 import comfy.ldm.hunyuan3dv2_1.hunyuandit
 import torch
 import logging
+import comfy.disk_offload
 from comfy.ldm.modules.diffusionmodules.openaimodel import UNetModel, Timestep
 from comfy.ldm.cascade.stage_c import StageC
 from comfy.ldm.cascade.stage_b import StageB
@@ -49,6 +50,7 @@ import comfy.ldm.omnigen.omnigen2
 import comfy.ldm.qwen_image.model
 
 import comfy.model_management
+import comfy.memory_profiler
 import comfy.patcher_extension
 import comfy.conds
 import comfy.ops
@@ -298,7 +300,8 @@ class BaseModel(torch.nn.Module):
                 to_load[k[len(unet_prefix):]] = sd.pop(k)
 
         to_load = self.model_config.process_unet_state_dict(to_load)
-        m, u = self.diffusion_model.load_state_dict(to_load, strict=False)
+        with comfy.disk_offload.disk_offload.loading(self):
+            m, u = self.diffusion_model.load_state_dict(to_load, strict=False)
         if len(m) > 0:
             logging.warning("unet missing: {}".format(m))
 
@@ -352,7 +355,7 @@ class BaseModel(torch.nn.Module):
     def scale_latent_inpaint(self, sigma, noise, latent_image, **kwargs):
         return self.model_sampling.noise_scaling(sigma.reshape([sigma.shape[0]] + [1] * (len(noise.shape) - 1)), noise, latent_image)
 
-    def memory_required(self, input_shape, cond_shapes={}):
+    def memory_usage_area(self, input_shape, cond_shapes={}):
         input_shapes = [input_shape]
         for c in self.memory_usage_factor_conds:
             shape = cond_shapes.get(c, None)
@@ -366,16 +369,29 @@ class BaseModel(torch.nn.Module):
                 if len(shape) > 0:
                     input_shapes += shape
 
+        return sum(map(lambda input_shape: input_shape[0] * math.prod(input_shape[2:]), input_shapes))
+
+    def memory_profile_key(self):
+        dtype = self.get_dtype()
+        if self.manual_cast_dtype is not None:
+            dtype = self.manual_cast_dtype
+        attention = "flash" if comfy.model_management.xformers_enabled() or comfy.model_management.pytorch_attention_flash_attention() else "split"
+        return "diffusion:{}:{}:{}:{}".format(type(self.model_config).__name__, type(self.diffusion_model).__name__, dtype, attention)
+
+    def memory_required(self, input_shape, cond_shapes={}):
+        area = self.memory_usage_area(input_shape, cond_shapes=cond_shapes)
+        learned = comfy.memory_profiler.memory_profiler.estimate(self.memory_profile_key(), area)
+        if learned is not None:
+            return learned
+
         if comfy.model_management.xformers_enabled() or comfy.model_management.pytorch_attention_flash_attention():
             dtype = self.get_dtype()
             if self.manual_cast_dtype is not None:
                 dtype = self.manual_cast_dtype
             #TODO: this needs to be tweaked
-            area = sum(map(lambda input_shape: input_shape[0] * math.prod(input_shape[2:]), input_shapes))
             return (area * comfy.model_management.dtype_size(dtype) * 0.01 * self.memory_usage_factor) * (1024 * 1024)
         else:
             #TODO: this formula might be too aggressive since I tweaked the sub-quad and split algorithms to use less memory.
-            area = sum(map(lambda input_shape: input_shape[0] * math.prod(input_shape[2:]), input_shapes))
             return (area * 0.15 * self.memory_usage_factor) * (1024 * 1024)
 
     def extra_conds_shapes(self, **kwargs):
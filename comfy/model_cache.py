@@ -0,0 +1,167 @@
+import collections
+import logging
+import os
+import threading
+
+
+def file_key(path):
+    """Identifies the version of a model file on disk."""
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def options_key(value):
+    """Turns loader options into something hashable, dicts are compared by their items."""
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), options_key(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(options_key(v) for v in value)
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+
+def device_key():
+    """The device the current thread loads models to, prompt workers can each use a different one."""
+    import comfy.model_management  # imports torch, the rest of this module doesn't need it
+    return str(comfy.model_management.get_torch_device())
+
+
+def object_size(obj):
+    """Bytes of weights held by a loaded ModelPatcher, CLIP, VAE or CLIP vision model."""
+    if obj is None:
+        return 0
+    if isinstance(obj, (list, tuple)):
+        return sum(object_size(o) for o in obj)
+    if hasattr(obj, "model_size"):
+        return obj.model_size()
+    patcher = getattr(obj, "patcher", None)
+    if patcher is not None:
+        return patcher.model_size()
+    return 0
+
+
+def clone_object(obj):
+    """ModelPatchers and CLIPs are cloned so the patches added by one user don't leak into the cached copy."""
+    if isinstance(obj, tuple):
+        return tuple(clone_object(o) for o in obj)
+    if isinstance(obj, list):
+        return [clone_object(o) for o in obj]
+    if obj is not None and hasattr(obj, "clone"):
+        return obj.clone()
+    return obj
+
+
+def object_patchers(obj):
+    """ModelPatchers of a loaded ModelPatcher, CLIP, VAE or CLIP vision model, or of a list of them."""
+    if obj is None:
+        return []
+    if isinstance(obj, (list, tuple)):
+        return [p for o in obj for p in object_patchers(o)]
+    if hasattr(obj, "model_files"):
+        return [obj]
+    patcher = getattr(obj, "patcher", None)
+    if patcher is not None:
+        return object_patchers(patcher)
+    return []
+
+
+def set_model_files(obj, paths):
+    """Stores the paths of the files a loaded object comes from on its ModelPatchers."""
+    for patcher in object_patchers(obj):
+        patcher.model_files = tuple(os.path.abspath(p) for p in paths)
+
+
+def share_weights(obj, key):
+    """Moves the weights of a loaded object to the shared weights files when they are enabled."""
+    patchers = object_patchers(obj)
+    if len(patchers) == 0:
+        return
+    import comfy.shared_weights  # imports torch, the rest of this module doesn't need it
+    for i, patcher in enumerate(patchers):
+        comfy.shared_weights.shared_weights.share(patcher.model, (key, i))
+
+
+class ModelFileCache:
+    """
+    Keeps the models loaded from files in RAM, so loading the same file with the same options again skips
+    reading it from disk and detecting the model type. Entries are keyed by the path, modification time and
+    size of the files, the loader options and the device of the current thread, since the loaded objects are
+    set up for that device. The least recently used entries are dropped when their total size is above the budget.
+    """
+    def __init__(self, budget=0):
+        self.budget = budget
+        self.entries = collections.OrderedDict()
+        self.sizes = {}
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def set_budget(self, budget):
+        with self.lock:
+            self.budget = budget
+            self._evict()
+
+    def enabled(self):
+        return self.budget > 0
+
+    def load(self, kind, paths, options, load_function):
+        """Returns load_function() or a clone of the result of a previous call with the same files and options."""
+        files_key = (kind, tuple(file_key(p) for p in paths), options_key(options))
+        if not self.enabled():
+            out = load_function()
+            set_model_files(out, paths)
+            share_weights(out, files_key)
+            return out
+
+        key = files_key + (device_key(),)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return clone_object(self.entries[key])
+            self.misses += 1
+
+        out = load_function()
+        set_model_files(out, paths)
+        share_weights(out, files_key)
+        size = object_size(out)
+        if size > self.budget:
+            logging.debug("Not caching {} model {}, {:.2f} MB is over the RAM cache budget".format(kind, paths, size / (1024 * 1024)))
+            return out
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = out
+                self.sizes[key] = size
+                self.resident_bytes += size
+            self._evict()
+            logging.debug("Model RAM cache: {} entries, {:.2f} MB resident".format(len(self.entries), self.resident_bytes / (1024 * 1024)))
+        return clone_object(out)
+
+    def _evict(self):
+        while self.resident_bytes > self.budget and len(self.entries) > 0:
+            key, _ = self.entries.popitem(last=False)
+            self.resident_bytes -= self.sizes.pop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.resident_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "resident_bytes": self.resident_bytes,
+                "budget_bytes": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+model_file_cache = ModelFileCache()
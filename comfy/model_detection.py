@@ -1,4 +1,6 @@
 import json
+import copy
+import comfy.detection_cache
 import comfy.supported_models
 import comfy.supported_models_base
 import comfy.utils
@@ -35,6 +37,7 @@ def calculate_transformer_depth(prefix, state_dict_keys, state_dict):
     return None
 
 def detect_unet_config(state_dict, key_prefix, metadata=None):
+    state_dict = comfy.utils.state_dict_info(state_dict) # Only the shapes are used, don't read the tensors of lazy state dicts
     state_dict_keys = list(state_dict.keys())
 
     if '{}joint_blocks.0.context_block.attn.qkv.weight'.format(key_prefix) in state_dict_keys: #mmdit model
@@ -682,11 +685,31 @@ def model_config_from_unet_config(unet_config, state_dict=None):
     logging.error("no match {}".format(unet_config))
     return None
 
+def model_config_from_name(model_name, unet_config):
+    for model_config in comfy.supported_models.models:
+        if model_config.__name__ == model_name:
+            return model_config(unet_config)
+    return None
+
 def model_config_from_unet(state_dict, unet_key_prefix, use_base_if_no_match=False, metadata=None):
-    unet_config = detect_unet_config(state_dict, unet_key_prefix, metadata=metadata)
-    if unet_config is None:
-        return None
-    model_config = model_config_from_unet_config(unet_config, state_dict)
+    cache_key = None
+    cached = None
+    if comfy.detection_cache.detection_cache.enabled():
+        cache_key = comfy.detection_cache.state_dict_fingerprint(state_dict, unet_key_prefix, metadata)
+        cached = comfy.detection_cache.detection_cache.get(cache_key)
+    if cached is not None:
+        unet_config, model_name = cached
+        logging.debug("Using cached model detection result: {}".format(model_name))
+        model_config = model_config_from_name(model_name, unet_config)
+    else:
+        unet_config = detect_unet_config(state_dict, unet_key_prefix, metadata=metadata)
+        if unet_config is None:
+            return None
+        detected_config = copy.deepcopy(unet_config)
+        model_config = model_config_from_unet_config(unet_config, state_dict)
+        if cache_key is not None:
+            comfy.detection_cache.detection_cache.put(cache_key, (detected_config, type(model_config).__name__ if model_config is not None else None))
+
     if model_config is None and use_base_if_no_match:
         model_config = comfy.supported_models_base.BASE(unet_config)
 
@@ -761,6 +784,7 @@ def convert_config(unet_config):
 
 
 def unet_config_from_diffusers_unet(state_dict, dtype=None):
+    state_dict = comfy.utils.state_dict_info(state_dict)
     if "conv_in.weight" not in state_dict:
         return None
 
@@ -26,6 +26,8 @@ import importlib
 import platform
 import weakref
 import gc
+import threading
+import comfy.eviction
 
 class VRAMState(Enum):
     DISABLED = 0    #No vram present: no need to move models to vram
@@ -186,6 +188,30 @@ def get_torch_device():
         else:
             return torch.device(torch.cuda.current_device())
 
+def set_torch_device_for_thread(device_index):
+    # The current device is per thread so this lets each prompt worker thread use its own device.
+    if directml_enabled or cpu_state != CPUState.GPU:
+        return
+    if is_intel_xpu():
+        torch.xpu.set_device(device_index)
+    elif is_ascend_npu():
+        torch.npu.set_device(device_index)
+    elif is_mlu():
+        torch.mlu.set_device(device_index)
+    else:
+        torch.cuda.set_device(device_index)
+
+def get_torch_device_count():
+    if directml_enabled or cpu_state != CPUState.GPU:
+        return 1
+    if is_intel_xpu():
+        return torch.xpu.device_count()
+    elif is_ascend_npu():
+        return torch.npu.device_count()
+    elif is_mlu():
+        return torch.mlu.device_count()
+    return torch.cuda.device_count()
+
 def get_total_memory(dev=None, torch_total_too=False):
     global directml_enabled
     if dev is None:
@@ -436,6 +462,24 @@ except:
 
 
 current_loaded_models = []
+# Guards current_loaded_models when several prompt workers load models at the same time
+current_loaded_models_lock = threading.RLock()
+# The models each prompt worker thread is using: the ones of its last load_models_gpu call, until it loads other
+# models or calls release_models_in_use(). Workers sharing a device don't unload or detach the models of the others.
+models_in_use = {}
+models_in_use_changed = threading.Condition(current_loaded_models_lock)
+
+def used_by_other_thread(loaded_model):
+    thread_id = threading.get_ident()
+    for other_id, models in models_in_use.items():
+        if other_id != thread_id and any(loaded_model is m for m in models):
+            return True
+    return False
+
+def release_models_in_use():
+    with models_in_use_changed:
+        if models_in_use.pop(threading.get_ident(), None) is not None:
+            models_in_use_changed.notify_all()
 
 def module_size(module):
     module_mem = 0
@@ -567,125 +611,137 @@ def minimum_inference_memory():
     return (1024 * 1024 * 1024) * 0.8 + extra_reserved_memory()
 
 def free_memory(memory_required, device, keep_loaded=[]):
-    cleanup_models_gc()
-    unloaded_model = []
-    can_unload = []
-    unloaded_models = []
-
-    for i in range(len(current_loaded_models) -1, -1, -1):
-        shift_model = current_loaded_models[i]
-        if shift_model.device == device:
-            if shift_model not in keep_loaded and not shift_model.is_dead():
-                can_unload.append((-shift_model.model_offloaded_memory(), sys.getrefcount(shift_model.model), shift_model.model_memory(), i))
-                shift_model.currently_used = False
-
-    for x in sorted(can_unload):
-        i = x[-1]
-        memory_to_free = None
-        if not DISABLE_SMART_MEMORY:
-            free_mem = get_free_memory(device)
-            if free_mem > memory_required:
-                break
-            memory_to_free = memory_required - free_mem
-        logging.debug(f"Unloading {current_loaded_models[i].model.model.__class__.__name__}")
-        if current_loaded_models[i].model_unload(memory_to_free):
-            unloaded_model.append(i)
-
-    for i in sorted(unloaded_model, reverse=True):
-        unloaded_models.append(current_loaded_models.pop(i))
-
-    if len(unloaded_model) > 0:
-        soft_empty_cache()
-    else:
-        if vram_state != VRAMState.HIGH_VRAM:
-            mem_free_total, mem_free_torch = get_free_memory(device, torch_free_too=True)
-            if mem_free_torch > mem_free_total * 0.25:
-                soft_empty_cache()
-    return unloaded_models
+    with current_loaded_models_lock:
+        cleanup_models_gc()
+        unloaded_model = []
+        can_unload = []
+        unloaded_models = []
+
+        for i in range(len(current_loaded_models) -1, -1, -1):
+            shift_model = current_loaded_models[i]
+            if shift_model.device == device:
+                if shift_model not in keep_loaded and not shift_model.is_dead() and not used_by_other_thread(shift_model):
+                    can_unload.append(comfy.eviction.EvictionCandidate(i, shift_model.model_memory(), shift_model.model_loaded_memory(), sys.getrefcount(shift_model.model), getattr(shift_model.model, "model_files", ())))
+                    shift_model.currently_used = False
+
+        for x in comfy.eviction.order_candidates(can_unload):
+            i = x.index
+            memory_to_free = None
+            if not DISABLE_SMART_MEMORY:
+                free_mem = get_free_memory(device)
+                if free_mem > memory_required:
+                    break
+                memory_to_free = memory_required - free_mem
+            logging.debug(f"Unloading {current_loaded_models[i].model.model.__class__.__name__}")
+            if current_loaded_models[i].model_unload(memory_to_free):
+                unloaded_model.append(i)
+
+        for i in sorted(unloaded_model, reverse=True):
+            unloaded_models.append(current_loaded_models.pop(i))
+
+        if len(unloaded_model) > 0:
+            soft_empty_cache()
+        else:
+            if vram_state != VRAMState.HIGH_VRAM:
+                mem_free_total, mem_free_torch = get_free_memory(device, torch_free_too=True)
+                if mem_free_torch > mem_free_total * 0.25:
+                    soft_empty_cache()
+        return unloaded_models
 
 def load_models_gpu(models, memory_required=0, force_patch_weights=False, minimum_memory_required=None, force_full_load=False):
-    cleanup_models_gc()
     global vram_state
+    with current_loaded_models_lock:
+        # This thread isn't running its previous models while it loads new ones, so others can have them while it waits
+        release_models_in_use()
+        cleanup_models_gc()
+
+        inference_memory = minimum_inference_memory()
+        extra_mem = max(inference_memory, memory_required + extra_reserved_memory())
+        if minimum_memory_required is None:
+            minimum_memory_required = extra_mem
+        else:
+            minimum_memory_required = max(inference_memory, minimum_memory_required + extra_reserved_memory())
 
-    inference_memory = minimum_inference_memory()
-    extra_mem = max(inference_memory, memory_required + extra_reserved_memory())
-    if minimum_memory_required is None:
-        minimum_memory_required = extra_mem
-    else:
-        minimum_memory_required = max(inference_memory, minimum_memory_required + extra_reserved_memory())
-
-    models_temp = set()
-    for m in models:
-        models_temp.add(m)
-        for mm in m.model_patches_models():
-            models_temp.add(mm)
-
-    models = models_temp
+        models_temp = set()
+        for m in models:
+            models_temp.add(m)
+            for mm in m.model_patches_models():
+                models_temp.add(mm)
 
-    models_to_load = []
+        models = models_temp
 
-    for x in models:
-        loaded_model = LoadedModel(x)
-        try:
-            loaded_model_index = current_loaded_models.index(loaded_model)
-        except:
-            loaded_model_index = None
+        models_to_load = []
 
-        if loaded_model_index is not None:
-            loaded = current_loaded_models[loaded_model_index]
-            loaded.currently_used = True
-            models_to_load.append(loaded)
-        else:
-            if hasattr(x, "model"):
-                logging.info(f"Requested to load {x.model.__class__.__name__}")
-            models_to_load.append(loaded_model)
+        for x in models:
+            loaded_model = LoadedModel(x)
+            try:
+                loaded_model_index = current_loaded_models.index(loaded_model)
+            except:
+                loaded_model_index = None
 
-    for loaded_model in models_to_load:
-        to_unload = []
-        for i in range(len(current_loaded_models)):
-            if loaded_model.model.is_clone(current_loaded_models[i].model):
-                to_unload = [i] + to_unload
-        for i in to_unload:
-            model_to_unload = current_loaded_models.pop(i)
-            model_to_unload.model.detach(unpatch_all=False)
-            model_to_unload.model_finalizer.detach()
-
-    total_memory_required = {}
-    for loaded_model in models_to_load:
-        total_memory_required[loaded_model.device] = total_memory_required.get(loaded_model.device, 0) + loaded_model.model_memory_required(loaded_model.device)
-
-    for device in total_memory_required:
-        if device != torch.device("cpu"):
-            free_memory(total_memory_required[device] * 1.1 + extra_mem, device)
-
-    for device in total_memory_required:
-        if device != torch.device("cpu"):
-            free_mem = get_free_memory(device)
-            if free_mem < minimum_memory_required:
-                models_l = free_memory(minimum_memory_required, device)
-                logging.info("{} models unloaded.".format(len(models_l)))
-
-    for loaded_model in models_to_load:
-        model = loaded_model.model
-        torch_dev = model.load_device
-        if is_device_cpu(torch_dev):
-            vram_set_state = VRAMState.DISABLED
-        else:
-            vram_set_state = vram_state
-        lowvram_model_memory = 0
-        if lowvram_available and (vram_set_state == VRAMState.LOW_VRAM or vram_set_state == VRAMState.NORMAL_VRAM) and not force_full_load:
-            loaded_memory = loaded_model.model_loaded_memory()
-            current_free_mem = get_free_memory(torch_dev) + loaded_memory
+            if loaded_model_index is not None:
+                loaded = current_loaded_models[loaded_model_index]
+                loaded.currently_used = True
+                models_to_load.append(loaded)
+            else:
+                if hasattr(x, "model"):
+                    logging.info(f"Requested to load {x.model.__class__.__name__}")
+                models_to_load.append(loaded_model)
+
+        # Wait until no other worker is using a clone of the models, the clones get detached
+        while any(x.model.is_clone(m.model) and used_by_other_thread(m) for x in models_to_load for m in current_loaded_models):
+            models_in_use_changed.wait()
+
+        for loaded_model in models_to_load:
+            to_unload = []
+            for i in range(len(current_loaded_models)):
+                if loaded_model.model.is_clone(current_loaded_models[i].model):
+                    to_unload = [i] + to_unload
+            for i in to_unload:
+                model_to_unload = current_loaded_models.pop(i)
+                model_to_unload.model.detach(unpatch_all=False)
+                model_to_unload.model_finalizer.detach()
+
+        if comfy.eviction.load_recorder.enabled():
+            comfy.eviction.load_recorder.record([(id(m.model.model), m.model_memory(), getattr(m.model, "model_files", ())) for m in models_to_load], memory_required, get_total_memory(get_torch_device()), comfy.eviction.upcoming_model_files())
+
+        total_memory_required = {}
+        for loaded_model in models_to_load:
+            total_memory_required[loaded_model.device] = total_memory_required.get(loaded_model.device, 0) + loaded_model.model_memory_required(loaded_model.device)
+
+        for device in total_memory_required:
+            if device != torch.device("cpu"):
+                free_memory(total_memory_required[device] * 1.1 + extra_mem, device)
+
+        for device in total_memory_required:
+            if device != torch.device("cpu"):
+                free_mem = get_free_memory(device)
+                if free_mem < minimum_memory_required:
+                    models_l = free_memory(minimum_memory_required, device)
+                    logging.info("{} models unloaded.".format(len(models_l)))
+
+        for loaded_model in models_to_load:
+            model = loaded_model.model
+            torch_dev = model.load_device
+            if is_device_cpu(torch_dev):
+                vram_set_state = VRAMState.DISABLED
+            else:
+                vram_set_state = vram_state
+            lowvram_model_memory = 0
+            if lowvram_available and (vram_set_state == VRAMState.LOW_VRAM or vram_set_state == VRAMState.NORMAL_VRAM) and not force_full_load:
+                loaded_memory = loaded_model.model_loaded_memory()
+                current_free_mem = get_free_memory(torch_dev) + loaded_memory
 
-            lowvram_model_memory = max(128 * 1024 * 1024, (current_free_mem - minimum_memory_required), min(current_free_mem * MIN_WEIGHT_MEMORY_RATIO, current_free_mem - minimum_inference_memory()))
-            lowvram_model_memory = max(0.1, lowvram_model_memory - loaded_memory)
+                lowvram_model_memory = max(128 * 1024 * 1024, (current_free_mem - minimum_memory_required), min(current_free_mem * MIN_WEIGHT_MEMORY_RATIO, current_free_mem - minimum_inference_memory()))
+                lowvram_model_memory = max(0.1, lowvram_model_memory - loaded_memory)
 
-        if vram_set_state == VRAMState.NO_VRAM:
-            lowvram_model_memory = 0.1
+            if vram_set_state == VRAMState.NO_VRAM:
+                lowvram_model_memory = 0.1
 
-        loaded_model.model_load(lowvram_model_memory, force_patch_weights=force_patch_weights)
-        current_loaded_models.insert(0, loaded_model)
-    return
+            loaded_model.model_load(lowvram_model_memory, force_patch_weights=force_patch_weights)
+            current_loaded_models.insert(0, loaded_model)
+        models_in_use[threading.get_ident()] = models_to_load
+        return
 
 def load_model_gpu(model):
     return load_models_gpu([model])
@@ -722,14 +778,15 @@ def cleanup_models_gc():
 
 
 def cleanup_models():
-    to_delete = []
-    for i in range(len(current_loaded_models)):
-        if current_loaded_models[i].real_model() is None:
-            to_delete = [i] + to_delete
+    with current_loaded_models_lock:
+        to_delete = []
+        for i in range(len(current_loaded_models)):
+            if current_loaded_models[i].real_model() is None:
+                to_delete = [i] + to_delete
 
-    for i in to_delete:
-        x = current_loaded_models.pop(i)
-        del x
+        for i in to_delete:
+            x = current_loaded_models.pop(i)
+            del x
 
 def dtype_size(dtype):
     dtype_size = 4
@@ -1044,6 +1101,44 @@ def get_offload_stream(device):
         return s
     return None
 
+# Keyed by (thread ident, device): prompt workers sharing a device each have their own buffers and module order
+PREFETCH_SCHEDULERS = {}
+def get_prefetch_scheduler(device):
+    """
+    The comfy.prefetch.PrefetchScheduler used by lowvram modules on device in the current thread, None if
+    prefetching is disabled.
+    """
+    if args.prefetch_modules <= 0:
+        return None
+    key = (threading.get_ident(), device)
+    if key in PREFETCH_SCHEDULERS:
+        return PREFETCH_SCHEDULERS[key]
+    if is_device_cuda(device):
+        stream = torch.cuda.Stream(device=device, priority=0)
+        current_stream = torch.cuda.current_stream
+    elif is_device_xpu(device):
+        stream = torch.xpu.Stream(device=device, priority=0)
+        current_stream = torch.xpu.current_stream
+    else:
+        return None
+
+    import comfy.prefetch
+    def begin_copy(pairs):
+        # The buffers might have been used by the compute that was already enqueued
+        stream.wait_stream(current_stream(device))
+        with stream:
+            for src, dst in pairs:
+                dst.copy_(src, non_blocking=True)
+            return stream.record_event()
+
+    def wait_copy(event):
+        if event is not None:
+            current_stream(device).wait_event(event)
+
+    scheduler = comfy.prefetch.PrefetchScheduler(begin_copy, wait_copy, depth=args.prefetch_modules)
+    PREFETCH_SCHEDULERS[key] = scheduler
+    return scheduler
+
 def sync_stream(device, stream):
     if stream is None:
         return
@@ -1191,6 +1286,27 @@ def get_free_memory(dev=None, torch_free_too=False):
     else:
         return mem_free_total
 
+def memory_allocated(dev):
+    """Memory allocated by torch on dev, None when it can't be measured."""
+    if is_device_cuda(dev):
+        return torch.cuda.memory_allocated(dev)
+    elif is_device_xpu(dev):
+        return torch.xpu.memory_allocated(dev)
+    return None
+
+def reset_peak_memory(dev):
+    if is_device_cuda(dev):
+        torch.cuda.reset_peak_memory_stats(dev)
+    elif is_device_xpu(dev):
+        torch.xpu.reset_peak_memory_stats(dev)
+
+def peak_memory_allocated(dev):
+    if is_device_cuda(dev):
+        return torch.cuda.max_memory_allocated(dev)
+    elif is_device_xpu(dev):
+        return torch.xpu.max_memory_allocated(dev)
+    return None
+
 def cpu_mode():
     global cpu_state
     return cpu_state == CPUState.CPU
@@ -1383,6 +1499,8 @@ def extended_fp16_support():
 
 def soft_empty_cache(force=False):
     global cpu_state
+    for scheduler in list(PREFETCH_SCHEDULERS.values()):
+        scheduler.clear()
     if cpu_state == CPUState.MPS:
         torch.mps.empty_cache()
     elif is_intel_xpu():
@@ -1400,25 +1518,41 @@ def unload_all_models():
 
 
 #TODO: might be cleaner to put this somewhere else
-import threading
-
 class InterruptProcessingException(Exception):
     pass
 
 interrupt_processing_mutex = threading.RLock()
 
 interrupt_processing = False
-def interrupt_current_processing(value=True):
+# Idents of the prompt worker threads that should be interrupted, used when several prompts run at the same time
+interrupt_processing_threads = set()
+# Background threads running a node for a prompt worker use the interrupt of that worker
+interrupt_thread = threading.local()
+
+def get_interrupt_thread_id():
+    return getattr(interrupt_thread, "thread_id", None) or threading.get_ident()
+
+def set_interrupt_thread_id(thread_id):
+    interrupt_thread.thread_id = thread_id
+
+def interrupt_current_processing(value=True, thread_id=None):
     global interrupt_processing
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
-        interrupt_processing = value
+        if thread_id is None:
+            interrupt_processing = value
+            if not value:
+                interrupt_processing_threads.discard(get_interrupt_thread_id())
+        elif value:
+            interrupt_processing_threads.add(thread_id)
+        else:
+            interrupt_processing_threads.discard(thread_id)
 
 def processing_interrupted():
     global interrupt_processing
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
-        return interrupt_processing
+        return interrupt_processing or get_interrupt_thread_id() in interrupt_processing_threads
 
 def throw_exception_if_processing_interrupted():
     global interrupt_processing
@@ -1427,3 +1561,7 @@ def throw_exception_if_processing_interrupted():
         if interrupt_processing:
             interrupt_processing = False
             raise InterruptProcessingException()
+        thread_id = get_interrupt_thread_id()
+        if thread_id in interrupt_processing_threads:
+            interrupt_processing_threads.discard(thread_id)
+            raise InterruptProcessingException()
@@ -28,6 +28,9 @@ from typing import Callable, Optional
 
 import torch
 
+import comfy.baked_patches
+import comfy.disk_offload
+import comfy.shared_weights
 import comfy.float
 import comfy.hooks
 import comfy.lora
@@ -215,6 +218,9 @@ class MemoryCounter:
     def decrement(self, used: int):
         self.value -= used
 
+# Maximum size of the float32 LoRA products calculated at the same time by ModelPatcher.patch_weights_to_device
+PATCH_BATCH_BYTES = 256 * 1024 * 1024
+
 class ModelPatcher:
     def __init__(self, model, load_device, offload_device, size=0, weight_inplace_update=False):
         self.size = size
@@ -237,6 +243,12 @@ class ModelPatcher:
         self.weight_inplace_update = weight_inplace_update
         self.force_cast_weights = False
         self.patches_uuid = uuid.uuid4()
+        # Description of the base weights and the patches added to them (files and strengths), used as the key of
+        # the baked patch cache. None when unknown.
+        self.patches_source = None
+        self.baked_patches_key = None
+        # Absolute paths of the files the model was loaded from, used to know which queued prompts need it
+        self.model_files = ()
         self.parent = None
 
         self.attachments: dict[str] = {}
@@ -269,6 +281,8 @@ class ModelPatcher:
         if not hasattr(self.model, 'current_weight_patches_uuid'):
             self.model.current_weight_patches_uuid = None
 
+        comfy.disk_offload.disk_offload.register(self.model)
+
     def model_size(self):
         if self.size > 0:
             return self.size
@@ -287,6 +301,8 @@ class ModelPatcher:
         for k in self.patches:
             n.patches[k] = self.patches[k][:]
         n.patches_uuid = self.patches_uuid
+        n.patches_source = self.patches_source
+        n.model_files = self.model_files
 
         n.object_patches = self.object_patches.copy()
         n.weight_wrapper_patches = self.weight_wrapper_patches.copy()
@@ -534,8 +550,14 @@ class ModelPatcher:
         if hasattr(self.model, "get_dtype"):
             return self.model.get_dtype()
 
-    def add_patches(self, patches, strength_patch=1.0, strength_model=1.0):
+    def add_patches(self, patches, strength_patch=1.0, strength_model=1.0, source=None):
         with self.use_ejected():
+            if self.patches_source is not None:
+                if source is None:
+                    self.patches_source = None
+                else:
+                    self.patches_source = self.patches_source + [(source, strength_patch, strength_model)]
+
             p = set()
             model_sd = self.model.state_dict()
             for k in patches:
@@ -591,9 +613,11 @@ class ModelPatcher:
                         sd.pop(k)
             return sd
 
-    def patch_weight_to_device(self, key, device_to=None, inplace_update=False):
+    def patch_weight_to_device(self, key, device_to=None, inplace_update=False, patches=None):
         if key not in self.patches:
             return
+        if patches is None:
+            patches = self.patches[key]
 
         weight, set_func, convert_func = get_key_weight(self.model, key)
         inplace_update = self.weight_inplace_update or inplace_update
@@ -601,6 +625,17 @@ class ModelPatcher:
         if key not in self.backup:
             self.backup[key] = collections.namedtuple('Dimension', ['weight', 'inplace_update'])(weight.to(device=self.offload_device, copy=inplace_update), inplace_update)
 
+        bake = set_func is None and convert_func is None and self.baked_patches_key is not None
+        if bake:
+            baked_weight = self.get_baked_weight(key, weight)
+            if baked_weight is not None:
+                out_weight = baked_weight.to(device=device_to if device_to is not None else weight.device)
+                if inplace_update:
+                    comfy.utils.copy_to_param(self.model, key, out_weight)
+                else:
+                    comfy.utils.set_attr_param(self.model, key, out_weight)
+                return
+
         if device_to is not None:
             temp_weight = comfy.model_management.cast_to_device(weight, device_to, torch.float32, copy=True)
         else:
@@ -608,9 +643,11 @@ class ModelPatcher:
         if convert_func is not None:
             temp_weight = convert_func(temp_weight, inplace=True)
 
-        out_weight = comfy.lora.calculate_weight(self.patches[key], temp_weight, key)
+        out_weight = comfy.lora.calculate_weight(patches, temp_weight, key)
         if set_func is None:
             out_weight = comfy.float.stochastic_rounding(out_weight, weight.dtype, seed=string_to_seed(key))
+            if bake:
+                self.new_baked_patches[key] = out_weight.to("cpu", copy=True)
             if inplace_update:
                 comfy.utils.copy_to_param(self.model, key, out_weight)
             else:
@@ -618,6 +655,69 @@ class ModelPatcher:
         else:
             set_func(out_weight, inplace_update=inplace_update, seed=string_to_seed(key))
 
+    def patch_weights_to_device(self, keys, device_to=None):
+        """patch_weight_to_device for many keys, the plain LoRA patches are calculated in batches of keys."""
+        batch = []
+        batch_size = 0
+        for key in keys:
+            if key not in self.patches:
+                continue
+            batch.append(key)
+            batch_size += get_key_weight(self.model, key)[0].nelement() * 4
+            if batch_size >= PATCH_BATCH_BYTES:
+                self._patch_weight_batch(batch, device_to)
+                batch = []
+                batch_size = 0
+        self._patch_weight_batch(batch, device_to)
+
+    def _patch_weight_batch(self, keys, device_to):
+        key_patches = {}
+        weight_shapes = {}
+        device = device_to
+        for key in keys:
+            weight, set_func, convert_func = get_key_weight(self.model, key)
+            if set_func is not None or convert_func is not None:
+                continue
+            if self.baked_patches_key is not None and self.get_baked_weight(key, weight) is not None:
+                continue
+            if device is None:
+                device = weight.device
+            key_patches[key] = self.patches[key]
+            weight_shapes[key] = weight.shape
+
+        batched = {}
+        if len(key_patches) > 1:
+            batched = comfy.lora.batch_lora_patches(key_patches, weight_shapes, device)
+        for key in keys:
+            self.patch_weight_to_device(key, device_to=device_to, patches=batched.pop(key, None))
+
+    def open_baked_patches(self):
+        self.baked_patches_key = None
+        if not comfy.baked_patches.baked_patch_cache.enabled() or self.patches_source is None or len(self.patches) == 0:
+            return
+        self.baked_patches_key = comfy.baked_patches.patches_key(self.patches_source, self.patches)
+        self.baked_patches = comfy.baked_patches.baked_patch_cache.open(self.baked_patches_key)
+        self.new_baked_patches = {}
+
+    def get_baked_weight(self, key, weight):
+        if self.baked_patches is None or key not in self.baked_patches:
+            return None
+        info = comfy.utils.state_dict_info(self.baked_patches)[key]
+        if info.shape != weight.shape or info.dtype != weight.dtype:
+            return None
+        return self.baked_patches[key]
+
+    def close_baked_patches(self):
+        if self.baked_patches_key is None:
+            return
+        if len(self.new_baked_patches) > 0:
+            comfy.baked_patches.baked_patch_cache.save(self.baked_patches_key, self.new_baked_patches, existing=self.baked_patches)
+        else:
+            comfy.utils.close_state_dict(self.baked_patches)
+        self.baked_patches_key = None
+        self.baked_patches = None
+        self.new_baked_patches = {}
+
     def _load_list(self):
         loading = []
         for n, m in self.model.named_modules():
@@ -636,6 +736,8 @@ class ModelPatcher:
     def load(self, device_to=None, lowvram_model_memory=0, force_patch_weights=False, full_load=False):
         with self.use_ejected():
             self.unpatch_hooks()
+            self.open_baked_patches()
+            comfy.disk_offload.disk_offload.touch(self.model)
             mem_counter = 0
             patch_counter = 0
             lowvram_counter = 0
@@ -704,6 +806,7 @@ class ModelPatcher:
                 mem_counter += move_weight_functions(m, device_to)
 
             load_completely.sort(reverse=True)
+            patch_keys = []
             for x in load_completely:
                 n = x[1]
                 m = x[2]
@@ -713,11 +816,13 @@ class ModelPatcher:
                         continue
 
                 for param in params:
-                    self.patch_weight_to_device("{}.{}".format(n, param), device_to=device_to)
+                    patch_keys.append("{}.{}".format(n, param))
 
                 logging.debug("lowvram: loaded module regularly {} {}".format(n, m))
                 m.comfy_patched_weights = True
 
+            self.patch_weights_to_device(patch_keys, device_to=device_to)
+
             for x in load_completely:
                 x[2].to(device_to)
 
@@ -735,6 +840,7 @@ class ModelPatcher:
             self.model.device = device_to
             self.model.model_loaded_weight_memory = mem_counter
             self.model.current_weight_patches_uuid = self.patches_uuid
+            self.close_baked_patches()
 
             for callback in self.get_all_callbacks(CallbacksMP.ON_LOAD):
                 callback(self, device_to, lowvram_model_memory, force_patch_weights, full_load)
@@ -785,6 +891,8 @@ class ModelPatcher:
             if device_to is not None:
                 self.model.to(device_to)
                 self.model.device = device_to
+                comfy.shared_weights.shared_weights.attach(self.model, changed=set(keys))
+                comfy.disk_offload.disk_offload.enforce_budget()
             self.model.model_loaded_weight_memory = 0
 
             for m in self.model.modules():
@@ -802,6 +910,7 @@ class ModelPatcher:
             hooks_unpatched = False
             memory_freed = 0
             patch_counter = 0
+            restored_keys = set()
             unload_list = self._load_list()
             unload_list.sort()
             for unload in unload_list:
@@ -832,6 +941,7 @@ class ModelPatcher:
                             else:
                                 comfy.utils.set_attr_param(self.model, key, bk.weight)
                             self.backup.pop(key)
+                            restored_keys.add(key)
 
                     weight_key = "{}.weight".format(n)
                     bias_key = "{}.bias".format(n)
@@ -860,6 +970,9 @@ class ModelPatcher:
             self.model.model_lowvram = True
             self.model.lowvram_patch_counter += patch_counter
             self.model.model_loaded_weight_memory -= memory_freed
+            if memory_freed > 0:
+                comfy.shared_weights.shared_weights.attach(self.model, changed=restored_keys)
+                comfy.disk_offload.disk_offload.enforce_budget()
             return memory_freed
 
     def partially_load(self, device_to, extra_memory=0, force_patch_weights=False):
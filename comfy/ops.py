@@ -79,6 +79,11 @@ def cast_bias_weight(s, input=None, dtype=None, device=None, bias_dtype=None):
         if device is None:
             device = input.device
 
+    if len(s.weight_function) == 0 and len(s.bias_function) == 0:
+        prefetch_scheduler = comfy.model_management.get_prefetch_scheduler(device)
+        if prefetch_scheduler is not None:
+            return prefetch_scheduler.cast(s, dtype, device, bias_dtype)
+
     offload_stream = comfy.model_management.get_offload_stream(device)
     if offload_stream is not None:
         wf_context = offload_stream
@@ -0,0 +1,149 @@
+import threading
+import weakref
+
+import torch
+
+
+class PrefetchedCast:
+    def __init__(self, args, sources, tensors, handle, buffers):
+        self.args = args
+        self.sources = sources
+        self.versions = tuple(t._version if t is not None else None for t in sources)
+        self.tensors = tensors
+        self.handle = handle
+        self.buffers = buffers
+
+    def is_valid(self, args, sources):
+        if args != self.args:
+            return False
+        for a, b, version in zip(sources, self.sources, self.versions):
+            if a is not b:
+                return False
+            if a is not None and a._version != version:
+                return False
+        return True
+
+
+class PrefetchScheduler:
+    """
+    Casts the weights of lowvram modules to the compute device ahead of time. The order modules are used in is
+    learned while running (each module remembers the module used after it last time), and every time a module
+    gets its weights the casts of the next depth modules are started so the copies overlap with the compute of
+    the current module. The destination tensors come from a pool of buffers that are reused once the module they
+    were given to is done with them.
+
+    The copies are done by the copy engine which makes this independent of the device:
+      begin_copy(pairs) starts copying each (source, destination) pair and returns a handle.
+      wait_copy(handle) makes the destinations safe to use by the compute that follows.
+    """
+    def __init__(self, begin_copy, wait_copy, depth=2, max_buffers=16):
+        self.begin_copy = begin_copy
+        self.wait_copy = wait_copy
+        self.depth = depth
+        self.max_buffers = max_buffers
+        self.successors = weakref.WeakKeyDictionary()
+        self.cast_args = weakref.WeakKeyDictionary()
+        self.pending = weakref.WeakKeyDictionary()
+        self.in_use = []
+        self.pool = {}
+        self.pool_size = 0
+        self.last = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    def _get_buffer(self, shape, dtype, device):
+        buffers = self.pool.get((shape, dtype, device), None)
+        if buffers:
+            self.pool_size -= 1
+            return buffers.pop()
+        return torch.empty(shape, dtype=dtype, device=device)
+
+    def _release(self, cast):
+        for b in cast.buffers:
+            if self.pool_size >= self.max_buffers:
+                break
+            self.pool.setdefault((b.shape, b.dtype, b.device), []).append(b)
+            self.pool_size += 1
+        cast.buffers = []
+
+    def _start(self, module, args):
+        dtype, device, bias_dtype = args
+        sources = (module.weight, getattr(module, "bias", None))
+        pairs = []
+        buffers = []
+        tensors = []
+        for t, d in zip(sources, (dtype, bias_dtype)):
+            if t is None:
+                tensors.append(None)
+                continue
+            if d is None:
+                d = t.dtype
+            if t.device == device and t.dtype == d:
+                tensors.append(t)
+                continue
+            b = self._get_buffer(t.shape, d, device)
+            pairs.append((t, b))
+            buffers.append(b)
+            tensors.append(b)
+        handle = self.begin_copy(pairs) if len(pairs) > 0 else None
+        return PrefetchedCast(args, sources, tuple(tensors), handle, buffers)
+
+    def cast(self, module, dtype, device, bias_dtype=None):
+        """Returns (weight, bias) of module cast to dtype and device, the bias to bias_dtype if given, like cast_bias_weight."""
+        if bias_dtype is None:
+            bias_dtype = dtype
+        with self.lock:
+            args = (dtype, device, bias_dtype)
+            self.cast_args[module] = args
+            last = self.last() if self.last is not None else None
+            if last is not None and last is not module:
+                self.successors[last] = weakref.ref(module)
+            self.last = weakref.ref(module)
+
+            # Everything handed out before was already used by the compute enqueued after it
+            for c in self.in_use:
+                self._release(c)
+            self.in_use = []
+
+            cast = self.pending.pop(module, None)
+            if cast is not None and cast.is_valid(args, (module.weight, getattr(module, "bias", None))):
+                self.hits += 1
+            else:
+                if cast is not None:
+                    self.wait_copy(cast.handle)
+                    self._release(cast)
+                self.misses += 1
+                cast = self._start(module, args)
+
+            next_module = module
+            for _ in range(self.depth):
+                ref = self.successors.get(next_module, None)
+                next_module = ref() if ref is not None else None
+                if next_module is None or next_module is module:
+                    break
+                if next_module in self.pending or next_module not in self.cast_args:
+                    continue
+                if len(self.pending) >= self.depth * 2:
+                    # Prefetched modules that weren't used, the order changed
+                    self._drop_pending()
+                self.pending[next_module] = self._start(next_module, self.cast_args[next_module])
+
+            self.wait_copy(cast.handle)
+            self.in_use.append(cast)
+            return cast.tensors
+
+    def _drop_pending(self):
+        for cast in list(self.pending.values()):
+            self.wait_copy(cast.handle)
+            self._release(cast)
+        self.pending = weakref.WeakKeyDictionary()
+
+    def clear(self):
+        """Drops the prefetched casts and the buffer pool, the learned module order is kept."""
+        with self.lock:
+            self._drop_pending()
+            self.in_use = []
+            self.pool = {}
+            self.pool_size = 0
+            self.last = None
@@ -4,12 +4,52 @@ import comfy.samplers
 import comfy.utils
 import numpy as np
 import logging
+from comfy.cli_args import args
 
-def prepare_noise(latent_image, seed, noise_inds=None):
+MASK64 = (1 << 64) - 1
+
+def counter_seed(seed, index):
+    """
+    Seed of the noise of batch item index, mixed from the seed and the index with the splitmix64 finalizer.
+    Item 0 uses the seed itself so a batch of one gets the legacy noise.
+    """
+    if index == 0:
+        return seed
+    z = (seed + index * 0x9E3779B97F4A7C15) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+def prepare_counter_noise(latent_image, seed, noise_inds=None):
+    """
+    Generates the noise of every batch index with its own generator so batch index i doesn't need the noise
+    of the indices before it.
+    """
+    torch.manual_seed(seed)
+    if noise_inds is None:
+        noise_inds = range(latent_image.size(0))
+    shape = [1] + list(latent_image.size())[1:]
+    generated = {}
+    noises = []
+    for i in noise_inds:
+        i = int(i)
+        if i not in generated:
+            generator = torch.Generator(device="cpu").manual_seed(counter_seed(seed, i))
+            generated[i] = torch.randn(shape, dtype=latent_image.dtype, layout=latent_image.layout, generator=generator, device="cpu")
+        noises.append(generated[i])
+    return torch.cat(noises, axis=0)
+
+def prepare_noise(latent_image, seed, noise_inds=None, seeding=None):
     """
     creates random noise given a latent image and a seed.
     optional arg skip can be used to skip and discard x number of noise generations for a given seed
+    seeding is "legacy" or "counter" (see --noise-seeding), it defaults to the command line option
     """
+    if seeding is None:
+        seeding = args.noise_seeding
+    if seeding == "counter":
+        return prepare_counter_noise(latent_image, seed, noise_inds)
+
     generator = torch.manual_seed(seed)
     if noise_inds is None:
         return torch.randn(latent_image.size(), dtype=latent_image.dtype, layout=latent_image.layout, generator=generator, device="cpu")
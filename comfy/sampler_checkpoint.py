@@ -0,0 +1,245 @@
+import contextlib
+import hashlib
+import logging
+import os
+import threading
+import uuid
+
+import torch
+
+import comfy.conditioning_cache
+import comfy.conds
+import comfy.k_diffusion.sampling
+import comfy.samplers
+
+MAXIMUM_CHECKPOINTS = 16
+
+
+class Unhashable(Exception):
+    pass
+
+
+def update_hash(h, value):
+    """
+    Hashes the inputs of a sampling run. Values that can't be identified the same way in another run (functions,
+    models, control objects...) raise Unhashable so runs that use them aren't resumed from a wrong checkpoint.
+    """
+    if isinstance(value, comfy.conds.CONDRegular):
+        h.update("{}:".format(type(value).__name__).encode("utf-8"))
+        update_hash(h, value.cond)
+    elif isinstance(value, dict):
+        h.update(b"{")
+        for k in sorted(value.keys(), key=str):
+            update_hash(h, k)
+            update_hash(h, value[k])
+        h.update(b"}")
+    elif isinstance(value, (list, tuple)):
+        h.update(b"[")
+        for v in value:
+            update_hash(h, v)
+        h.update(b"]")
+    elif isinstance(value, (torch.Tensor, bool, int, float, str, torch.dtype, torch.device)) or value is None:
+        comfy.conditioning_cache.update_hash(h, value)
+    else:
+        raise Unhashable(type(value).__name__)
+
+
+def guider_state(guider):
+    """The inputs of a guider (CFGGuider and its subclasses) that change its outputs."""
+    patcher = guider.model_patcher
+    if patcher.forced_hooks is not None or len(patcher.hook_patches) > 0:
+        raise Unhashable("hooks")
+    for name in patcher.object_patches:
+        if name != "model_sampling":
+            raise Unhashable("object patch {}".format(name))
+    weights, _ = comfy.conditioning_cache.weights_key(patcher)
+    scalars = {k: v for k, v in vars(guider).items() if isinstance(v, (bool, int, float, str))}
+    return [
+        type(guider).__name__,
+        scalars,
+        weights,
+        comfy.samplers.model_sampling_key(patcher.get_model_object("model_sampling")),
+        guider.original_conds,
+        guider.model_options,
+    ]
+
+
+class NoiseSamplerState:
+    """
+    Collects the generators of the noise samplers that a sampler function creates so their state can be saved
+    with a checkpoint. When resuming it restores the saved generator states and the bounds of the brownian tree
+    noise samplers (which the sampler functions take from the remaining sigmas).
+    """
+    def __init__(self, saved=None):
+        self.generators = []
+        self.bounds = []
+        self.saved = saved if saved is not None else {"generators": [], "bounds": []}
+
+    def add_generator(self, generator):
+        index = len(self.generators)
+        self.generators.append(generator)
+        if index < len(self.saved["generators"]):
+            generator.set_state(self.saved["generators"][index])
+
+    def brownian_bounds(self, sigma_min, sigma_max):
+        index = len(self.bounds)
+        if index < len(self.saved["bounds"]):
+            sigma_min, sigma_max = self.saved["bounds"][index]
+        self.bounds.append([float(sigma_min), float(sigma_max)])
+        return sigma_min, sigma_max
+
+    def state(self):
+        return {"generators": [g.get_state() for g in self.generators], "bounds": [list(b) for b in self.bounds]}
+
+
+@contextlib.contextmanager
+def track_noise_samplers(state):
+    tracker = comfy.k_diffusion.sampling.noise_sampler_tracker
+    previous = getattr(tracker, "current", None)
+    tracker.current = state
+    try:
+        yield
+    finally:
+        tracker.current = previous
+
+
+class Checkpoint:
+    """The checkpoint of one sampling run. update() is called with the state before every step."""
+    def __init__(self, checkpoints, key, saved=None):
+        self.checkpoints = checkpoints
+        self.key = key
+        self.step = 0
+        self.x = None
+        noise_state = None
+        if saved is not None:
+            self.step = saved["step"]
+            self.x = saved["x"]
+            noise_state = saved["noise_samplers"]
+        self.resumed_step = self.step
+        self.noise_samplers = NoiseSamplerState(noise_state)
+
+    def update(self, step, x):
+        if step == self.resumed_step or step % self.checkpoints.every != 0:
+            return
+        self.checkpoints.save(self.key, step, x, self.noise_samplers.state())
+
+    def finish(self):
+        self.checkpoints.remove(self.key)
+
+
+class SamplerCheckpoints:
+    """
+    Saves the state of running samplers (the latent before the step, the step and the state of the noise
+    generators) to a directory every few steps, so a sampling run that is interrupted, runs out of memory or
+    is killed with the process continues from the last checkpoint when the same prompt runs again. Runs are
+    identified by a hash of everything that goes into them: the model files and patches, the conds, the noise,
+    the latent, the sigmas and the sampler with its options. Runs that use inputs that can't be hashed (custom
+    model options functions, hooks, control objects) aren't checkpointed.
+
+    Only the samplers in comfy.samplers.RESUMABLE_KSAMPLER_NAMES are checkpointed, a resumed run gives the same
+    result as an uninterrupted one. Saving the history buffers of multistep samplers (dpmpp_2m, deis, ipndm...) is
+    not implemented: that history is kept in local variables of the k-diffusion sampler functions, so those
+    samplers are never checkpointed. Checkpoints are removed when their run finishes.
+    """
+    def __init__(self):
+        self.directory = None
+        self.every = 0
+        self.lock = threading.Lock()
+
+    def set_directory(self, directory, every):
+        self.directory = directory
+        self.every = every
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def enabled(self):
+        return self.directory is not None and self.every > 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pt")
+
+    def run_key(self, sampler, guider, sigmas, extra_args, noise, latent_image, denoise_mask):
+        h = hashlib.sha256()
+        try:
+            function = sampler.sampler_function
+            update_hash(h, [
+                "{}.{}".format(function.__module__, function.__qualname__),
+                sampler.extra_options,
+                sampler.inpaint_options,
+                guider_state(guider),
+                extra_args.get("seed", None),
+                sigmas,
+                noise,
+                latent_image,
+                denoise_mask,
+            ])
+        except (Unhashable, AttributeError) as e:
+            logging.debug("Not checkpointing the sampler, its inputs can't be identified: {}".format(e))
+            return None
+        return h.hexdigest()
+
+    def begin(self, sampler, guider, sigmas, extra_args, noise, latent_image, denoise_mask):
+        """Returns the Checkpoint of the run, with the saved state if it was interrupted before, or None."""
+        if not self.enabled():
+            return None
+        key = self.run_key(sampler, guider, sigmas, extra_args, noise, latent_image, denoise_mask)
+        if key is None:
+            return None
+        saved = self.load(key)
+        if saved is not None:
+            logging.info("Resuming sampling from step {} of {}.".format(saved["step"], len(sigmas) - 1))
+        return Checkpoint(self, key, saved)
+
+    def load(self, key):
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            return torch.load(path, map_location="cpu", weights_only=True)
+        except Exception as e:
+            logging.warning("Could not read the sampler checkpoint {}: {}".format(path, e))
+            return None
+
+    def save(self, key, step, x, noise_samplers):
+        path = self._path(key)
+        temp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+        try:
+            torch.save({"step": step, "x": x.detach().cpu(), "noise_samplers": noise_samplers}, temp_path)
+            os.replace(temp_path, path)
+        except Exception as e:
+            logging.warning("Could not write the sampler checkpoint {}: {}".format(path, e))
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        with self.lock:
+            self.evict(keep=path)
+
+    def remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning("Could not remove the sampler checkpoint: {}".format(e))
+
+    def evict(self, keep=None):
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pt"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        files.sort(reverse=True)
+        for _, path in files[MAXIMUM_CHECKPOINTS:]:
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+
+sampler_checkpoints = SamplerCheckpoints()
@@ -9,6 +9,9 @@ if TYPE_CHECKING:
 import torch
 from functools import partial
 import collections
+import hashlib
+import threading
+import weakref
 from comfy import model_management
 import math
 import logging
@@ -18,6 +21,8 @@ import comfy.patcher_extension
 import comfy.hooks
 import comfy.context_windows
 import comfy.utils
+import comfy.memory_profiler
+import comfy.sampler_checkpoint
 import scipy.stats
 import numpy
 
@@ -200,6 +205,138 @@ def finalize_default_conds(model: 'BaseModel', hooked_to_run: dict[comfy.hooks.H
             hooked_to_run.setdefault(p.hooks, list())
             hooked_to_run[p.hooks] += [(p, i)]
 
+MAXIMUM_PLANS = 64
+
+def cond_plan_key(item):
+    p, i = item
+    control = None if p.control is None else id(p.control)
+    area = None if p.area is None else tuple(p.area)
+    return (i, p.uuid, tuple(p.input_x.shape), area, control, p.patches is not None)
+
+def plan_cond_batches(model: BaseModel, to_run: list[tuple[tuple,int]], x_in: torch.Tensor) -> list[list[int]]:
+    """
+    Splits the conds in to_run into model calls: conds that can be concatenated are run together as long as
+    the memory they need is free, otherwise the batch is halved until it fits. Returns the indices in to_run
+    of the conds of every call.
+    """
+    free_memory = model_management.get_free_memory(x_in.device)
+    remaining = list(range(len(to_run)))
+    batches = []
+    while len(remaining) > 0:
+        first = to_run[remaining[0]]
+        first_shape = first[0].input_x.shape
+        to_batch_temp = [x for x in remaining if can_concat_cond(to_run[x][0], first[0])]
+
+        to_batch_temp.reverse()
+        to_batch = to_batch_temp[:1]
+
+        for i in range(1, len(to_batch_temp) + 1):
+            batch_amount = to_batch_temp[:len(to_batch_temp)//i]
+            input_shape = [len(batch_amount) * first_shape[0]] + list(first_shape)[1:]
+            cond_shapes = collections.defaultdict(list)
+            for tt in batch_amount:
+                for k, v in to_run[tt][0].conditioning.items():
+                    cond_shapes[k].append(v.size())
+
+            # The measured memory usage already is the peak, the static estimate needs some headroom
+            memory_required = comfy.memory_profiler.memory_profiler.estimate(model.memory_profile_key(), model.memory_usage_area(input_shape, cond_shapes=cond_shapes))
+            if memory_required is None:
+                memory_required = model.memory_required(input_shape, cond_shapes=cond_shapes) * 1.5
+            if memory_required < free_memory:
+                to_batch = batch_amount
+                break
+
+        batches.append(to_batch)
+        remaining = [x for x in remaining if x not in to_batch]
+    return batches
+
+class CondBatchPlanner:
+    """
+    Remembers for one sampling run how the conds are split into model calls and their concatenated
+    conditioning, so the steps after the first don't estimate the memory of every possible batch and
+    concatenate the same conds again. Plans are keyed by the conds that are active (which changes with their
+    timestep ranges) and the input shape. The conditioning of a batch is reused while its conds are the same
+    objects, so conds that are replaced between calls (context windows) are concatenated again.
+
+    passes has the number of model calls of every evaluation of the model, more than one means the conds
+    (usually cond and uncond) weren't run in one batch.
+    """
+    def __init__(self):
+        self.plans = {}
+        self.conditioning = {}
+        self.passes = []
+
+    def plan(self, model: BaseModel, to_run: list[tuple[tuple,int]], x_in: torch.Tensor) -> list[list[int]]:
+        key = (tuple(x_in.shape), x_in.device, tuple(cond_plan_key(o) for o in to_run))
+        batches = self.plans.get(key, None)
+        if batches is None:
+            if len(self.plans) >= MAXIMUM_PLANS:
+                self.plans.clear()
+            batches = plan_cond_batches(model, to_run, x_in)
+            self.plans[key] = batches
+        return batches
+
+    def concat_conditioning(self, items: list[tuple[tuple,int]], sources: dict, batch_size: int) -> dict:
+        conditioning = [p.conditioning for p, _ in items]
+        model_conds = [sources.get(id(p), None) for p, _ in items]
+        if any(m is None for m in model_conds):
+            return cond_cat(conditioning)
+        key = (batch_size, tuple((i, p.uuid, None if p.area is None else tuple(p.area)) for p, i in items))
+        check = [(m, tuple(m.values())) for m in model_conds]
+        cached = self.conditioning.get(key, None)
+        if cached is not None and self._same_conds(cached[0], check):
+            return dict(cached[1])
+        if len(self.conditioning) >= MAXIMUM_PLANS:
+            self.conditioning.clear()
+        c = cond_cat(conditioning)
+        self.conditioning[key] = (check, c)
+        return dict(c)
+
+    @staticmethod
+    def _same_conds(a, b):
+        for (m1, v1), (m2, v2) in zip(a, b):
+            if m1 is not m2 or len(v1) != len(v2):
+                return False
+            if any(x is not y for x, y in zip(v1, v2)):
+                return False
+        return True
+
+    def record(self, forward_passes):
+        self.passes.append(forward_passes)
+
+    def finish(self):
+        cond_batch_stats.add(self.passes)
+        split = sum(1 for n in self.passes if n > 1)
+        if split > 0:
+            logging.debug("Sampling ran the model {} times for {} evaluations, {} of them needed more than one call.".format(sum(self.passes), len(self.passes), split))
+        self.plans.clear()
+        self.conditioning.clear()
+
+class CondBatchStats:
+    """Number of model calls per evaluation of all the sampling runs."""
+    def __init__(self):
+        self.runs = 0
+        self.passes = collections.Counter()
+        self.lock = threading.Lock()
+
+    def add(self, passes):
+        with self.lock:
+            self.runs += 1
+            self.passes.update(passes)
+
+    def stats(self):
+        with self.lock:
+            evaluations = sum(self.passes.values())
+            return {
+                "runs": self.runs,
+                "evaluations": evaluations,
+                "forward_passes": sum(k * v for k, v in self.passes.items()),
+                "split_evaluations": sum(v for k, v in self.passes.items() if k > 1),
+                "passes_per_evaluation": {str(k): v for k, v in sorted(self.passes.items())},
+            }
+
+cond_batch_stats = CondBatchStats()
+
 def calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tensor, timestep, model_options: dict[str]):
     handler: comfy.context_windows.ContextHandlerABC = model_options.get("context_handler", None)
     if handler is None or not handler.should_use_context(model, conds, x_in, timestep, model_options):
@@ -220,6 +357,11 @@ def _calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tens
     hooked_to_run: dict[comfy.hooks.HookGroup,list[tuple[tuple,int]]] = {}
     default_conds = []
     has_default_conds = False
+    # model_conds of the conds in hooked_to_run, to reuse their concatenated conditioning
+    sources = {}
+    planner = model_options.get("cond_batch_planner", None)
+    if planner is None:
+        planner = CondBatchPlanner()
 
     for i in range(len(conds)):
         out_conds.append(torch.zeros_like(x_in))
@@ -238,6 +380,7 @@ def _calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tens
                     continue
                 if p.hooks is not None:
                     model.current_patcher.prepare_hook_patches_current_keyframe(timestep, p.hooks, model_options)
+                sources[id(p)] = x["model_conds"]
                 hooked_to_run.setdefault(p.hooks, list())
                 hooked_to_run[p.hooks] += [(p, i)]
         default_conds.append(default_c)
@@ -248,32 +391,9 @@ def _calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tens
     model.current_patcher.prepare_state(timestep)
 
     # run every hooked_to_run separately
+    forward_passes = 0
     for hooks, to_run in hooked_to_run.items():
-        while len(to_run) > 0:
-            first = to_run[0]
-            first_shape = first[0][0].shape
-            to_batch_temp = []
-            for x in range(len(to_run)):
-                if can_concat_cond(to_run[x][0], first[0]):
-                    to_batch_temp += [x]
-
-            to_batch_temp.reverse()
-            to_batch = to_batch_temp[:1]
-
-            free_memory = model_management.get_free_memory(x_in.device)
-            for i in range(1, len(to_batch_temp) + 1):
-                batch_amount = to_batch_temp[:len(to_batch_temp)//i]
-                input_shape = [len(batch_amount) * first_shape[0]] + list(first_shape)[1:]
-                cond_shapes = collections.defaultdict(list)
-                for tt in batch_amount:
-                    cond = {k: v.size() for k, v in to_run[tt][0].conditioning.items()}
-                    for k, v in to_run[tt][0].conditioning.items():
-                        cond_shapes[k].append(v.size())
-
-                if model.memory_required(input_shape, cond_shapes=cond_shapes) * 1.5 < free_memory:
-                    to_batch = batch_amount
-                    break
-
+        for to_batch in planner.plan(model, to_run, x_in):
             input_x = []
             mult = []
             c = []
@@ -282,8 +402,8 @@ def _calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tens
             area = []
             control = None
             patches = None
-            for x in to_batch:
-                o = to_run.pop(x)
+            items = [to_run[x] for x in to_batch]
+            for o in items:
                 p = o[0]
                 input_x.append(p.input_x)
                 mult.append(p.mult)
@@ -296,7 +416,11 @@ def _calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tens
 
             batch_chunks = len(cond_or_uncond)
             input_x = torch.cat(input_x)
-            c = cond_cat(c)
+            cond_shapes = collections.defaultdict(list)
+            for x in c:
+                for k, v in x.items():
+                    cond_shapes[k].append(v.size())
+            c = planner.concat_conditioning(items, sources, x_in.shape[0])
             timestep_ = torch.cat([timestep] * batch_chunks)
 
             transformer_options = model.current_patcher.apply_hooks(hooks=hooks)
@@ -320,10 +444,13 @@ def _calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tens
             if control is not None:
                 c['control'] = control.get_control(input_x, timestep_, c, len(cond_or_uncond), transformer_options)
 
-            if 'model_function_wrapper' in model_options:
-                output = model_options['model_function_wrapper'](model.apply_model, {"input": input_x, "timestep": timestep_, "c": c, "cond_or_uncond": cond_or_uncond}).chunk(batch_chunks)
-            else:
-                output = model.apply_model(input_x, timestep_, **c).chunk(batch_chunks)
+            memory_profile_size = model.memory_usage_area(input_x.shape, cond_shapes=cond_shapes)
+            with comfy.memory_profiler.memory_profiler.measure(model.memory_profile_key(), memory_profile_size, input_x.device):
+                if 'model_function_wrapper' in model_options:
+                    output = model_options['model_function_wrapper'](model.apply_model, {"input": input_x, "timestep": timestep_, "c": c, "cond_or_uncond": cond_or_uncond}).chunk(batch_chunks)
+                else:
+                    output = model.apply_model(input_x, timestep_, **c).chunk(batch_chunks)
+            forward_passes += 1
 
             for o in range(batch_chunks):
                 cond_index = cond_or_uncond[o]
@@ -341,6 +468,7 @@ def _calc_cond_batch(model: BaseModel, conds: list[list[dict]], x_in: torch.Tens
                     out_c += output[o] * mult[o]
                     out_cts += mult[o]
 
+    planner.record(forward_passes)
     for i in range(len(out_conds)):
         out_conds[i] /= out_counts[i]
 
@@ -726,7 +854,18 @@ KSAMPLER_NAMES = ["euler", "euler_cfg_pp", "euler_ancestral", "euler_ancestral_c
                   "ipndm", "ipndm_v", "deis", "res_multistep", "res_multistep_cfg_pp", "res_multistep_ancestral", "res_multistep_ancestral_cfg_pp",
                   "gradient_estimation", "gradient_estimation_cfg_pp", "er_sde", "seeds_2", "seeds_3", "sa_solver", "sa_solver_pece"]
 
+# Samplers whose state between steps is only the x passed to the callback (and the noise samplers, which are
+# saved separately). Multistep samplers keep the previous denoised outputs and dpm_fast, dpm_adaptive and heunpp2
+# depend on the first sigma or pick their own steps, so continuing them from a checkpoint would change the result.
+# Checkpointing the history of the multistep samplers is not implemented, they always run from the first step.
+RESUMABLE_KSAMPLER_NAMES = {"euler", "euler_cfg_pp", "euler_ancestral", "euler_ancestral_cfg_pp", "heun", "dpm_2", "dpm_2_ancestral",
+                            "dpmpp_2s_ancestral", "dpmpp_2s_ancestral_cfg_pp", "dpmpp_sde", "dpmpp_sde_gpu", "ddpm", "lcm"}
+
 class KSAMPLER(Sampler):
+    # Set for sampler functions that step through the sigmas and call the callback with the x of every step,
+    # so they can continue from a checkpoint with the remaining sigmas
+    resumable = False
+
     def __init__(self, sampler_function, extra_options={}, inpaint_options={}):
         self.sampler_function = sampler_function
         self.extra_options = extra_options
@@ -742,14 +881,31 @@ class KSAMPLER(Sampler):
         else:
             model_k.noise = noise
 
+        checkpoint = None
+        if self.resumable:
+            checkpoint = comfy.sampler_checkpoint.sampler_checkpoints.begin(self, model_wrap, sigmas, extra_args, noise, latent_image, denoise_mask)
+
         noise = model_wrap.inner_model.model_sampling.noise_scaling(sigmas[0], noise, latent_image, self.max_denoise(model_wrap, sigmas))
 
+        start = 0
+        if checkpoint is not None and checkpoint.x is not None:
+            start = checkpoint.step
+            noise = checkpoint.x.to(device=noise.device, dtype=noise.dtype)
+
         k_callback = None
         total_steps = len(sigmas) - 1
-        if callback is not None:
+        if checkpoint is not None:
+            def k_callback(x):
+                checkpoint.update(x["i"] + start, x["x"])
+                if callback is not None:
+                    callback(x["i"] + start, x["denoised"], x["x"], total_steps)
+        elif callback is not None:
             k_callback = lambda x: callback(x["i"], x["denoised"], x["x"], total_steps)
 
-        samples = self.sampler_function(model_k, noise, sigmas, extra_args=extra_args, callback=k_callback, disable=disable_pbar, **self.extra_options)
+        with comfy.sampler_checkpoint.track_noise_samplers(None if checkpoint is None else checkpoint.noise_samplers):
+            samples = self.sampler_function(model_k, noise, sigmas[start:], extra_args=extra_args, callback=k_callback, disable=disable_pbar, **self.extra_options)
+        if checkpoint is not None:
+            checkpoint.finish()
         samples = model_wrap.inner_model.model_sampling.inverse_noise_scaling(sigmas[-1], samples)
         return samples
 
@@ -779,7 +935,10 @@ def ksampler(sampler_name, extra_options={}, inpaint_options={}):
     else:
         sampler_function = getattr(k_diffusion_sampling, "sample_{}".format(sampler_name))
 
-    return KSAMPLER(sampler_function, extra_options, inpaint_options)
+    sampler = KSAMPLER(sampler_function, extra_options, inpaint_options)
+    # s_churn is divided by the number of sigmas so a run with the remaining sigmas would use a different amount
+    sampler.resumable = sampler_name in RESUMABLE_KSAMPLER_NAMES and not extra_options.get("s_churn", 0)
+    return sampler
 
 
 def process_conds(model, noise, conds, device, latent_image=None, denoise_mask=None, seed=None):
@@ -970,6 +1129,8 @@ class CFGGuider:
 
         extra_model_options = comfy.model_patcher.create_model_options_clone(self.model_options)
         extra_model_options.setdefault("transformer_options", {})["sample_sigmas"] = sigmas
+        planner = CondBatchPlanner()
+        extra_model_options["cond_batch_planner"] = planner
         extra_args = {"model_options": extra_model_options, "seed": seed}
 
         executor = comfy.patcher_extension.WrapperExecutor.new_class_executor(
@@ -977,7 +1138,10 @@ class CFGGuider:
             sampler,
             comfy.patcher_extension.get_all_wrappers(comfy.patcher_extension.WrappersMP.SAMPLER_SAMPLE, extra_args["model_options"], is_model_options=True)
         )
-        samples = executor.execute(self, sigmas, extra_args, callback, noise, latent_image, denoise_mask, disable_pbar)
+        try:
+            samples = executor.execute(self, sigmas, extra_args, callback, noise, latent_image, denoise_mask, disable_pbar)
+        finally:
+            planner.finish()
         return self.inner_model.process_latent_out(samples.to(torch.float32))
 
     def outer_sample(self, noise, latent_image, sampler, sigmas, denoise_mask=None, callback=None, disable_pbar=False, seed=None):
@@ -1066,15 +1230,107 @@ SCHEDULER_HANDLERS = {
 }
 SCHEDULER_NAMES = list(SCHEDULER_HANDLERS)
 
+SIGMAS_CACHE_SIZE = 256
+
+def _model_sampling_state(model_sampling):
+    scalars = []
+    tensors = {}
+    if isinstance(model_sampling, torch.nn.Module):
+        tensors.update(model_sampling.named_buffers())
+    for name, value in sorted(vars(model_sampling).items()):
+        if isinstance(value, torch.Tensor):
+            tensors[name] = value
+        elif isinstance(value, (bool, int, float, str)) or value is None:
+            scalars.append((name, value))
+    return scalars, tensors
+
+_model_sampling_keys = weakref.WeakKeyDictionary()
+_model_sampling_keys_lock = threading.Lock()
+
+def model_sampling_key(model_sampling: object) -> str:
+    """
+    Identifies the schedules a model_sampling object gives: its classes, scalar attributes and tensors.
+    The key is remembered per object until a scalar changes or a tensor is replaced or modified in place, so the
+    tensors are only copied to the cpu and hashed once instead of on every call.
+    """
+    scalars, tensors = _model_sampling_state(model_sampling)
+    version = (tuple(scalars), tuple((name, id(t), t.data_ptr(), t._version) for name, t in sorted(tensors.items())))
+    try:
+        with _model_sampling_keys_lock:
+            cached = _model_sampling_keys.get(model_sampling, None)
+    except TypeError:
+        cached = None
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    h = hashlib.sha256()
+    h.update(",".join("{}.{}".format(c.__module__, c.__qualname__) for c in type(model_sampling).__mro__).encode("utf-8"))
+    for name, value in scalars:
+        h.update("{}={!r};".format(name, value).encode("utf-8"))
+    for name in sorted(tensors):
+        t = tensors[name].detach().cpu().contiguous()
+        h.update("{}:{}{}:".format(name, t.dtype, tuple(t.shape)).encode("utf-8"))
+        h.update(t.reshape(-1).view(torch.uint8).numpy().tobytes())
+    key = h.hexdigest()
+    try:
+        with _model_sampling_keys_lock:
+            _model_sampling_keys[model_sampling] = (version, key)
+    except TypeError:
+        pass
+    return key
+
+class SigmasCache:
+    """
+    Keeps the most recently calculated sigma schedules so samplers that run many prompts with the same model,
+    scheduler and steps don't calculate them again (beta runs scipy, the others are small but add up when
+    serving batches). Schedules are returned as copies because callers modify them.
+    """
+    def __init__(self, size=SIGMAS_CACHE_SIZE):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            sigmas = self.entries.get(key, None)
+            if sigmas is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return sigmas.clone()
+
+    def put(self, key, sigmas):
+        with self.lock:
+            self.entries[key] = sigmas.detach().clone()
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+sigmas_cache = SigmasCache()
+
 def calculate_sigmas(model_sampling: object, scheduler_name: str, steps: int) -> torch.Tensor:
     handler = SCHEDULER_HANDLERS.get(scheduler_name)
     if handler is None:
         err = f"error invalid scheduler {scheduler_name}"
         logging.error(err)
         raise ValueError(err)
+    key = (model_sampling_key(model_sampling), scheduler_name, handler.handler, steps)
+    sigmas = sigmas_cache.get(key)
+    if sigmas is not None:
+        return sigmas
     if handler.use_ms:
-        return handler.handler(model_sampling, steps)
-    return handler.handler(n=steps, sigma_min=float(model_sampling.sigma_min), sigma_max=float(model_sampling.sigma_max))
+        sigmas = handler.handler(model_sampling, steps)
+    else:
+        sigmas = handler.handler(n=steps, sigma_min=float(model_sampling.sigma_min), sigma_max=float(model_sampling.sigma_max))
+    sigmas_cache.put(key, sigmas)
+    return sigmas
 
 def sampler_object(name):
     if name == "uni_pc":
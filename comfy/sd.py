@@ -25,6 +25,10 @@ import math
 import os
 
 import comfy.utils
+import comfy.model_cache
+import comfy.memory_profiler
+import comfy.conditioning_cache
+import comfy.disk_offload
 
 from . import clip_vision
 from . import gligen
@@ -62,7 +66,7 @@ import comfy.taesd.taesd
 
 import comfy.ldm.flux.redux
 
-def load_lora_for_models(model, clip, lora, strength_model, strength_clip):
+def load_lora_for_models(model, clip, lora, strength_model, strength_clip, source=None):
     key_map = {}
     if model is not None:
         key_map = comfy.lora.model_lora_keys_unet(model.model, key_map)
@@ -73,14 +77,14 @@ def load_lora_for_models(model, clip, lora, strength_model, strength_clip):
     loaded = comfy.lora.load_lora(lora, key_map)
     if model is not None:
         new_modelpatcher = model.clone()
-        k = new_modelpatcher.add_patches(loaded, strength_model)
+        k = new_modelpatcher.add_patches(loaded, strength_model, source=source)
     else:
         k = ()
         new_modelpatcher = None
 
     if clip is not None:
         new_clip = clip.clone()
-        k1 = new_clip.add_patches(loaded, strength_clip)
+        k1 = new_clip.add_patches(loaded, strength_clip, source=source)
     else:
         k1 = ()
         new_clip = None
@@ -143,8 +147,8 @@ class CLIP:
         n.apply_hooks_to_conds = self.apply_hooks_to_conds
         return n
 
-    def add_patches(self, patches, strength_patch=1.0, strength_model=1.0):
-        return self.patcher.add_patches(patches, strength_patch, strength_model)
+    def add_patches(self, patches, strength_patch=1.0, strength_model=1.0, source=None):
+        return self.patcher.add_patches(patches, strength_patch, strength_model, source=source)
 
     def set_tokenizer_option(self, option_name, value):
         self.tokenizer_options[option_name] = value
@@ -232,8 +236,22 @@ class CLIP:
         if return_pooled == "unprojected":
             self.cond_stage_model.set_clip_options({"projected_pooled": False})
 
-        self.load_model()
-        o = self.cond_stage_model.encode_token_weights(tokens)
+        cache = comfy.conditioning_cache.conditioning_cache
+        o = None
+        cache_key = None
+        weights_key = None
+        if cache.enabled() and comfy.conditioning_cache.cacheable(self.patcher):
+            weights_key, persistent = comfy.conditioning_cache.weights_key(self.patcher)
+            cache_key = comfy.conditioning_cache.tokens_key(weights_key, type(self.cond_stage_model).__name__, self.layer_idx, return_pooled == "unprojected", tokens)
+            o = cache.get(cache_key, persistent)
+
+        if o is None:
+            self.load_model()
+            with cache.encoder(weights_key):
+                o = self.cond_stage_model.encode_token_weights(tokens)
+            if cache_key is not None:
+                cache.put(cache_key, o, persistent)
+
         cond, pooled = o[:2]
         if return_dict:
             out = {"cond": cond, "pooled_output": pooled}
@@ -252,10 +270,11 @@ class CLIP:
         return self.encode_from_tokens(tokens)
 
     def load_sd(self, sd, full_model=False):
-        if full_model:
-            return self.cond_stage_model.load_state_dict(sd, strict=False)
-        else:
-            return self.cond_stage_model.load_sd(sd)
+        with comfy.disk_offload.disk_offload.loading(self.cond_stage_model):
+            if full_model:
+                return self.cond_stage_model.load_state_dict(sd, strict=False)
+            else:
+                return self.cond_stage_model.load_sd(sd)
 
     def get_sd(self):
         sd_clip = self.cond_stage_model.state_dict()
@@ -596,6 +615,18 @@ class VAE:
         self.patcher = comfy.model_patcher.ModelPatcher(self.first_stage_model, load_device=self.device, offload_device=offload_device)
         logging.info("VAE load device: {}, offload device: {}, dtype: {}".format(self.device, offload_device, self.vae_dtype))
 
+    def memory_profile_key(self, kind):
+        return "vae_{}:{}:{}:{}:{}".format(kind, type(self.first_stage_model).__name__, self.latent_channels, self.latent_dim, self.vae_dtype)
+
+    def memory_used(self, kind, shape):
+        """Memory needed to decode or encode one sample of shape, measured if available else estimated."""
+        learned = comfy.memory_profiler.memory_profiler.estimate(self.memory_profile_key(kind), math.prod(shape[2:]))
+        if learned is not None:
+            return learned
+        if kind == "decode":
+            return self.memory_used_decode(shape, self.vae_dtype)
+        return self.memory_used_encode(shape, self.vae_dtype)
+
     def throw_exception_if_invalid(self):
         if self.first_stage_model is None:
             raise RuntimeError("ERROR: VAE is invalid: None\n\nIf the VAE is from a checkpoint loader node your checkpoint does not contain a valid VAE.")
@@ -683,7 +714,7 @@ class VAE:
         pixel_samples = None
         do_tile = False
         try:
-            memory_used = self.memory_used_decode(samples_in.shape, self.vae_dtype)
+            memory_used = self.memory_used("decode", samples_in.shape)
             model_management.load_models_gpu([self.patcher], memory_required=memory_used, force_full_load=self.disable_offload)
             free_memory = model_management.get_free_memory(self.device)
             batch_number = int(free_memory / memory_used)
@@ -691,7 +722,9 @@ class VAE:
 
             for x in range(0, samples_in.shape[0], batch_number):
                 samples = samples_in[x:x+batch_number].to(self.vae_dtype).to(self.device)
-                out = self.process_output(self.first_stage_model.decode(samples, **vae_options).to(self.output_device).float())
+                with comfy.memory_profiler.memory_profiler.measure(self.memory_profile_key("decode"), samples.shape[0] * math.prod(samples.shape[2:]), self.device):
+                    out = self.first_stage_model.decode(samples, **vae_options)
+                out = self.process_output(out.to(self.output_device).float())
                 if pixel_samples is None:
                     pixel_samples = torch.empty((samples_in.shape[0],) + tuple(out.shape[1:]), device=self.output_device)
                 pixel_samples[x:x+batch_number] = out
@@ -757,7 +790,7 @@ class VAE:
             else:
                 pixel_samples = pixel_samples.unsqueeze(2)
         try:
-            memory_used = self.memory_used_encode(pixel_samples.shape, self.vae_dtype)
+            memory_used = self.memory_used("encode", pixel_samples.shape)
             model_management.load_models_gpu([self.patcher], memory_required=memory_used, force_full_load=self.disable_offload)
             free_memory = model_management.get_free_memory(self.device)
             batch_number = int(free_memory / max(1, memory_used))
@@ -765,7 +798,9 @@ class VAE:
             samples = None
             for x in range(0, pixel_samples.shape[0], batch_number):
                 pixels_in = self.process_input(pixel_samples[x:x + batch_number]).to(self.vae_dtype).to(self.device)
-                out = self.first_stage_model.encode(pixels_in).to(self.output_device).float()
+                with comfy.memory_profiler.memory_profiler.measure(self.memory_profile_key("encode"), pixels_in.shape[0] * math.prod(pixels_in.shape[2:]), self.device):
+                    out = self.first_stage_model.encode(pixels_in)
+                out = out.to(self.output_device).float()
                 if samples is None:
                     samples = torch.empty((pixel_samples.shape[0],) + tuple(out.shape[1:]), device=self.output_device)
                 samples[x:x + batch_number] = out
@@ -900,10 +935,13 @@ class CLIPType(Enum):
 
 
 def load_clip(ckpt_paths, embedding_directory=None, clip_type=CLIPType.STABLE_DIFFUSION, model_options={}):
-    clip_data = []
-    for p in ckpt_paths:
-        clip_data.append(comfy.utils.load_torch_file(p, safe_load=True))
-    return load_text_encoder_state_dicts(clip_data, embedding_directory=embedding_directory, clip_type=clip_type, model_options=model_options)
+    def load():
+        clip_data = []
+        for p in ckpt_paths:
+            clip_data.append(comfy.utils.load_torch_file(p, safe_load=True))
+        return load_text_encoder_state_dicts(clip_data, embedding_directory=embedding_directory, clip_type=clip_type, model_options=model_options)
+    options = {"embedding_directory": embedding_directory, "clip_type": clip_type, "model_options": model_options}
+    return comfy.model_cache.model_file_cache.load("clip", ckpt_paths, options, load)
 
 
 class TEModel(Enum):
@@ -1175,11 +1213,19 @@ def load_checkpoint(config_path=None, ckpt_path=None, output_vae=True, output_cl
     return (model, clip, vae)
 
 def load_checkpoint_guess_config(ckpt_path, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True, model_options={}, te_model_options={}):
-    sd, metadata = comfy.utils.load_torch_file(ckpt_path, return_metadata=True)
-    out = load_state_dict_guess_config(sd, output_vae, output_clip, output_clipvision, embedding_directory, output_model, model_options, te_model_options=te_model_options, metadata=metadata)
-    if out is None:
-        raise RuntimeError("ERROR: Could not detect model type of: {}\n{}".format(ckpt_path, model_detection_error_hint(ckpt_path, sd)))
-    return out
+    def load():
+        sd, metadata = comfy.utils.load_torch_file(ckpt_path, return_metadata=True, lazy=True)
+        try:
+            out = load_state_dict_guess_config(sd, output_vae, output_clip, output_clipvision, embedding_directory, output_model, model_options, te_model_options=te_model_options, metadata=metadata)
+        finally:
+            comfy.utils.close_state_dict(sd)
+        if out is None:
+            raise RuntimeError("ERROR: Could not detect model type of: {}\n{}".format(ckpt_path, model_detection_error_hint(ckpt_path, sd)))
+        if out[0] is not None:
+            out[0].patches_source = [("checkpoint", comfy.model_cache.file_key(ckpt_path), model_options)]
+        return out
+    options = (output_vae, output_clip, output_clipvision, embedding_directory, output_model, model_options, te_model_options)
+    return comfy.model_cache.model_file_cache.load("checkpoint", [ckpt_path], options, load)
 
 def load_state_dict_guess_config(sd, output_vae=True, output_clip=True, output_clipvision=False, embedding_directory=None, output_model=True, model_options={}, te_model_options={}, metadata=None):
     clip = None
@@ -1346,12 +1392,18 @@ def load_diffusion_model_state_dict(sd, model_options={}):
 
 
 def load_diffusion_model(unet_path, model_options={}):
-    sd = comfy.utils.load_torch_file(unet_path)
-    model = load_diffusion_model_state_dict(sd, model_options=model_options)
-    if model is None:
-        logging.error("ERROR UNSUPPORTED DIFFUSION MODEL {}".format(unet_path))
-        raise RuntimeError("ERROR: Could not detect model type of: {}\n{}".format(unet_path, model_detection_error_hint(unet_path, sd)))
-    return model
+    def load():
+        sd = comfy.utils.load_torch_file(unet_path, lazy=True)
+        try:
+            model = load_diffusion_model_state_dict(sd, model_options=model_options)
+        finally:
+            comfy.utils.close_state_dict(sd)
+        if model is None:
+            logging.error("ERROR UNSUPPORTED DIFFUSION MODEL {}".format(unet_path))
+            raise RuntimeError("ERROR: Could not detect model type of: {}\n{}".format(unet_path, model_detection_error_hint(unet_path, sd)))
+        model.patches_source = [("diffusion_model", comfy.model_cache.file_key(unet_path), model_options)]
+        return model
+    return comfy.model_cache.model_file_cache.load("diffusion_model", [unet_path], model_options, load)
 
 def load_unet(unet_path, dtype=None):
     logging.warning("The load_unet function has been deprecated and will be removed please switch to: load_diffusion_model")
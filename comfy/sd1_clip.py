@@ -1,17 +1,23 @@
 import os
 
-from transformers import CLIPTokenizer
+from transformers import CLIPTokenizer, PreTrainedTokenizerBase
 import comfy.ops
 import torch
 import traceback
 import zipfile
+import collections
+import functools
+import threading
 from . import model_management
 import comfy.clip_model
+import comfy.conditioning_cache
 import json
 import logging
 import numbers
 import re
 
+WORD_TOKENS_CACHE_SIZE = 16384
+
 def gen_empty_tokens(special_tokens, length):
     start_token = special_tokens.get("start", None)
     end_token = special_tokens.get("end", None)
@@ -24,7 +30,59 @@ def gen_empty_tokens(special_tokens, length):
     output += [pad_token] * (length - len(output))
     return output
 
+def split_sections(o, count):
+    """Splits the outputs of encode for count sections into one output per section, None if they can't be split."""
+    out, pooled = o[:2]
+    if out.shape[0] != count or (pooled is not None and pooled.shape[0] != count):
+        return None
+    extra = o[2] if len(o) > 2 else None
+    if extra is not None:
+        for v in extra.values():
+            if not isinstance(v, torch.Tensor) or v.shape[0] != count:
+                return None
+    device = model_management.intermediate_device()
+    sections = []
+    for i in range(count):
+        section = (out[i:i + 1].to(device, copy=True), pooled[i:i + 1].to(device, copy=True) if pooled is not None else None)
+        if extra is not None:
+            section = section + ({k: v[i:i + 1].to(device, copy=True) for k, v in extra.items()},)
+        sections.append(section)
+    return sections
+
+def join_sections(sections):
+    out = torch.cat([s[0] for s in sections])
+    pooled = None
+    if sections[0][1] is not None:
+        pooled = torch.cat([s[1] for s in sections])
+    if len(sections[0]) > 2:
+        return out, pooled, {k: torch.cat([s[2][k] for s in sections]) for k in sections[0][2]}
+    return out, pooled
+
 class ClipTokenWeightEncoder:
+    def encode_sections(self, to_encode):
+        """self.encode(to_encode), reusing the outputs of sections encoded before by the same encoder with the same options."""
+        cache = comfy.conditioning_cache.conditioning_cache
+        weights = cache.encoder_key()
+        if weights is None or len(to_encode) == 0:
+            return self.encode(to_encode)
+
+        options = (type(self).__name__, getattr(self, "layer", None), getattr(self, "layer_idx", None), getattr(self, "return_projected_pooled", None))
+        length = max(map(len, to_encode))
+        keys = [comfy.conditioning_cache.tokens_key(weights, options, length, tokens) for tokens in to_encode]
+        sections = [cache.get(k) for k in keys]
+        missing = [i for i in range(len(sections)) if sections[i] is None]
+        if len(missing) > 0:
+            o = self.encode([to_encode[i] for i in missing])
+            new_sections = split_sections(o, len(missing))
+            if new_sections is None:
+                if len(missing) == len(to_encode):
+                    return o
+                return self.encode(to_encode)
+            for i, section in zip(missing, new_sections):
+                sections[i] = section
+                cache.put(keys[i], section)
+        return join_sections(sections)
+
     def encode_token_weights(self, token_weight_pairs):
         to_encode = list()
         max_token_len = 0
@@ -42,7 +100,7 @@ class ClipTokenWeightEncoder:
             else:
                 to_encode.append(gen_empty_tokens(self.special_tokens, max_token_len))
 
-        o = self.encode(to_encode)
+        o = self.encode_sections(to_encode)
         out, pooled = o[:2]
 
         if pooled is not None:
@@ -341,6 +399,11 @@ def token_weights(string, current_weight):
             out += [(x, current_weight)]
     return out
 
+@functools.lru_cache(maxsize=1024)
+def parse_prompt_weights(text):
+    """token_weights(text, 1.0), memoized since the same prompts get tokenized again and again."""
+    return tuple(token_weights(text, 1.0))
+
 def escape_important(text):
     text = text.replace("\\)", "\0\1")
     text = text.replace("\\(", "\0\2")
@@ -388,6 +451,11 @@ def bundled_embed(embed, prefix, suffix): #bundled embedding in lora format
 
     return torch.cat(out_list, dim=0)
 
+# Loaded embeddings keyed by their path, mtime and size so editing or replacing a file loads it again
+EMBEDDING_CACHE_SIZE = 64
+embedding_cache = collections.OrderedDict()
+embedding_cache_lock = threading.Lock()
+
 def load_embed(embedding_name, embedding_directory, embedding_size, embed_key=None):
     if isinstance(embedding_directory, str):
         embedding_directory = [embedding_directory]
@@ -418,8 +486,26 @@ def load_embed(embedding_name, embedding_directory, embedding_size, embed_key=No
     if valid_file is None:
         return None
 
-    embed_path = valid_file
+    try:
+        st = os.stat(valid_file)
+    except OSError:
+        return None
+    key = (valid_file, st.st_mtime_ns, st.st_size, embedding_size, embed_key)
+    with embedding_cache_lock:
+        embed_out = embedding_cache.get(key, None)
+        if embed_out is not None:
+            embedding_cache.move_to_end(key)
+            return embed_out
+
+    embed_out = load_embed_file(valid_file, embedding_name, embedding_size, embed_key)
+    if embed_out is not None:
+        with embedding_cache_lock:
+            embedding_cache[key] = embed_out
+            while len(embedding_cache) > EMBEDDING_CACHE_SIZE:
+                embedding_cache.popitem(last=False)
+    return embed_out
 
+def load_embed_file(embed_path, embedding_name, embedding_size, embed_key=None):
     embed_out = None
 
     try:
@@ -505,6 +591,36 @@ class SDTokenizer:
         self.embedding_identifier = "embedding:"
         self.embedding_size = embedding_size
         self.embedding_key = embedding_key
+        self.word_tokens = collections.OrderedDict()
+        self.word_tokens_lock = threading.Lock()
+
+    def tokenize_words(self, words):
+        """Token ids of each word without the start and end tokens, the words not seen recently are tokenized in one call."""
+        out = {}
+        with self.word_tokens_lock:
+            for word in words:
+                ids = self.word_tokens.get(word, None)
+                if ids is not None:
+                    self.word_tokens.move_to_end(word)
+                    out[word] = ids
+
+        missing = list(dict.fromkeys(w for w in words if w not in out))
+        if len(missing) > 0:
+            end = 999999999999
+            if self.tokenizer_adds_end_token:
+                end = -1
+            if isinstance(self.tokenizer, PreTrainedTokenizerBase):
+                input_ids = self.tokenizer(missing)["input_ids"]
+            else:
+                input_ids = [self.tokenizer(word)["input_ids"] for word in missing]
+            with self.word_tokens_lock:
+                for word, ids in zip(missing, input_ids):
+                    ids = tuple(ids[self.tokens_start:end])
+                    out[word] = ids
+                    self.word_tokens[word] = ids
+                while len(self.word_tokens) > WORD_TOKENS_CACHE_SIZE:
+                    self.word_tokens.popitem(last=False)
+        return [out[word] for word in words]
 
     def _try_get_embedding(self, embedding_name:str):
         '''
@@ -537,10 +653,11 @@ class SDTokenizer:
         if kwargs.get("disable_weights", False):
             parsed_weights = [(text, 1.0)]
         else:
-            parsed_weights = token_weights(text, 1.0)
+            parsed_weights = parse_prompt_weights(text)
 
-        # tokenize words
+        # tokenize words, the words are collected first so they are tokenized together
         tokens = []
+        words = []
         for weighted_segment, weight in parsed_weights:
             to_tokenize = unescape_important(weighted_segment)
             split = re.split(' {0}|\n{0}'.format(self.embedding_identifier), to_tokenize)
@@ -566,11 +683,12 @@ class SDTokenizer:
                         word = leftover
                     else:
                         continue
-                end = 999999999999
-                if self.tokenizer_adds_end_token:
-                    end = -1
                 #parse word
-                tokens.append([(t, weight) for t in self.tokenizer(word)["input_ids"][self.tokens_start:end]])
+                words.append((len(tokens), word, weight))
+                tokens.append(None)
+
+        for (i, _, weight), ids in zip(words, self.tokenize_words([w[1] for w in words])):
+            tokens[i] = [(t, weight) for t in ids]
 
         #reshape token array to CLIP input size
         batched_tokens = []
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+
+import torch
+
+ALIGNMENT = 64
+
+
+def shared_params(model):
+    return [(name, param) for name, param in model.named_parameters() if param.device.type == "cpu" and param.numel() > 0]
+
+
+def layout(params):
+    """(name, dtype, shape, offset, nbytes) of every parameter in the shared file."""
+    out = []
+    offset = 0
+    for name, param in params:
+        out.append((name, str(param.dtype).split(".")[-1], tuple(param.shape), offset, param.nbytes))
+        offset += (param.nbytes + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+    return out, offset
+
+
+class SharedWeights:
+    """
+    Keeps the weights of the models loaded on the offload device in files that are memory mapped copy-on-write,
+    so every ComfyUI process on the host that loads the same model files with the same options (and gets the
+    same weight dtypes) uses the same pages in RAM. The directory should be on a tmpfs like /dev/shm or a fast
+    disk. Writing to a weight (in place LoRA patching for example) gives the process a private copy of the pages
+    written, the files are never modified once created. The least recently used files are removed when the
+    directory grows over max_size bytes, processes that still map them keep working.
+    """
+    def __init__(self):
+        self.directory = None
+        self.max_size = 0
+        self.lock = threading.Lock()
+
+    def set_directory(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def enabled(self):
+        return self.directory is not None
+
+    def _write(self, path, params, entries, size):
+        temp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+        try:
+            with open(temp_path, "wb") as f:
+                f.truncate(size)
+                for (_, param), (_, _, _, offset, _) in zip(params, entries):
+                    f.seek(offset)
+                    f.write(param.data.detach().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def share(self, model, key):
+        """
+        Replaces the weights of model on the cpu with views of the shared file for key, writing it if no
+        other process did. key identifies the files and options the model was loaded with.
+        """
+        if not self.enabled():
+            return 0
+        params = shared_params(model)
+        if len(params) == 0:
+            return 0
+        entries, size = layout(params)
+        h = hashlib.sha256()
+        h.update(json.dumps([key, type(model).__name__, entries], default=str).encode("utf-8"))
+        path = os.path.join(self.directory, h.hexdigest() + ".bin")
+        try:
+            with self.lock:
+                if not os.path.exists(path) or os.path.getsize(path) != size:
+                    self._write(path, params, entries, size)
+                    self.evict(keep=path)
+                else:
+                    os.utime(path)
+            storage = torch.from_file(path, shared=False, size=size, dtype=torch.uint8)
+        except Exception as e:
+            logging.warning("Could not share the weights of {}: {}".format(type(model).__name__, e))
+            return 0
+
+        views = {}
+        for (name, param), (_, _, shape, offset, nbytes) in zip(params, entries):
+            views[name] = storage[offset:offset + nbytes].view(param.dtype).reshape(shape)
+        model.shared_weight_views = views
+        model.shared_weight_ptrs = set(v.data_ptr() for v in views.values())
+        self.attach(model)
+        logging.debug("Sharing {:.2f} MB of {} weights from {}".format(size / (1024 * 1024), type(model).__name__, path))
+        return size
+
+    def attach(self, model, changed=()):
+        """
+        Points the weights of model that were moved back to the cpu at the shared views again. changed has the
+        names of the weights that may have been modified (patched weights restored from their backup), only those
+        are compared with the shared ones and they stay private if they differ. Comparing every weight would read
+        all of them each time a model is offloaded.
+        """
+        views = getattr(model, "shared_weight_views", None)
+        if views is None:
+            return
+        for name, param in shared_params(model):
+            view = views.get(name, None)
+            if view is None or param.data_ptr() == view.data_ptr():
+                continue
+            if param.dtype != view.dtype or param.shape != view.shape:
+                continue
+            if name in changed and not torch.equal(param.data, view):
+                continue
+            param.data = view
+
+    def is_shared(self, model, module):
+        """True if all the weights of module (a submodule of model) are views of the shared file."""
+        shared_ptrs = getattr(model, "shared_weight_ptrs", None)
+        if shared_ptrs is None:
+            return False
+        params = list(module.parameters(recurse=False))
+        if len(params) == 0:
+            return False
+        return all(param.data_ptr() in shared_ptrs for param in params)
+
+    def evict(self, keep=None):
+        files = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".bin"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+shared_weights = SharedWeights()
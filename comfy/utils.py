@@ -20,6 +20,8 @@
 import torch
 import math
 import struct
+import json
+import collections.abc
 import comfy.checkpoint_pickle
 import safetensors.torch
 import numpy as np
@@ -54,21 +56,186 @@ if hasattr(torch.serialization, "add_safe_globals"):  # TODO: this was added in
 else:
     logging.info("Warning, you are using an old pytorch version and some ckpt/pt files might be loaded unsafely. Upgrading to 2.4 or above is recommended.")
 
-def load_torch_file(ckpt, safe_load=False, device=None, return_metadata=False):
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+    "F8_E4M3": getattr(torch, "float8_e4m3fn", None),
+    "F8_E5M2": getattr(torch, "float8_e5m2", None),
+}
+
+class TensorInfo:
+    """Shape and dtype of a tensor of a LazyStateDict that wasn't read from the file yet."""
+    def __init__(self, key, shape, dtype):
+        self.key = key
+        self.shape = torch.Size(shape)
+        self.dtype = dtype
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def dim(self):
+        return len(self.shape)
+
+    def size(self, dim=None):
+        if dim is None:
+            return self.shape
+        return self.shape[dim]
+
+    def numel(self):
+        return self.shape.numel()
+
+    def nelement(self):
+        return self.shape.numel()
+
+class LazyStateDict(collections.abc.MutableMapping):
+    """
+    State dict of a safetensors file that only reads a tensor from the file the first time it is accessed.
+    The keys, shapes and dtypes come from the header so model detection and prefix filtering don't read
+    any tensor data, and the tensors a loader never uses (the VAE of a checkpoint loaded without it for
+    example) are never read. The file stays open until close() is called (or the with block it is used in
+    ends), the tensors that were read stay valid after that.
+    """
+    def __init__(self, ckpt, device, header):
+        self.ckpt = ckpt
+        self.device = device
+        self.handle = safetensors.safe_open(ckpt, framework="pt", device=device.type)
+        self.metadata = header.get("__metadata__", None)
+        self.entries = {}
+        for k, v in header.items():
+            if k == "__metadata__":
+                continue
+            dtype = SAFETENSORS_DTYPES.get(v["dtype"], None)
+            if dtype is None:
+                raise ValueError("Unsupported safetensors dtype {} for {} in {}".format(v["dtype"], k, ckpt))
+            self.entries[k] = TensorInfo(k, v["shape"], dtype)
+
+    def empty(self):
+        """A new LazyStateDict without keys that reads from the same file."""
+        out = LazyStateDict.__new__(LazyStateDict)
+        out.ckpt = self.ckpt
+        out.device = self.device
+        out.handle = self.handle
+        out.metadata = self.metadata
+        out.entries = {}
+        return out
+
+    def close(self):
+        """Closes the file, shared with the LazyStateDicts made with empty(). Unread tensors can't be read anymore."""
+        self.handle.__exit__(None, None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _read(self, info):
+        tensor = self.handle.get_tensor(info.key)
+        if DISABLE_MMAP:
+            tensor = tensor.to(device=self.device, copy=True)
+        return tensor
+
+    def __getitem__(self, key):
+        value = self.entries[key]
+        if isinstance(value, TensorInfo):
+            value = self._read(value)
+            self.entries[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.entries[key] = value
+
+    def __delitem__(self, key):
+        del self.entries[key]
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def info(self, key):
+        """The tensor if it was already read, its TensorInfo otherwise."""
+        return self.entries[key]
+
+    def move(self, key, out, new_key):
+        """out[new_key] = self.pop(key), without reading the tensor when out reads from the same file."""
+        value = self.entries.pop(key)
+        if isinstance(out, LazyStateDict) and out.handle is self.handle:
+            out.entries[new_key] = value
+        else:
+            if isinstance(value, TensorInfo):
+                value = self._read(value)
+            out[new_key] = value
+
+class StateDictInfo(collections.abc.Mapping):
+    """Read only view of a LazyStateDict that returns TensorInfo objects instead of reading the tensors."""
+    def __init__(self, sd):
+        self.sd = sd
+
+    def __getitem__(self, key):
+        return self.sd.info(key)
+
+    def __contains__(self, key):
+        return key in self.sd
+
+    def __iter__(self):
+        return iter(self.sd)
+
+    def __len__(self):
+        return len(self.sd)
+
+def state_dict_info(sd):
+    """A mapping of sd that can be used for shapes and dtypes without reading the tensors of a LazyStateDict."""
+    if isinstance(sd, LazyStateDict):
+        return StateDictInfo(sd)
+    return sd
+
+def close_state_dict(sd):
+    """Closes the file of a state dict returned by load_torch_file(lazy=True) once the weights were loaded."""
+    if isinstance(sd, LazyStateDict):
+        sd.close()
+
+def move_key(state_dict, key, out, new_key):
+    if isinstance(state_dict, LazyStateDict):
+        state_dict.move(key, out, new_key)
+    else:
+        out[new_key] = state_dict.pop(key)
+
+def load_torch_file(ckpt, safe_load=False, device=None, return_metadata=False, lazy=False):
     if device is None:
         device = torch.device("cpu")
     metadata = None
     if ckpt.lower().endswith(".safetensors") or ckpt.lower().endswith(".sft"):
         try:
-            with safetensors.safe_open(ckpt, framework="pt", device=device.type) as f:
-                sd = {}
-                for k in f.keys():
-                    tensor = f.get_tensor(k)
-                    if DISABLE_MMAP:  # TODO: Not sure if this is the best way to bypass the mmap issues
-                        tensor = tensor.to(device=device, copy=True)
-                    sd[k] = tensor
-                if return_metadata:
-                    metadata = f.metadata()
+            header = None
+            if lazy:
+                header = safetensors_header(ckpt)
+            if header is not None:
+                sd = LazyStateDict(ckpt, device, json.loads(header))
+                metadata = sd.metadata
+            else:
+                with safetensors.safe_open(ckpt, framework="pt", device=device.type) as f:
+                    sd = {}
+                    for k in f.keys():
+                        tensor = f.get_tensor(k)
+                        if DISABLE_MMAP:  # TODO: Not sure if this is the best way to bypass the mmap issues
+                            tensor = tensor.to(device=device, copy=True)
+                        sd[k] = tensor
+                    if return_metadata:
+                        metadata = f.metadata()
         except Exception as e:
             if len(e.args) > 0:
                 message = e.args[0]
@@ -107,6 +274,7 @@ def save_torch_file(sd, ckpt, metadata=None):
 
 def calculate_parameters(sd, prefix=""):
     params = 0
+    sd = state_dict_info(sd)
     for k in sd.keys():
         if k.startswith(prefix):
             w = sd[k]
@@ -115,6 +283,7 @@ def calculate_parameters(sd, prefix=""):
 
 def weight_dtype(sd, prefix=""):
     dtypes = {}
+    sd = state_dict_info(sd)
     for k in sd.keys():
         if k.startswith(prefix):
             w = sd[k]
@@ -128,19 +297,21 @@ def weight_dtype(sd, prefix=""):
 def state_dict_key_replace(state_dict, keys_to_replace):
     for x in keys_to_replace:
         if x in state_dict:
-            state_dict[keys_to_replace[x]] = state_dict.pop(x)
+            move_key(state_dict, x, state_dict, keys_to_replace[x])
     return state_dict
 
 def state_dict_prefix_replace(state_dict, replace_prefix, filter_keys=False):
     if filter_keys:
-        out = {}
+        if isinstance(state_dict, LazyStateDict):
+            out = state_dict.empty()
+        else:
+            out = {}
     else:
         out = state_dict
     for rp in replace_prefix:
         replace = list(map(lambda a: (a, "{}{}".format(replace_prefix[rp], a[len(rp):])), filter(lambda a: a.startswith(rp), state_dict.keys())))
         for x in replace:
-            w = state_dict.pop(x[0])
-            out[x[1]] = w
+            move_key(state_dict, x[0], out, x[1])
     return out
 
 
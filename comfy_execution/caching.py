@@ -1,9 +1,13 @@
 import itertools
+import logging
+import sys
+import time
 from typing import Sequence, Mapping, Dict
 from comfy_execution.graph import DynamicPrompt
 from abc import ABC, abstractmethod
 
 import nodes
+import torch
 
 from comfy_execution.graph_utils import is_link
 
@@ -41,10 +45,20 @@ class CacheKeySet(ABC):
     def get_subcache_key(self, node_id):
         return self.subcache_keys.get(node_id, None)
 
+    def reuse_keys_from(self, previous):
+        """Called with the key set of the previous prompt, before add_keys. previous may be None."""
+        pass
+
 class Unhashable:
     def __init__(self):
         self.value = float("NaN")
 
+def values_equal(a, b):
+    try:
+        return bool(a == b)
+    except Exception:
+        return False
+
 def to_hashable(obj):
     # So that we don't infinitely recurse since frozenset and tuples
     # are Sequences.
@@ -78,10 +92,20 @@ class CacheKeySetInputSignature(CacheKeySet):
         super().__init__(dynprompt, node_ids, is_changed_cache)
         self.dynprompt = dynprompt
         self.is_changed_cache = is_changed_cache
+        self.previous = None
+        self.unchanged = {}
 
     def include_node_id_in_input(self) -> bool:
         return False
 
+    def reuse_keys_from(self, previous):
+        # Only key sets built the same way produce the same signatures.
+        if previous is not None and type(previous) is type(self):
+            self.previous = previous
+            # Older prompts are not needed anymore, don't keep them alive.
+            previous.previous = None
+            previous.unchanged = {}
+
     async def add_keys(self, node_ids):
         for node_id in node_ids:
             if node_id in self.keys:
@@ -89,9 +113,38 @@ class CacheKeySetInputSignature(CacheKeySet):
             if not self.dynprompt.has_node(node_id):
                 continue
             node = self.dynprompt.get_node(node_id)
-            self.keys[node_id] = await self.get_node_signature(self.dynprompt, node_id)
+            if node_id in self.previous_keys() and await self.is_unchanged(node_id):
+                self.keys[node_id] = self.previous.keys[node_id]
+            else:
+                self.keys[node_id] = await self.get_node_signature(self.dynprompt, node_id)
             self.subcache_keys[node_id] = (node_id, node["class_type"])
 
+    def previous_keys(self):
+        return self.previous.keys if self.previous is not None else {}
+
+    # A node is unchanged when it, its IS_CHANGED result and all of its ancestors are the same as in
+    # the previous prompt. Its signature from the previous prompt can then be used as it is, so only
+    # the nodes downstream of a change have their ancestry walked again.
+    async def is_unchanged(self, node_id):
+        if node_id in self.unchanged:
+            return self.unchanged[node_id]
+        self.unchanged[node_id] = False
+        prompt = self.dynprompt.get_original_prompt()
+        previous_prompt = self.previous.dynprompt.get_original_prompt()
+        if node_id not in prompt or node_id not in previous_prompt:
+            return False
+        node = prompt[node_id]
+        if node is not previous_prompt[node_id] and not values_equal(node, previous_prompt[node_id]):
+            return False
+        previous_is_changed = self.previous.is_changed_cache.is_changed.get(node_id, float("NaN"))
+        if not values_equal(await self.is_changed_cache.get(node_id), previous_is_changed):
+            return False
+        for value in node["inputs"].values():
+            if is_link(value) and not await self.is_unchanged(value[0]):
+                return False
+        self.unchanged[node_id] = True
+        return True
+
     async def get_node_signature(self, dynprompt, node_id):
         signature = []
         ancestors, order_mapping = self.get_ordered_ancestry(dynprompt, node_id)
@@ -149,10 +202,18 @@ class BasicCache:
         self.cache_key_set: CacheKeySet
         self.cache = {}
         self.subcaches = {}
+        self.disk_cache = None
+        self.disk_cache_misses = set()
+
+    def set_disk_cache(self, disk_cache):
+        self.disk_cache = disk_cache
 
     async def set_prompt(self, dynprompt, node_ids, is_changed_cache):
+        self.disk_cache_misses.clear()
         self.dynprompt = dynprompt
+        previous = self.cache_key_set if self.initialized else None
         self.cache_key_set = self.key_class(dynprompt, node_ids, is_changed_cache)
+        self.cache_key_set.reuse_keys_from(previous)
         await self.cache_key_set.add_keys(node_ids)
         self.is_changed_cache = is_changed_cache
         self.initialized = True
@@ -192,6 +253,8 @@ class BasicCache:
         assert self.initialized
         cache_key = self.cache_key_set.get_data_key(node_id)
         self.cache[cache_key] = value
+        if self._use_disk_cache(node_id, cache_key):
+            self.disk_cache.set(cache_key, value)
 
     def _get_immediate(self, node_id):
         if not self.initialized:
@@ -199,14 +262,33 @@ class BasicCache:
         cache_key = self.cache_key_set.get_data_key(node_id)
         if cache_key in self.cache:
             return self.cache[cache_key]
+        elif self._use_disk_cache(node_id, cache_key) and cache_key not in self.disk_cache_misses:
+            value = self.disk_cache.get(cache_key)
+            if value is None:
+                self.disk_cache_misses.add(cache_key)
+                return None
+            self.cache[cache_key] = value
+            return value
         else:
             return None
 
+    def lookup(self, node_id):
+        # The lookup that decides whether a node gets executed, other gets are only probes
+        return self.get(node_id)
+
+    def _use_disk_cache(self, node_id, cache_key):
+        if self.disk_cache is None or cache_key is None:
+            return False
+        if not self.dynprompt.has_node(node_id):
+            return False
+        return self.disk_cache.is_enabled_for(self.dynprompt.get_node(node_id)["class_type"])
+
     async def _ensure_subcache(self, node_id, children_ids):
         subcache_key = self.cache_key_set.get_subcache_key(node_id)
         subcache = self.subcaches.get(subcache_key, None)
         if subcache is None:
             subcache = BasicCache(self.key_class)
+            subcache.set_disk_cache(self.disk_cache)
             self.subcaches[subcache_key] = subcache
         await subcache.set_prompt(self.dynprompt, children_ids, self.is_changed_cache)
         return subcache
@@ -318,6 +400,180 @@ class LRUCache(BasicCache):
         return self
 
 
+def estimate_output_size(obj, seen=None):
+    """
+    Estimate the number of bytes held by a cached node output.
+
+    Returns a (ram_bytes, vram_bytes) tuple. Tensors are counted by the size of their
+    underlying storage (so views of a large tensor are charged for the whole storage) and
+    each storage is only counted once. Lists, tuples and dicts (e.g. latents) are walked
+    recursively. Other objects such as models are not counted since their memory is
+    managed by comfy.model_management.
+    """
+    if seen is None:
+        seen = set()
+    if isinstance(obj, torch.Tensor):
+        storage = obj.untyped_storage()
+        key = (obj.device, storage.data_ptr())
+        if key in seen:
+            return 0, 0
+        seen.add(key)
+        size = storage.nbytes()
+        if obj.device.type == "cpu":
+            return size, 0
+        return 0, size
+    if isinstance(obj, (str, bytes)):
+        return sys.getsizeof(obj), 0
+    ram, vram = 0, 0
+    if isinstance(obj, Mapping):
+        items = obj.values()
+    elif isinstance(obj, (list, tuple)):
+        items = obj
+    else:
+        nbytes = getattr(obj, "nbytes", None)  # numpy arrays
+        if isinstance(nbytes, int):
+            return nbytes, 0
+        return 0, 0
+    if id(obj) in seen:
+        return 0, 0
+    seen.add(id(obj))
+    for item in items:
+        r, v = estimate_output_size(item, seen)
+        ram += r
+        vram += v
+    return ram, vram
+
+class MemoryBudgetCache(LRUCache):
+    """
+    An LRU style cache that evicts by the byte size of cached outputs instead of by the
+    number of cached nodes.
+
+    Entries that were not used by the current prompt are evicted once the RAM or VRAM held
+    by the cache goes over budget. The entry with the lowest score is evicted first, where
+    the score is the time it took to compute the entry divided by its size, decayed by the
+    number of prompts since the entry was last used. Large outputs that are cheap to
+    recompute (e.g. decoded images) are dropped before small expensive ones (e.g. encoded
+    conditioning).
+
+    The compute time of an entry is the time between the last cache miss for the node and
+    the moment its output is stored, which is the execution time of the node itself.
+    Hits and misses are only counted by lookup(), the check that decides whether a node is
+    executed, and not by the other gets done while building the execution list.
+    """
+
+    def __init__(self, key_class, ram_budget, vram_budget=None):
+        super().__init__(key_class, max_size=0)
+        self.ram_budget = ram_budget
+        self.vram_budget = vram_budget
+        self.ram_used = 0
+        self.vram_used = 0
+        self.sizes = {}
+        self.compute_times = {}
+        self.miss_times = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def _over_budget(self):
+        if self.ram_used > self.ram_budget:
+            return True
+        return self.vram_budget is not None and self.vram_used > self.vram_budget
+
+    def _score(self, key):
+        ram, vram = self.sizes[key]
+        age = self.generation - self.used_generation.get(key, 0)
+        return self.compute_times.get(key, 0.0) / max(ram + vram, 1) / (age + 1)
+
+    def _evict(self):
+        candidates = [key for key in self.cache if self.used_generation.get(key, 0) < self.generation]
+        candidates.sort(key=self._score)
+        for key in candidates:
+            if not self._over_budget():
+                break
+            ram, vram = self.sizes.get(key, (0, 0))
+            self._remove_key(key)
+            self.evictions += 1
+            self.evicted_bytes += ram + vram
+
+    def _remove_key(self, key):
+        del self.cache[key]
+        ram, vram = self.sizes.pop(key, (0, 0))
+        self.ram_used -= ram
+        self.vram_used -= vram
+        self.used_generation.pop(key, None)
+        self.compute_times.pop(key, None)
+        self.children.pop(key, None)
+
+    async def set_prompt(self, dynprompt, node_ids, is_changed_cache):
+        self.miss_times.clear()
+        await super().set_prompt(dynprompt, node_ids, is_changed_cache)
+
+    def clean_unused(self):
+        if self._over_budget():
+            self._evict()
+        self._clean_subcaches()
+        self.log_stats()
+
+    def get(self, node_id):
+        value = super().get(node_id)
+        if value is not None:
+            cache_key = self.cache_key_set.get_data_key(node_id)
+            if cache_key not in self.sizes:
+                # Loaded from the disk cache
+                self._update_size(cache_key, value)
+        return value
+
+    def lookup(self, node_id):
+        value = self.get(node_id)
+        if value is None:
+            self.misses += 1
+            cache_key = self.cache_key_set.get_data_key(node_id) if self.initialized else None
+            if cache_key is not None:
+                self.miss_times[cache_key] = time.perf_counter()
+        else:
+            self.hits += 1
+        return value
+
+    def _update_size(self, cache_key, value):
+        ram, vram = self.sizes.get(cache_key, (0, 0))
+        self.ram_used -= ram
+        self.vram_used -= vram
+        ram, vram = estimate_output_size(value)
+        self.sizes[cache_key] = (ram, vram)
+        self.ram_used += ram
+        self.vram_used += vram
+
+    def set(self, node_id, value):
+        super().set(node_id, value)
+        cache_key = self.cache_key_set.get_data_key(node_id)
+        self._update_size(cache_key, value)
+        miss_time = self.miss_times.pop(cache_key, None)
+        if miss_time is not None:
+            self.compute_times[cache_key] = time.perf_counter() - miss_time
+        if self._over_budget():
+            self._evict()
+
+    def get_stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "evicted_bytes": self.evicted_bytes,
+            "entries": len(self.cache),
+            "ram_used": self.ram_used,
+            "vram_used": self.vram_used,
+            "ram_budget": self.ram_budget,
+            "vram_budget": self.vram_budget,
+        }
+
+    def log_stats(self):
+        stats = self.get_stats()
+        logging.debug("Output cache: {} entries, {:.2f} MB RAM, {:.2f} MB VRAM, {} hits, {} misses, {} evictions".format(
+            stats["entries"], stats["ram_used"] / (1024 * 1024), stats["vram_used"] / (1024 * 1024),
+            stats["hits"], stats["misses"], stats["evictions"]))
+
+
 class DependencyAwareCache(BasicCache):
     """
     A cache implementation that tracks dependencies between nodes and manages
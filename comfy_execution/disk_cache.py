@@ -0,0 +1,203 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import uuid
+
+import safetensors
+import safetensors.torch
+import torch
+
+import comfyui_version
+
+
+class NotSerializable(Exception):
+    pass
+
+
+def _signature_digest(obj):
+    # The in-memory cache keys are built from frozensets, whose iteration order (and hash) is not
+    # stable between processes, so the digest of a frozenset is computed from its sorted child digests.
+    h = hashlib.sha256()
+    if obj is None:
+        h.update(b"N")
+    elif isinstance(obj, bool):
+        h.update(b"B1" if obj else b"B0")
+    elif isinstance(obj, int):
+        h.update(b"I" + str(obj).encode())
+    elif isinstance(obj, float):
+        if math.isnan(obj):
+            # NaN is used for values that should never be considered equal (e.g. IS_CHANGED results)
+            raise NotSerializable()
+        h.update(b"F" + repr(obj).encode())
+    elif isinstance(obj, str):
+        h.update(b"S" + obj.encode("utf-8", "surrogatepass"))
+    elif isinstance(obj, tuple):
+        h.update(b"(")
+        for x in obj:
+            h.update(_signature_digest(x))
+        h.update(b")")
+    elif isinstance(obj, frozenset):
+        h.update(b"{")
+        for d in sorted(_signature_digest(x) for x in obj):
+            h.update(d)
+        h.update(b"}")
+    else:
+        raise NotSerializable()
+    return h.digest()
+
+
+def signature_hash(signature):
+    """
+    Returns a hex digest of a cache signature that is stable across processes, or None if the
+    signature contains values that can never match (NaN, unhashable inputs).
+    """
+    try:
+        digest = _signature_digest(signature)
+    except NotSerializable:
+        return None
+    h = hashlib.sha256(comfyui_version.__version__.encode())
+    h.update(digest)
+    return h.hexdigest()
+
+
+def _flatten(obj, tensors, storages):
+    if isinstance(obj, torch.Tensor):
+        t = obj.detach().to("cpu").contiguous()
+        ptr = t.untyped_storage().data_ptr()
+        if ptr in storages:
+            t = t.clone()
+        storages.add(t.untyped_storage().data_ptr())
+        name = str(len(tensors))
+        tensors[name] = t
+        return {"t": name}
+    if obj is None or isinstance(obj, (bool, int, str)):
+        return {"v": obj}
+    if isinstance(obj, float):
+        if not math.isfinite(obj):
+            raise NotSerializable()
+        return {"v": obj}
+    if isinstance(obj, list):
+        return {"l": [_flatten(x, tensors, storages) for x in obj]}
+    if isinstance(obj, tuple):
+        return {"u": [_flatten(x, tensors, storages) for x in obj]}
+    if isinstance(obj, dict):
+        if not all(isinstance(k, str) for k in obj):
+            raise NotSerializable()
+        return {"d": {k: _flatten(v, tensors, storages) for k, v in obj.items()}}
+    raise NotSerializable()
+
+
+def _unflatten(obj, tensors):
+    if "t" in obj:
+        return tensors[obj["t"]]
+    if "v" in obj:
+        return obj["v"]
+    if "l" in obj:
+        return [_unflatten(x, tensors) for x in obj["l"]]
+    if "u" in obj:
+        return tuple(_unflatten(x, tensors) for x in obj["u"])
+    return {k: _unflatten(v, tensors) for k, v in obj["d"].items()}
+
+
+class DiskCache:
+    """
+    Second tier for the node output cache that stores the outputs of selected node classes as
+    safetensors files in a directory, keyed by a hash of their input signature.
+
+    Files are written atomically so several ComfyUI processes can share the same directory. Reads
+    refresh the file mtime and the least recently used files are removed when the directory grows
+    over max_size bytes.
+    """
+
+    def __init__(self, directory, max_size, node_classes):
+        self.directory = directory
+        self.max_size = max_size
+        self.node_classes = set(node_classes)
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self.total_size = self._scan()[1]
+
+    def is_enabled_for(self, class_type):
+        return class_type in self.node_classes
+
+    def _path(self, key_hash):
+        return os.path.join(self.directory, key_hash[:2], key_hash + ".safetensors")
+
+    def _scan(self):
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(".safetensors"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        return files, total
+
+    def get(self, signature):
+        key_hash = signature_hash(signature)
+        if key_hash is None:
+            return None
+        path = self._path(key_hash)
+        if not os.path.exists(path):
+            return None
+        try:
+            tensors = safetensors.torch.load_file(path)
+            with safetensors.safe_open(path, framework="pt") as f:
+                structure = json.loads(f.metadata()["structure"])
+            os.utime(path)
+        except Exception as e:
+            logging.warning("Failed to load disk cache entry {}: {}".format(path, e))
+            return None
+        return _unflatten(structure, tensors)
+
+    def set(self, signature, value):
+        key_hash = signature_hash(signature)
+        if key_hash is None:
+            return False
+        tensors = {}
+        try:
+            structure = _flatten(value, tensors, set())
+        except NotSerializable:
+            return False
+
+        path = self._path(key_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+        try:
+            safetensors.torch.save_file(tensors, temp_path, metadata={"structure": json.dumps(structure)})
+            size = os.path.getsize(temp_path)
+            os.replace(temp_path, path)
+        except Exception as e:
+            logging.warning("Failed to write disk cache entry {}: {}".format(path, e))
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+
+        with self.lock:
+            self.total_size += size
+            if self.total_size > self.max_size:
+                self.evict()
+        return True
+
+    def evict(self):
+        # Rescan since other processes might have written or evicted entries
+        files, total = self._scan()
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        self.total_size = total
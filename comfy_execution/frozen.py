@@ -0,0 +1,82 @@
+import copy
+
+
+def _immutable(self, *args, **kwargs):
+    raise TypeError("'{}' object is immutable".format(type(self).__name__))
+
+
+class FrozenDict(dict):
+    """
+    A dict that can't be modified after creation. It is still a dict, so it can be serialized to
+    JSON and passed to code that only reads from it without any conversion.
+    """
+    __setitem__ = _immutable
+    __delitem__ = _immutable
+    __ior__ = _immutable
+    clear = _immutable
+    pop = _immutable
+    popitem = _immutable
+    setdefault = _immutable
+    update = _immutable
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self, memo)
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+class FrozenList(list):
+    """A list that can't be modified after creation."""
+    __setitem__ = _immutable
+    __delitem__ = _immutable
+    __iadd__ = _immutable
+    __imul__ = _immutable
+    append = _immutable
+    extend = _immutable
+    insert = _immutable
+    pop = _immutable
+    remove = _immutable
+    clear = _immutable
+    sort = _immutable
+    reverse = _immutable
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self, memo)
+
+    def __reduce__(self):
+        return (FrozenList, (list(self),))
+
+
+def freeze(obj):
+    """
+    Returns an immutable version of obj where every dict and list is replaced by a FrozenDict or
+    FrozenList. Containers that are already frozen are reused as they are, so freezing a structure
+    built from other frozen parts only copies the new parts.
+    """
+    if isinstance(obj, (FrozenDict, FrozenList)):
+        return obj
+    if isinstance(obj, dict):
+        return FrozenDict((k, freeze(v)) for k, v in obj.items())
+    if isinstance(obj, list):
+        return FrozenList(freeze(v) for v in obj)
+    if isinstance(obj, tuple) and type(obj) is tuple:
+        return tuple(freeze(v) for v in obj)
+    return obj
+
+
+def thaw(obj, memo=None):
+    """Returns a mutable deep copy of a structure created by freeze()."""
+    if isinstance(obj, dict):
+        return {k: thaw(v, memo) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [thaw(v, memo) for v in obj]
+    if isinstance(obj, tuple) and type(obj) is tuple:
+        return tuple(thaw(v, memo) for v in obj)
+    return copy.deepcopy(obj, memo)
@@ -5,6 +5,7 @@ import nodes
 import asyncio
 import inspect
 from comfy_execution.graph_utils import is_link, ExecutionBlocker
+from comfy_execution.parallel import get_node_resource
 from comfy.comfy_types.node_typing import ComfyNodeABC, InputTypeDict, InputTypeOptions
 
 # NOTE: ExecutionBlocker code got moved to graph_utils.py to prevent torch being imported too soon during unit tests
@@ -194,6 +195,8 @@ class ExecutionList(TopologicalSort):
         super().__init__(dynprompt)
         self.output_cache = output_cache
         self.staged_node_id = None
+        # Resources of the nodes that run in background threads (see comfy_execution.parallel)
+        self.background_resources = set()
 
     def is_cached(self, node_id):
         return self.output_cache.get(node_id) is not None
@@ -243,11 +246,13 @@ class ExecutionList(TopologicalSort):
                 return True
             return False
 
-        # If an available node is async, do that first.
+        # If an available node is async or runs in a background thread, do that first.
         # This will execute the asynchronous function earlier, reducing the overall time.
         def is_async(node_id):
             class_type = self.dynprompt.get_node(node_id)["class_type"]
             class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
+            if get_node_resource(class_def) in self.background_resources:
+                return True
             return inspect.iscoroutinefunction(getattr(class_def, class_def.FUNCTION))
 
         for node_id in node_list:
@@ -1,3 +1,5 @@
+import threading
+
 def is_link(obj):
     if not isinstance(obj, list):
         return False
@@ -9,11 +11,15 @@ def is_link(obj):
         return False
     return True
 
+# The default prefix is per thread so prompts executing concurrently don't allocate the same node ids
+class _DefaultPrefix(threading.local):
+    root = ""
+    call_index = 0
+    graph_index = 0
+
 # The GraphBuilder is just a utility class that outputs graphs in the form expected by the ComfyUI back-end
 class GraphBuilder:
-    _default_prefix_root = ""
-    _default_prefix_call_index = 0
-    _default_prefix_graph_index = 0
+    _default_prefix = _DefaultPrefix()
 
     def __init__(self, prefix = None):
         if prefix is None:
@@ -25,20 +31,20 @@ class GraphBuilder:
 
     @classmethod
     def set_default_prefix(cls, prefix_root, call_index, graph_index = 0):
-        cls._default_prefix_root = prefix_root
-        cls._default_prefix_call_index = call_index
-        cls._default_prefix_graph_index = graph_index
+        cls._default_prefix.root = prefix_root
+        cls._default_prefix.call_index = call_index
+        cls._default_prefix.graph_index = graph_index
 
     @classmethod
     def alloc_prefix(cls, root=None, call_index=None, graph_index=None):
         if root is None:
-            root = GraphBuilder._default_prefix_root
+            root = GraphBuilder._default_prefix.root
         if call_index is None:
-            call_index = GraphBuilder._default_prefix_call_index
+            call_index = GraphBuilder._default_prefix.call_index
         if graph_index is None:
-            graph_index = GraphBuilder._default_prefix_graph_index
+            graph_index = GraphBuilder._default_prefix.graph_index
         result = f"{root}.{call_index}.{graph_index}."
-        GraphBuilder._default_prefix_graph_index += 1
+        GraphBuilder._default_prefix.graph_index += 1
         return result
 
     def node(self, class_type, id=None, **kwargs):
@@ -0,0 +1,78 @@
+import asyncio
+import concurrent.futures
+import contextvars
+
+# Resources a node class can declare with EXECUTION_RESOURCE. They decide which nodes may run at the
+# same time when parallel node execution is enabled:
+#  - GPU nodes run on the prompt worker thread like without parallel execution, one at a time.
+#  - CPU nodes run in a pool of background threads, several at a time.
+#  - IO nodes run one at a time in a background thread, in the order they became ready. This keeps
+#    things like the file name counters of the save nodes race free.
+# Nodes that don't declare a resource are assumed to use the GPU.
+RESOURCE_GPU = "GPU"
+RESOURCE_CPU = "CPU"
+RESOURCE_IO = "IO"
+
+# Functions that capture thread local state of the prompt worker thread. They return a function that
+# restores that state in the background thread running a node.
+thread_state_capturers = []
+
+
+def get_node_resource(class_def):
+    return getattr(class_def, "EXECUTION_RESOURCE", RESOURCE_GPU)
+
+
+def _capture_progress_state():
+    from comfy_execution.progress import get_progress_state, thread_progress_registry
+    registry = get_progress_state()
+    def restore():
+        thread_progress_registry.registry = registry
+    return restore
+
+thread_state_capturers.append(_capture_progress_state)
+
+
+def _capture_interrupt_thread():
+    # /interrupt flags the prompt worker thread, the nodes it runs in the background check that flag
+    import comfy.model_management
+    thread_id = comfy.model_management.get_interrupt_thread_id()
+    def restore():
+        comfy.model_management.set_interrupt_thread_id(thread_id)
+    return restore
+
+thread_state_capturers.append(_capture_interrupt_thread)
+
+
+class NodeThreadPool:
+    """Runs the functions of CPU and IO nodes in background threads so they overlap with other nodes."""
+    def __init__(self, max_workers):
+        self.executors = {
+            RESOURCE_CPU: concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="comfy_cpu_node"),
+            RESOURCE_IO: concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="comfy_io_node"),
+        }
+
+    @property
+    def resources(self):
+        return set(self.executors.keys())
+
+    def can_run(self, class_def):
+        return get_node_resource(class_def) in self.executors
+
+    def submit(self, class_def, f, args, pre_execute_cb=None):
+        """Calls f(**args) in a background thread, returns an asyncio.Task with the result."""
+        executor = self.executors[get_node_resource(class_def)]
+        restore_functions = [capture() for capture in thread_state_capturers]
+        context = contextvars.copy_context()
+        def call():
+            for restore in restore_functions:
+                restore()
+            if pre_execute_cb is not None:
+                pre_execute_cb()
+            return f(**args)
+        async def run():
+            return await asyncio.get_running_loop().run_in_executor(executor, context.run, call)
+        return asyncio.create_task(run())
+
+    def shutdown(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,326 @@
+import asyncio
+import copy
+import json
+import logging
+import math
+import time
+
+import torch
+
+import comfy.sample
+import comfy.samplers
+import comfy.utils
+import execution
+import latent_preview
+import nodes
+from comfy_execution.graph_utils import is_link
+
+# Samplers that don't add noise while sampling. For these, sampling a batch gives the same result as
+# sampling every batch item on its own, so prompts can be fused without changing their outputs.
+DETERMINISTIC_SAMPLERS = {
+    "euler", "euler_cfg_pp", "heun", "heunpp2", "dpm_2", "lms", "dpmpp_2m", "dpmpp_2m_cfg_pp",
+    "ipndm", "ipndm_v", "deis", "res_multistep", "res_multistep_cfg_pp", "gradient_estimation",
+    "gradient_estimation_cfg_pp", "ddim", "uni_pc", "uni_pc_bh2",
+}
+
+BATCHABLE_SAMPLERS = {"KSampler"}
+# Node inputs that may differ between prompts fused into one batch
+BATCHABLE_INPUTS = {
+    "KSampler": "seed",
+    "CLIPTextEncode": "text",
+}
+FUSED_SAMPLER_CLASS = "KSamplerBatched"
+MAXIMUM_FUSED_PROMPTS = 64
+
+
+def get_batch_key(prompt, execute_outputs):
+    """
+    Returns a key that is equal for prompts that only differ in the inputs listed in BATCHABLE_INPUTS,
+    or None if the prompt can't be fused with others.
+    """
+    samplers = [node_id for node_id, node in prompt.items() if node["class_type"] in BATCHABLE_SAMPLERS]
+    if len(samplers) != 1:
+        return None
+    if prompt[samplers[0]]["inputs"].get("sampler_name") not in DETERMINISTIC_SAMPLERS:
+        return None
+    canonical = {}
+    for node_id, node in prompt.items():
+        inputs = dict(node["inputs"])
+        batchable_input = BATCHABLE_INPUTS.get(node["class_type"], None)
+        if batchable_input is not None and not is_link(inputs.get(batchable_input)):
+            inputs.pop(batchable_input, None)
+        canonical[node_id] = {"class_type": node["class_type"], "inputs": inputs}
+    try:
+        return json.dumps([canonical, sorted(execute_outputs)], sort_keys=True)
+    except TypeError:
+        return None
+
+
+def fuse_prompts(prompts, execute_outputs):
+    """
+    Fuses prompts that have the same batch key into a single prompt where the sampler is replaced by
+    a KSamplerBatched node. Nodes that depend on the inputs that differ between the prompts are
+    duplicated for every prompt, everything else is shared.
+
+    Returns (fused_prompt, fused_outputs, node_maps) where node_maps[i] maps the ids of the nodes
+    duplicated for prompts[i] back to their original ids, or None if the prompts can't be fused.
+    """
+    base = prompts[0]
+    sampler_id = [node_id for node_id, node in base.items() if node["class_type"] in BATCHABLE_SAMPLERS][0]
+
+    consumers = {node_id: [] for node_id in base}
+    for node_id, node in base.items():
+        for value in node["inputs"].values():
+            if is_link(value) and value[0] in consumers:
+                consumers[value[0]].append(node_id)
+
+    varying = [node_id for node_id in base if any(p[node_id]["inputs"] != base[node_id]["inputs"] for p in prompts[1:])]
+    per_prompt = set()
+    to_visit = varying + [sampler_id]
+    while len(to_visit) > 0:
+        node_id = to_visit.pop()
+        if node_id in per_prompt:
+            continue
+        per_prompt.add(node_id)
+        to_visit.extend(consumers[node_id])
+    per_prompt.discard(sampler_id)
+
+    sampler_inputs = base[sampler_id]["inputs"]
+    for name, value in sampler_inputs.items():
+        if name not in ("positive", "negative") and is_link(value) and value[0] in per_prompt:
+            return None
+
+    def node_id_for(i, node_id):
+        return "{}.batch{}".format(node_id, i)
+
+    def remap(i, value):
+        if not is_link(value):
+            return value
+        if value[0] == sampler_id:
+            return [sampler_id, i]
+        if value[0] in per_prompt:
+            return [node_id_for(i, value[0]), value[1]]
+        return value
+
+    fused = {}
+    for node_id, node in base.items():
+        if node_id not in per_prompt and node_id != sampler_id:
+            fused[node_id] = copy.deepcopy(node)
+
+    node_maps = []
+    fused_sampler_inputs = {k: v for k, v in sampler_inputs.items() if k not in ("positive", "negative", "seed")}
+    for i, prompt in enumerate(prompts):
+        node_map = {}
+        for node_id in per_prompt:
+            node = copy.deepcopy(prompt[node_id])
+            node["inputs"] = {k: remap(i, v) for k, v in node["inputs"].items()}
+            fused[node_id_for(i, node_id)] = node
+            node_map[node_id_for(i, node_id)] = node_id
+        node_maps.append(node_map)
+        inputs = prompt[sampler_id]["inputs"]
+        fused_sampler_inputs["positive_{}".format(i)] = remap(i, inputs["positive"])
+        fused_sampler_inputs["negative_{}".format(i)] = remap(i, inputs["negative"])
+        fused_sampler_inputs["seed_{}".format(i)] = inputs["seed"]
+    fused[sampler_id] = {"class_type": FUSED_SAMPLER_CLASS, "inputs": fused_sampler_inputs}
+
+    fused_outputs = []
+    for node_id in execute_outputs:
+        if node_id in per_prompt:
+            fused_outputs += [node_id_for(i, node_id) for i in range(len(prompts))]
+        else:
+            fused_outputs.append(node_id)
+    return fused, fused_outputs, node_maps
+
+
+def _batch_conditioning(conds, batch_size):
+    # Every conditioning must be a single entry (as output by CLIPTextEncode) with matching extras
+    if any(len(c) != 1 for c in conds):
+        return None
+    tensors = [c[0][0] for c in conds]
+    if any(t.shape[0] != 1 or t.shape[2] != tensors[0].shape[2] for t in tensors):
+        return None
+    max_len = math.lcm(*[t.shape[1] for t in tensors])
+    if max_len // min(t.shape[1] for t in tensors) > 4:
+        return None
+    # padding with repeat doesn't change result
+    tensors = [t.repeat(batch_size, max_len // t.shape[1], 1) for t in tensors]
+
+    extras = {}
+    for key in conds[0][0][1]:
+        values = [c[0][1].get(key, None) for c in conds]
+        if isinstance(values[0], torch.Tensor):
+            if any(not isinstance(v, torch.Tensor) or v.shape != values[0].shape or v.shape[0] != 1 for v in values):
+                return None
+            extras[key] = torch.cat([v.repeat_interleave(batch_size, dim=0) for v in values])
+        else:
+            if any(v is not values[0] and v != values[0] for v in values):
+                return None
+            extras[key] = values[0]
+    if any(set(c[0][1].keys()) != set(extras.keys()) for c in conds):
+        return None
+    return [[torch.cat(tensors), extras]]
+
+
+class KSamplerBatched:
+    """
+    Samples the latent once for every set of positive/negative conditioning and seed in a single
+    batched run. Used in place of a KSampler when several queued prompts are fused together.
+    """
+    @classmethod
+    def INPUT_TYPES(s):
+        optional = {}
+        for i in range(MAXIMUM_FUSED_PROMPTS):
+            optional["positive_{}".format(i)] = ("CONDITIONING", )
+            optional["negative_{}".format(i)] = ("CONDITIONING", )
+            optional["seed_{}".format(i)] = ("INT", {"default": 0, "min": 0, "max": 0xffffffffffffffff})
+        return {
+            "required": {
+                "model": ("MODEL", ),
+                "steps": ("INT", {"default": 20, "min": 1, "max": 10000}),
+                "cfg": ("FLOAT", {"default": 8.0, "min": 0.0, "max": 100.0, "step": 0.1, "round": 0.01}),
+                "sampler_name": (sorted(DETERMINISTIC_SAMPLERS), ),
+                "scheduler": (comfy.samplers.KSampler.SCHEDULERS, ),
+                "latent_image": ("LATENT", ),
+                "denoise": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 1.0, "step": 0.01}),
+            },
+            "optional": optional,
+        }
+
+    RETURN_TYPES = ("LATENT",) * MAXIMUM_FUSED_PROMPTS
+    FUNCTION = "sample"
+
+    CATEGORY = "_for_testing"
+    DESCRIPTION = "Used internally to sample several fused prompts in one batch."
+    # Not listed in /object_info and not accepted in the prompts sent to /prompt
+    INTERNAL = True
+
+    def sample(self, model, steps, cfg, sampler_name, scheduler, latent_image, denoise=1.0, **kwargs):
+        count = len([k for k in kwargs if k.startswith("seed_")])
+        seeds = [kwargs["seed_{}".format(i)] for i in range(count)]
+        positives = [kwargs["positive_{}".format(i)] for i in range(count)]
+        negatives = [kwargs["negative_{}".format(i)] for i in range(count)]
+
+        latent = latent_image["samples"]
+        latent = comfy.sample.fix_empty_latent_channels(model, latent)
+        batch_size = latent.shape[0]
+        positive = _batch_conditioning(positives, batch_size)
+        negative = _batch_conditioning(negatives, batch_size)
+        if positive is None or negative is None:
+            logging.info("Conditioning can't be batched, sampling {} fused prompts one at a time.".format(count))
+            outputs = []
+            for i in range(count):
+                outputs += nodes.common_ksampler(model, seeds[i], steps, cfg, sampler_name, scheduler, positives[i], negatives[i], latent_image, denoise=denoise)
+            return tuple(outputs)
+
+        batch_inds = latent_image["batch_index"] if "batch_index" in latent_image else None
+        noise = torch.cat([comfy.sample.prepare_noise(latent, seed, batch_inds) for seed in seeds])
+        noise_mask = None
+        if "noise_mask" in latent_image:
+            noise_mask = latent_image["noise_mask"]
+            if noise_mask.shape[0] > 1:
+                noise_mask = torch.cat([noise_mask] * count)
+
+        callback = latent_preview.prepare_callback(model, steps)
+        disable_pbar = not comfy.utils.PROGRESS_BAR_ENABLED
+        samples = comfy.sample.sample(model, noise, steps, cfg, sampler_name, scheduler, positive, negative, torch.cat([latent] * count),
+                                      denoise=denoise, noise_mask=noise_mask, callback=callback, disable_pbar=disable_pbar, seed=seeds[0])
+        outputs = []
+        for i in range(count):
+            out = latent_image.copy()
+            out["samples"] = samples[i * batch_size:(i + 1) * batch_size]
+            outputs.append(out)
+        return tuple(outputs)
+
+
+def _map_node_id(node_map, shared_nodes, node_id):
+    if node_id in node_map:
+        return node_map[node_id]
+    if node_id in shared_nodes:
+        return node_id
+    return None
+
+
+class SamplerBatcher:
+    """
+    Collects queued prompts that only differ in their sampler seed and text prompts, executes them as
+    one fused prompt and splits the results back into the history of every prompt.
+    """
+    def __init__(self, max_batch_size, max_wait):
+        self.max_batch_size = min(max_batch_size, MAXIMUM_FUSED_PROMPTS)
+        self.max_wait = max_wait
+        nodes.NODE_CLASS_MAPPINGS[FUSED_SAMPLER_CLASS] = KSamplerBatched
+
+    def collect(self, queue, item, item_id):
+        key = get_batch_key(item[2], item[4])
+        if key is None:
+            return [(item, item_id)]
+        others = queue.get_compatible(lambda x: get_batch_key(x[2], x[4]) == key, self.max_batch_size - 1, self.max_wait)
+        return [(item, item_id)] + others
+
+    def execute(self, executor, batch):
+        items = [item for item, _ in batch]
+        fused = fuse_prompts([item[2] for item in items], items[0][4])
+        if fused is None:
+            return None
+        fused_prompt, fused_outputs, node_maps = fused
+        leader = items[0]
+        valid, error, _, node_errors = asyncio.run(execution.validate_prompt(leader[1], fused_prompt, fused_outputs, allow_internal=True))
+        if not valid or len(node_errors) > 0:
+            logging.warning("Fused prompt is invalid, executing the prompts one at a time: {} {}".format(error, node_errors))
+            return None
+        logging.info("Executing {} fused prompts".format(len(items)))
+
+        # The fused prompt doesn't send live updates, every client gets its results once it is done.
+        extra_data = {k: v for k, v in leader[3].items() if k != "client_id"}
+        start_time = time.perf_counter()
+        executor.execute(fused_prompt, leader[1], extra_data, fused_outputs)
+        logging.debug("Fused prompts executed in {:.2f} seconds".format(time.perf_counter() - start_time))
+        if not executor.success and not any(event == "execution_interrupted" for event, _ in executor.status_messages):
+            # Every prompt gets its own error when they are executed one at a time, the nodes that ran are cached.
+            logging.info("Fused prompts failed, executing them one at a time.")
+            return None
+
+        shared_nodes = set(leader[2].keys())
+        for node_map in node_maps:
+            shared_nodes -= set(node_map.values())
+        server = executor.server
+        results = []
+        for i, item in enumerate(items):
+            prompt_id = item[1]
+            client_id = item[3].get("client_id", None)
+            outputs = {}
+            meta = {}
+            for node_id, output in executor.history_result["outputs"].items():
+                original_id = _map_node_id(node_maps[i], shared_nodes, node_id)
+                if original_id is None:
+                    continue
+                outputs[original_id] = output
+                node_meta = dict(executor.history_result["meta"][node_id])
+                for k in ("node_id", "display_node", "real_node_id"):
+                    if node_meta.get(k, None) is not None:
+                        node_meta[k] = _map_node_id(node_maps[i], shared_nodes, node_meta[k]) or node_meta[k]
+                meta[original_id] = node_meta
+
+            messages = []
+            for event, data in executor.status_messages:
+                data = dict(data)
+                data["prompt_id"] = prompt_id
+                if data.get("node_id", None) is not None:
+                    data["node_id"] = _map_node_id(node_maps[i], shared_nodes, data["node_id"]) or data["node_id"]
+                if "nodes" in data:
+                    data["nodes"] = [n for n in (_map_node_id(node_maps[i], shared_nodes, n) for n in data["nodes"]) if n is not None]
+                messages.append((event, data))
+
+            if client_id is not None:
+                for event, data in messages:
+                    if event == "execution_success":
+                        continue
+                    server.send_sync(event, data, client_id)
+                for node_id, output in outputs.items():
+                    server.send_sync("executed", {"node": node_id, "display_node": meta[node_id].get("display_node", node_id), "output": output, "prompt_id": prompt_id}, client_id)
+                for event, data in messages:
+                    if event == "execution_success":
+                        server.send_sync(event, data, client_id)
+                server.send_sync("executing", {"node": None, "prompt_id": prompt_id}, client_id)
+            results.append(({"outputs": outputs, "meta": meta}, messages))
+        return results
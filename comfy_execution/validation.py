@@ -37,3 +37,56 @@ def validate_node_input(
     else:
         # In non-strict mode, there must be at least one type in common
         return len(received_types.intersection(input_types)) > 0
+
+
+class NodeSchema:
+    """The resolved INPUT_TYPES() of a node class, with sets of the combo options for fast lookups."""
+    def __init__(self, class_inputs):
+        self.class_inputs = class_inputs
+        self.valid_inputs = set(class_inputs.get("required", {})).union(set(class_inputs.get("optional", {})))
+        self.combo_sets = {}
+
+    def combo_contains(self, input_name, combo_options, value):
+        options = self.combo_sets.get(input_name, None)
+        if options is None:
+            try:
+                options = frozenset(combo_options)
+            except TypeError:
+                # Unhashable options, fall back to the list
+                options = combo_options
+            self.combo_sets[input_name] = options
+        try:
+            return value in options
+        except TypeError:
+            return value in combo_options
+
+
+class NodeSchemaCache:
+    """
+    Caches the NodeSchema of each node class so INPUT_TYPES(), which often lists model or input files,
+    isn't called for every node of every prompt. Everything is invalidated when
+    folder_paths.get_directories_fingerprint() changes, which is checked by refresh().
+    """
+    def __init__(self):
+        self.schemas = {}
+        self.fingerprint = None
+        self.hits = 0
+        self.misses = 0
+
+    def refresh(self):
+        import folder_paths
+        fingerprint = folder_paths.get_directories_fingerprint()
+        if fingerprint != self.fingerprint:
+            self.schemas.clear()
+            self.fingerprint = fingerprint
+
+    def get(self, class_type, class_def, reload=False):
+        """Returns (schema, cached) where cached is True if the schema wasn't resolved by this call."""
+        cached = self.schemas.get(class_type, None)
+        if cached is not None and cached[0] is class_def and not reload:
+            self.hits += 1
+            return cached[1], True
+        self.misses += 1
+        schema = NodeSchema(class_def.INPUT_TYPES())
+        self.schemas[class_type] = (class_def, schema)
+        return schema, False
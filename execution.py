@@ -1,7 +1,10 @@
 import copy
+import hashlib
 import heapq
 import inspect
+import json
 import logging
+import os
 import sys
 import threading
 import time
@@ -13,6 +16,7 @@ import asyncio
 import torch
 
 import comfy.model_management
+import folder_paths
 import nodes
 from comfy_execution.caching import (
     BasicCache,
@@ -21,6 +25,7 @@ from comfy_execution.caching import (
     DependencyAwareCache,
     HierarchicalCache,
     LRUCache,
+    MemoryBudgetCache,
 )
 from comfy_execution.graph import (
     DynamicPrompt,
@@ -28,8 +33,10 @@ from comfy_execution.graph import (
     ExecutionList,
     get_input_info,
 )
+from comfy_execution.frozen import freeze, thaw
+from comfy_execution.parallel import NodeThreadPool
 from comfy_execution.graph_utils import GraphBuilder, is_link
-from comfy_execution.validation import validate_node_input
+from comfy_execution.validation import NodeSchemaCache, validate_node_input
 from comfy_execution.progress import get_progress_state, reset_progress_state, add_progress_handler, WebUIProgressHandler
 from comfy_execution.utils import CurrentNodeContext
 from comfy_api.internal import _ComfyNodeInternal, _NodeOutputInternal, first_real_override, is_class, make_locked_method_func
@@ -76,26 +83,30 @@ class IsChangedCache:
 
         # Intentionally do not use cached outputs here. We only want constants in IS_CHANGED
         input_data_all, _, hidden_inputs = get_input_data(node["inputs"], class_def, node_id, None)
+        # The result is only kept in this cache, not written to the prompt.
         try:
             is_changed = await _async_map_node_over_list(self.prompt_id, node_id, class_def, input_data_all, is_changed_name)
             is_changed = await resolve_map_node_over_list_results(is_changed)
-            node["is_changed"] = [None if isinstance(x, ExecutionBlocker) else x for x in is_changed]
+            self.is_changed[node_id] = [None if isinstance(x, ExecutionBlocker) else x for x in is_changed]
         except Exception as e:
             logging.warning("WARNING: {}".format(e))
-            node["is_changed"] = float("NaN")
-        finally:
-            self.is_changed[node_id] = node["is_changed"]
+            self.is_changed[node_id] = float("NaN")
         return self.is_changed[node_id]
 
 
+# The ui cache gets 1/UI_CACHE_BUDGET_DIVISOR of the memory budget, the output cache the rest
+UI_CACHE_BUDGET_DIVISOR = 16
+
+
 class CacheType(Enum):
     CLASSIC = 0
     LRU = 1
     DEPENDENCY_AWARE = 2
+    MEMORY_BUDGET = 3
 
 
 class CacheSet:
-    def __init__(self, cache_type=None, cache_size=None):
+    def __init__(self, cache_type=None, cache_size=None, cache_vram_size=None, disk_cache=None):
         if cache_type == CacheType.DEPENDENCY_AWARE:
             self.init_dependency_aware_cache()
             logging.info("Disabling intermediate node cache.")
@@ -104,9 +115,17 @@ class CacheSet:
                 cache_size = 0
             self.init_lru_cache(cache_size)
             logging.info("Using LRU cache")
+        elif cache_type == CacheType.MEMORY_BUDGET:
+            if cache_size is None:
+                cache_size = 0
+            self.init_memory_budget_cache(cache_size, cache_vram_size)
+            logging.info("Using memory budget cache")
         else:
             self.init_classic_cache()
 
+        if disk_cache is not None:
+            self.outputs.set_disk_cache(disk_cache)
+
         self.all = [self.outputs, self.ui, self.objects]
 
     # Performs like the old cache -- dump data ASAP
@@ -120,12 +139,33 @@ class CacheSet:
         self.ui = LRUCache(CacheKeySetInputSignature, max_size=cache_size)
         self.objects = HierarchicalCache(CacheKeySetID)
 
+    # cache_size and cache_vram_size are in bytes, split between the output and ui caches so that together they stay
+    # within the budget. The ui outputs are mostly file names and text so they only get a small share.
+    def init_memory_budget_cache(self, cache_size, cache_vram_size=None):
+        ui_size = cache_size // UI_CACHE_BUDGET_DIVISOR
+        ui_vram_size = None
+        if cache_vram_size is not None:
+            ui_vram_size = cache_vram_size // UI_CACHE_BUDGET_DIVISOR
+            cache_vram_size -= ui_vram_size
+        self.outputs = MemoryBudgetCache(CacheKeySetInputSignature, ram_budget=cache_size - ui_size, vram_budget=cache_vram_size)
+        self.ui = MemoryBudgetCache(CacheKeySetInputSignature, ram_budget=ui_size, vram_budget=ui_vram_size)
+        self.objects = HierarchicalCache(CacheKeySetID)
+
     # only hold cached items while the decendents have not executed
     def init_dependency_aware_cache(self):
         self.outputs = DependencyAwareCache(CacheKeySetInputSignature)
         self.ui = DependencyAwareCache(CacheKeySetInputSignature)
         self.objects = DependencyAwareCache(CacheKeySetID)
 
+    def get_stats(self):
+        # Only the memory budget cache keeps statistics
+        if not isinstance(self.outputs, MemoryBudgetCache):
+            return None
+        return {
+            "outputs": self.outputs.get_stats(),
+            "ui": self.ui.get_stats(),
+        }
+
     def recursive_debug_dump(self):
         result = {
             "outputs": self.outputs.recursive_debug_dump(),
@@ -214,7 +254,7 @@ async def resolve_map_node_over_list_results(results):
                 raise exc
         return [x.result() if isinstance(x, asyncio.Task) else x for x in results]
 
-async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, func, allow_interrupt=False, execution_block_cb=None, pre_execute_cb=None, hidden_inputs=None):
+async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, func, allow_interrupt=False, execution_block_cb=None, pre_execute_cb=None, hidden_inputs=None, node_pool=None):
     # check if node wants the lists
     input_is_list = getattr(obj, "INPUT_IS_LIST", False)
 
@@ -272,6 +312,11 @@ async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, f
                     results.append(result)
                 else:
                     results.append(task)
+            elif node_pool is not None and node_pool.can_run(obj):
+                # Handled like an async node: the task is awaited by the execution loop while other nodes run.
+                with CurrentNodeContext(prompt_id, unique_id, index):
+                    task = node_pool.submit(obj, f, inputs, pre_execute_cb=None if pre_execute_cb is None or index is None else lambda: pre_execute_cb(index))
+                results.append(task)
             else:
                 with CurrentNodeContext(prompt_id, unique_id, index):
                     result = f(**inputs)
@@ -311,8 +356,8 @@ def merge_result_data(results, obj):
             output.append([o[i] for o in results])
     return output
 
-async def get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=None, pre_execute_cb=None, hidden_inputs=None):
-    return_values = await _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, obj.FUNCTION, allow_interrupt=True, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, hidden_inputs=hidden_inputs)
+async def get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=None, pre_execute_cb=None, hidden_inputs=None, node_pool=None):
+    return_values = await _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, obj.FUNCTION, allow_interrupt=True, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, hidden_inputs=hidden_inputs, node_pool=node_pool)
     has_pending_task = any(isinstance(r, asyncio.Task) and not r.done() for r in return_values)
     if has_pending_task:
         return return_values, {}, False, has_pending_task
@@ -392,7 +437,7 @@ def format_value(x):
     else:
         return str(x)
 
-async def execute(server, dynprompt, caches, current_item, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes):
+async def execute(server, dynprompt, caches, current_item, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes, node_pool=None):
     unique_id = current_item
     real_node_id = dynprompt.get_real_node_id(unique_id)
     display_node_id = dynprompt.get_display_node_id(unique_id)
@@ -400,7 +445,7 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
     inputs = dynprompt.get_node(unique_id)['inputs']
     class_type = dynprompt.get_node(unique_id)['class_type']
     class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
-    if caches.outputs.get(unique_id) is not None:
+    if caches.outputs.lookup(unique_id) is not None:
         if server.client_id is not None:
             cached_output = caches.ui.get(unique_id) or {}
             server.send_sync("executed", { "node": unique_id, "display_node": display_node_id, "output": cached_output.get("output",None), "prompt_id": prompt_id }, server.client_id)
@@ -493,7 +538,7 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
             def pre_execute_cb(call_index):
                 # TODO - How to handle this with async functions without contextvars (which requires Python 3.12)?
                 GraphBuilder.set_default_prefix(unique_id, call_index, 0)
-            output_data, output_ui, has_subgraph, has_pending_tasks = await get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, hidden_inputs=hidden_inputs)
+            output_data, output_ui, has_subgraph, has_pending_tasks = await get_output_data(prompt_id, unique_id, obj, input_data_all, execution_block_cb=execution_block_cb, pre_execute_cb=pre_execute_cb, hidden_inputs=hidden_inputs, node_pool=node_pool)
             if has_pending_tasks:
                 pending_async_nodes[unique_id] = output_data
                 unblock = execution_list.add_external_block(unique_id)
@@ -597,14 +642,23 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
     return (ExecutionResult.SUCCESS, None, None)
 
 class PromptExecutor:
-    def __init__(self, server, cache_type=False, cache_size=None):
+    def __init__(self, server, cache_type=False, cache_size=None, cache_vram_size=None, disk_cache=None, parallel_nodes=0):
         self.cache_size = cache_size
+        self.cache_vram_size = cache_vram_size
+        self.disk_cache = disk_cache
+        self.node_pool = None
+        if parallel_nodes > 0:
+            self.node_pool = NodeThreadPool(parallel_nodes)
         self.cache_type = cache_type
         self.server = server
         self.reset()
 
+    def shutdown(self):
+        if self.node_pool is not None:
+            self.node_pool.shutdown()
+
     def reset(self):
-        self.caches = CacheSet(cache_type=self.cache_type, cache_size=self.cache_size)
+        self.caches = CacheSet(cache_type=self.cache_type, cache_size=self.cache_size, cache_vram_size=self.cache_vram_size, disk_cache=self.disk_cache)
         self.status_messages = []
         self.success = True
 
@@ -650,6 +704,10 @@ class PromptExecutor:
 
     async def execute_async(self, prompt, prompt_id, extra_data={}, execute_outputs=[]):
         nodes.interrupt_processing(False)
+        # Queued prompts are frozen (see PromptQueue.put). Nodes get mutable copies through the PROMPT and
+        # EXTRA_PNGINFO hidden inputs like before, shared by all the nodes of this execution.
+        prompt = thaw(prompt)
+        extra_data = thaw(extra_data)
 
         if "client_id" in extra_data:
             self.server.client_id = extra_data["client_id"]
@@ -681,6 +739,8 @@ class PromptExecutor:
             pending_async_nodes = {} # TODO - Unify this with pending_subgraph_results
             executed = set()
             execution_list = ExecutionList(dynamic_prompt, self.caches.outputs)
+            if self.node_pool is not None:
+                execution_list.background_resources = self.node_pool.resources
             current_outputs = self.caches.outputs.all_node_ids()
             for node_id in list(execute_outputs):
                 execution_list.add_node(node_id)
@@ -692,7 +752,7 @@ class PromptExecutor:
                     break
 
                 assert node_id is not None, "Node ID should not be None at this point"
-                result, error, ex = await execute(self.server, dynamic_prompt, self.caches, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes)
+                result, error, ex = await execute(self.server, dynamic_prompt, self.caches, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes, node_pool=self.node_pool)
                 self.success = result != ExecutionResult.FAILURE
                 if result == ExecutionResult.FAILURE:
                     self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
@@ -722,6 +782,9 @@ class PromptExecutor:
                 comfy.model_management.unload_all_models()
 
 
+# Resolved INPUT_TYPES() of the node classes, refreshed at the start of every validate_prompt
+node_schemas = NodeSchemaCache()
+
 async def validate_inputs(prompt_id, prompt, item, validated):
     unique_id = item
     if unique_id in validated:
@@ -731,8 +794,9 @@ async def validate_inputs(prompt_id, prompt, item, validated):
     class_type = prompt[unique_id]['class_type']
     obj_class = nodes.NODE_CLASS_MAPPINGS[class_type]
 
-    class_inputs = obj_class.INPUT_TYPES()
-    valid_inputs = set(class_inputs.get('required',{})).union(set(class_inputs.get('optional',{})))
+    schema, schema_cached = node_schemas.get(class_type, obj_class)
+    class_inputs = schema.class_inputs
+    valid_inputs = schema.valid_inputs
 
     errors = []
     valid = True
@@ -893,9 +957,15 @@ async def validate_inputs(prompt_id, prompt, item, validated):
                     errors.append(error)
                     continue
 
+                if isinstance(input_type, list) and not schema.combo_contains(x, input_type, val) and schema_cached:
+                    # The value might be a file the cached schema doesn't know about yet
+                    schema, schema_cached = node_schemas.get(class_type, obj_class, reload=True)
+                    class_inputs = schema.class_inputs
+                    input_type, _, _ = get_input_info(obj_class, x, class_inputs)
+
                 if isinstance(input_type, list):
                     combo_options = input_type
-                    if val not in combo_options:
+                    if not schema.combo_contains(x, combo_options, val):
                         input_config = info
                         list_info = ""
 
@@ -963,7 +1033,8 @@ def full_type_name(klass):
         return klass.__qualname__
     return module + '.' + klass.__qualname__
 
-async def validate_prompt(prompt_id, prompt, partial_execution_list: Union[list[str], None]):
+async def validate_prompt(prompt_id, prompt, partial_execution_list: Union[list[str], None], allow_internal=False):
+    node_schemas.refresh()
     outputs = set()
     for x in prompt:
         if 'class_type' not in prompt[x]:
@@ -977,7 +1048,7 @@ async def validate_prompt(prompt_id, prompt, partial_execution_list: Union[list[
 
         class_type = prompt[x]['class_type']
         class_ = nodes.NODE_CLASS_MAPPINGS.get(class_type, None)
-        if class_ is None:
+        if class_ is None or (getattr(class_, "INTERNAL", False) and not allow_internal):
             error = {
                 "type": "invalid_prompt",
                 "message": f"Cannot execute because node {class_type} does not exist.",
@@ -1073,6 +1144,48 @@ async def validate_prompt(prompt_id, prompt, partial_execution_list: Union[list[
     return (True, None, list(good_outputs), node_errors)
 
 MAXIMUM_HISTORY_SIZE = 10000
+# Older history entries are kept in the prompt store (when there is one) up to this many entries.
+MAXIMUM_STORED_HISTORY_SIZE = 100000
+
+# With several prompt workers, a worker may take one of the first AFFINITY_WINDOW queued prompts
+# if it prefers it (e.g. it already has its models loaded). A prompt can only be passed over
+# MAXIMUM_AFFINITY_SKIPS times before the next worker has to take it.
+AFFINITY_WINDOW = 8
+MAXIMUM_AFFINITY_SKIPS = 4
+
+def strip_sensitive_data(extra_data):
+    """Returns extra_data without the SENSITIVE_EXTRA_DATA_KEYS, extra_data itself if it has none of them."""
+    if any(sensitive_val in extra_data for sensitive_val in SENSITIVE_EXTRA_DATA_KEYS):
+        return {k: v for k, v in extra_data.items() if k not in SENSITIVE_EXTRA_DATA_KEYS}
+    return extra_data
+
+def get_coalescing_key(item):
+    """
+    Returns a hash of everything that decides the results of a queue item: the nodes its outputs depend
+    on and the extra_data other than the client_id. Queue items with the same key give the same results.
+    """
+    prompt, extra_data, outputs_to_execute = item[2], item[3], item[4]
+    needed_nodes = {}
+    to_visit = list(outputs_to_execute)
+    while len(to_visit) > 0:
+        node_id = to_visit.pop()
+        if node_id in needed_nodes or node_id not in prompt:
+            continue
+        node = prompt[node_id]
+        needed_nodes[node_id] = {"class_type": node["class_type"], "inputs": node["inputs"]}
+        to_visit.extend(value[0] for value in node["inputs"].values() if is_link(value))
+    extra_data = {k: v for k, v in extra_data.items() if k != "client_id"}
+    data = json.dumps([needed_nodes, sorted(outputs_to_execute), extra_data], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+def get_prompt_model_files(prompt):
+    """Returns the set of model files (checkpoints, loras, vaes...) selected by the loader nodes of a prompt."""
+    model_files = set()
+    for node in prompt.values():
+        for value in node.get("inputs", {}).values():
+            if isinstance(value, str) and os.path.splitext(value)[1].lower() in folder_paths.supported_pt_extensions:
+                model_files.add(value)
+    return model_files
 
 class PromptQueue:
     def __init__(self, server):
@@ -1082,28 +1195,158 @@ class PromptQueue:
         self.task_counter = 0
         self.queue = []
         self.currently_running = {}
+        self.running_threads = {}
+        self.skip_counts = {}
         self.history = {}
+        # Ids of the history entries in insertion order, starting at history_start, so pages of the
+        # history can be sliced out without walking through the entries before them.
+        self.history_order = []
+        self.history_start = 0
         self.flags = {}
+        self.worker_flags = {}
+        self.store = None
+        # When coalesce_prompts is set, a prompt with the same coalescing key as a queued or running one
+        # isn't executed again. It waits in followers for the results of that prompt instead.
+        self.coalesce_prompts = False
+        self.coalescing_keys = {}
+        self.in_flight = {}
+        self.followers = {}
+
+    def set_store(self, store):
+        """
+        Keeps the queue and the history in store (an app.database.prompt_store.PromptStore) from now on.
+        The prompts that were queued or running when it was last used are queued again and the most
+        recent history entries are loaded.
+        """
+        with self.mutex:
+            self.store = store
+            for prompt_id, entry in store.get_history(max_items=MAXIMUM_HISTORY_SIZE).items():
+                if prompt_id not in self.history:
+                    self.history_order.append(prompt_id)
+                self.history[prompt_id] = freeze(entry)
+            restored = store.load_queue()
+            for item in restored:
+                heapq.heappush(self.queue, freeze(item))
+                if item[0] >= self.server.number:
+                    self.server.number = int(item[0]) + 1
+            if len(restored) > 0:
+                logging.info("Restored {} queued prompts.".format(len(restored)))
+                self.server.queue_updated()
+                self.not_empty.notify_all()
 
     def put(self, item):
+        # Queue items are frozen so they can be shared with the executor, the history and every
+        # /queue and /history request without copying them.
+        item = freeze(item)
         with self.mutex:
+            if self.store is not None:
+                # Sensitive data like api keys is not written to disk, prompts that need it will fail
+                # if they are restored after a restart.
+                self.store.queue_put(item[:3] + (strip_sensitive_data(item[3]),) + item[4:])
+            if self.coalesce_prompts:
+                key = get_coalescing_key(item)
+                leader_id = self.in_flight.get(key, None)
+                if leader_id is not None:
+                    self.followers[leader_id].append(item)
+                    self.server.queue_updated()
+                    return
+                self._track_in_flight(item, key)
             heapq.heappush(self.queue, item)
             self.server.queue_updated()
             self.not_empty.notify()
 
-    def get(self, timeout=None):
+    def _track_in_flight(self, item, key):
+        self.coalescing_keys[item[1]] = key
+        self.in_flight[key] = item[1]
+        self.followers.setdefault(item[1], [])
+
+    def _untrack_in_flight(self, prompt_id):
+        """Stops coalescing new prompts with prompt_id, returns the prompts that were waiting for it."""
+        key = self.coalescing_keys.pop(prompt_id, None)
+        if key is not None and self.in_flight.get(key, None) == prompt_id:
+            del self.in_flight[key]
+        return self.followers.pop(prompt_id, [])
+
+    def get(self, timeout=None, preferred=None):
         with self.not_empty:
             while len(self.queue) == 0:
                 self.not_empty.wait(timeout=timeout)
                 if timeout is not None and len(self.queue) == 0:
                     return None
-            item = heapq.heappop(self.queue)
+            item = self._pop_item(preferred)
             i = self.task_counter
-            self.currently_running[i] = copy.deepcopy(item)
+            self.currently_running[i] = item
+            self.running_threads[i] = threading.get_ident()
             self.task_counter += 1
             self.server.queue_updated()
             return (item, i)
 
+    def _pop_item(self, preferred):
+        if preferred is not None and len(self.queue) > 1:
+            candidates = heapq.nsmallest(AFFINITY_WINDOW, self.queue)
+            for item in candidates:
+                if self.skip_counts.get(item[1], 0) >= MAXIMUM_AFFINITY_SKIPS:
+                    break
+                if preferred(item):
+                    for skipped in candidates:
+                        if skipped is item:
+                            break
+                        self.skip_counts[skipped[1]] = self.skip_counts.get(skipped[1], 0) + 1
+                    self.queue.remove(item)
+                    heapq.heapify(self.queue)
+                    self.skip_counts.pop(item[1], None)
+                    return item
+        item = heapq.heappop(self.queue)
+        self.skip_counts.pop(item[1], None)
+        return item
+
+    def get_compatible(self, is_compatible, max_items, timeout):
+        """
+        Removes up to max_items queued items for which is_compatible(item) is true and marks them as running,
+        waiting up to timeout seconds for more of them to be queued. Returns a list of (item, item_id).
+        """
+        deadline = time.perf_counter() + timeout
+        found = []
+        checked = set()
+        with self.not_empty:
+            while len(found) < max_items:
+                for item in sorted(self.queue):
+                    if len(found) >= max_items:
+                        break
+                    if item[1] in checked:
+                        continue
+                    checked.add(item[1])
+                    if is_compatible(item):
+                        self.queue.remove(item)
+                        self.skip_counts.pop(item[1], None)
+                        found.append(item)
+                remaining = deadline - time.perf_counter()
+                if len(found) >= max_items or remaining <= 0:
+                    break
+                self.not_empty.wait(timeout=remaining)
+            heapq.heapify(self.queue)
+
+            out = []
+            for item in found:
+                i = self.task_counter
+                self.currently_running[i] = item
+                self.running_threads[i] = threading.get_ident()
+                self.task_counter += 1
+                out.append((item, i))
+            if len(out) > 0:
+                self.server.queue_updated()
+            return out
+
+    def get_upcoming_model_files(self, max_items):
+        """Model files selected by the running prompts and the next max_items queued ones, in the order they will run."""
+        with self.mutex:
+            items = list(self.currently_running.values()) + heapq.nsmallest(max_items, self.queue)
+        return [get_prompt_model_files(item[2]) for item in items]
+
+    def get_running_thread_ids(self, prompt_id=None):
+        with self.mutex:
+            return [self.running_threads[i] for i, item in self.currently_running.items() if prompt_id is None or item[1] == prompt_id]
+
     class ExecutionStatus(NamedTuple):
         status_str: Literal['success', 'error']
         completed: bool
@@ -1113,85 +1356,175 @@ class PromptQueue:
                   status: Optional['PromptQueue.ExecutionStatus']):
         with self.mutex:
             prompt = self.currently_running.pop(item_id)
-            if len(self.history) > MAXIMUM_HISTORY_SIZE:
-                self.history.pop(next(iter(self.history)))
+            self.running_threads.pop(item_id, None)
 
             status_dict: Optional[dict] = None
             if status is not None:
-                status_dict = copy.deepcopy(status._asdict())
-
-            # Remove sensitive data from extra_data before storing in history
-            for sensitive_val in SENSITIVE_EXTRA_DATA_KEYS:
-                if sensitive_val in prompt[3]:
-                    prompt[3].pop(sensitive_val)
-
-            self.history[prompt[1]] = {
-                "prompt": prompt,
-                "outputs": {},
-                'status': status_dict,
-            }
-            self.history[prompt[1]].update(history_result)
+                status_dict = status._asdict()
+
+            self._add_history(prompt, history_result, status_dict)
+            key = self.coalescing_keys.get(prompt[1], None)
+            followers = self._untrack_in_flight(prompt[1])
+            if len(followers) > 0 and status is not None and not status.completed:
+                # The prompt was interrupted or failed, the prompts waiting for it (maybe from other clients)
+                # don't get its error. The first one is executed in its place.
+                self._promote_follower(followers, key)
+            else:
+                for follower in followers:
+                    self._add_history(follower, history_result, status_dict)
+                    self._send_coalesced_results(follower, history_result, status)
+            self._trim_history()
             self.server.queue_updated()
 
-    # Note: slow
+    def _trim_history(self):
+        # A prompt adds one history entry for itself and one for each prompt coalesced with it
+        while len(self.history) > MAXIMUM_HISTORY_SIZE:
+            self.history.pop(self.history_order[self.history_start])
+            self.history_start += 1
+            if self.history_start > MAXIMUM_HISTORY_SIZE:
+                del self.history_order[:self.history_start]
+                self.history_start = 0
+                if self.store is not None:
+                    self.store.history_trim(MAXIMUM_STORED_HISTORY_SIZE)
+
+    def _promote_follower(self, followers, key):
+        self._track_in_flight(followers[0], key)
+        self.followers[followers[0][1]] = followers[1:]
+        heapq.heappush(self.queue, followers[0])
+        self.not_empty.notify()
+
+    def _add_history(self, prompt, history_result, status_dict):
+        # Remove sensitive data from extra_data before storing in history
+        prompt = prompt[:3] + (strip_sensitive_data(prompt[3]),) + prompt[4:]
+
+        entry = {
+            "prompt": prompt,
+            "outputs": {},
+            'status': status_dict,
+        }
+        entry.update(history_result)
+        if prompt[1] not in self.history:
+            self.history_order.append(prompt[1])
+        self.history[prompt[1]] = freeze(entry)
+        if self.store is not None:
+            self.store.queue_remove(prompt[1])
+            self.store.history_put(prompt[1], self.history[prompt[1]])
+
+    def _send_coalesced_results(self, item, history_result, status):
+        # Replays the messages of the execution the prompt was coalesced with to its client
+        prompt_id = item[1]
+        client_id = item[3].get("client_id", None)
+        if client_id is None:
+            return
+        def send(event, data):
+            self.server.send_sync(event, {**data, "prompt_id": prompt_id}, client_id)
+        messages = status.messages if status is not None else []
+        for event, data in messages:
+            if event in ("execution_start", "execution_cached"):
+                send(event, data)
+        meta = history_result.get("meta", {})
+        for node_id, output in history_result.get("outputs", {}).items():
+            display_node = meta.get(node_id, {}).get("display_node", node_id)
+            send("executed", {"node": node_id, "display_node": display_node, "output": output})
+        for event, data in messages:
+            if event not in ("execution_start", "execution_cached"):
+                send(event, data)
+        send("executing", {"node": None})
+
     def get_current_queue(self):
         with self.mutex:
-            out = []
-            for x in self.currently_running.values():
-                out += [x]
-            return (out, copy.deepcopy(self.queue))
+            running = list(self.currently_running.values())
+            queued = list(self.queue) + self._get_followers()
+            return (running, queued)
 
     # read-safe as long as queue items are immutable
     def get_current_queue_volatile(self):
         with self.mutex:
             running = [x for x in self.currently_running.values()]
-            queued = copy.copy(self.queue)
+            queued = copy.copy(self.queue) + self._get_followers()
             return (running, queued)
 
+    def _get_followers(self):
+        return [item for items in self.followers.values() for item in items]
+
+    def _is_queued_or_running(self, prompt_id):
+        items = list(self.currently_running.values()) + self.queue + self._get_followers()
+        return any(item[1] == prompt_id for item in items)
+
     def get_tasks_remaining(self):
         with self.mutex:
-            return len(self.queue) + len(self.currently_running)
+            return len(self.queue) + len(self.currently_running) + len(self._get_followers())
 
     def wipe_queue(self):
         with self.mutex:
+            removed = self.queue + self._get_followers()
+            for item in self.queue:
+                self._untrack_in_flight(item[1])
+            for items in self.followers.values():
+                items.clear()
+            if self.store is not None:
+                for item in removed:
+                    self.store.queue_remove(item[1])
             self.queue = []
+            self.skip_counts = {}
             self.server.queue_updated()
 
     def delete_queue_item(self, function):
         with self.mutex:
+            for items in self.followers.values():
+                for item in items:
+                    if function(item):
+                        items.remove(item)
+                        if self.store is not None:
+                            self.store.queue_remove(item[1])
+                        self.server.queue_updated()
+                        return True
             for x in range(len(self.queue)):
                 if function(self.queue[x]):
-                    if len(self.queue) == 1:
-                        self.wipe_queue()
-                    else:
-                        self.queue.pop(x)
-                        heapq.heapify(self.queue)
+                    item = self.queue.pop(x)
+                    self.skip_counts.pop(item[1], None)
+                    key = self.coalescing_keys.get(item[1], None)
+                    followers = self._untrack_in_flight(item[1])
+                    heapq.heapify(self.queue)
+                    if len(followers) > 0:
+                        # The first prompt waiting for the deleted one is executed in its place
+                        self._promote_follower(followers, key)
+                    if self.store is not None:
+                        self.store.queue_remove(item[1])
                     self.server.queue_updated()
                     return True
         return False
 
     def get_history(self, prompt_id=None, max_items=None, offset=-1, map_function=None):
+        # History entries are frozen, they are returned without copying them.
+        with self.mutex:
+            in_store = prompt_id is not None and prompt_id not in self.history and self.store is not None
+            if in_store and self._is_queued_or_running(prompt_id):
+                # Clients poll the history of the prompts they queued, those can't be in the store yet.
+                return {}
+        if in_store:
+            # Older entries that no longer fit in memory are still in the store. It is read without holding
+            # the mutex, the server calls this in an executor so the database query doesn't block the event loop.
+            out = self.store.get_history(prompt_id=prompt_id)
+            if map_function is not None:
+                out = {k: map_function(v) for k, v in out.items()}
+            return out
         with self.mutex:
             if prompt_id is None:
-                out = {}
-                i = 0
                 if offset < 0 and max_items is not None:
                     offset = len(self.history) - max_items
-                for k in self.history:
-                    if i >= offset:
-                        p = self.history[k]
-                        if map_function is not None:
-                            p = map_function(p)
-                        out[k] = p
-                        if max_items is not None and len(out) >= max_items:
-                            break
-                    i += 1
+                start = self.history_start + max(offset, 0)
+                end = None if max_items is None else start + max_items
+                out = {}
+                for k in self.history_order[start:end]:
+                    p = self.history[k]
+                    if map_function is not None:
+                        p = map_function(p)
+                    out[k] = p
                 return out
             elif prompt_id in self.history:
                 p = self.history[prompt_id]
-                if map_function is None:
-                    p = copy.deepcopy(p)
-                else:
+                if map_function is not None:
                     p = map_function(p)
                 return {prompt_id: p}
             else:
@@ -1200,21 +1533,37 @@ class PromptQueue:
     def wipe_history(self):
         with self.mutex:
             self.history = {}
+            self.history_order = []
+            self.history_start = 0
+            if self.store is not None:
+                self.store.history_clear()
 
     def delete_history_item(self, id_to_delete):
         with self.mutex:
-            self.history.pop(id_to_delete, None)
+            if self.history.pop(id_to_delete, None) is not None:
+                del self.history_order[self.history_order.index(id_to_delete, self.history_start)]
+            if self.store is not None:
+                self.store.history_remove(id_to_delete)
 
     def set_flag(self, name, data):
         with self.mutex:
             self.flags[name] = data
-            self.not_empty.notify()
+            for flags in self.worker_flags.values():
+                flags[name] = data
+            self.not_empty.notify_all()
 
-    def get_flags(self, reset=True):
+    def add_worker(self, worker_id):
         with self.mutex:
+            self.worker_flags[worker_id] = {}
+
+    def get_flags(self, reset=True, worker_id=None):
+        with self.mutex:
+            flags = self.flags if worker_id is None else self.worker_flags[worker_id]
             if reset:
-                ret = self.flags
-                self.flags = {}
-                return ret
+                if worker_id is None:
+                    self.flags = {}
+                else:
+                    self.worker_flags[worker_id] = {}
+                return flags
             else:
-                return self.flags.copy()
+                return flags.copy()
@@ -348,6 +348,24 @@ def cached_filename_list_(folder_name: str) -> tuple[list[str], dict[str, float]
 
     return out
 
+def get_directories_fingerprint() -> tuple[tuple[str, float | None], ...]:
+    """
+    Returns the modification times of the input directory, the model folders and every directory in the
+    filename list cache. It changes whenever a file list built from these directories might have changed.
+    """
+    directories = {get_input_directory()}
+    for folders, _ in folder_names_and_paths.values():
+        directories.update(folders)
+    for _, folders_all, _ in filename_list_cache.values():
+        directories.update(folders_all.keys())
+    out = []
+    for x in sorted(directories):
+        try:
+            out.append((x, os.path.getmtime(x)))
+        except OSError:
+            out.append((x, None))
+    return tuple(out)
+
 def get_filename_list(folder_name: str) -> list[str]:
     folder_name = map_legacy(folder_name)
     out = cached_filename_list_(folder_name)
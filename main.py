@@ -147,10 +147,20 @@ if 'torch' in sys.modules:
 import comfy.utils
 
 import execution
+import comfy_execution.parallel
 import server
 from protocol import BinaryEventTypes
 import nodes
 import comfy.model_management
+import comfy.model_cache
+import comfy.conditioning_cache
+import comfy.detection_cache
+import comfy.baked_patches
+import comfy.disk_offload
+import comfy.shared_weights
+import comfy.memory_profiler
+import comfy.sampler_checkpoint
+import comfy.eviction
 import comfyui_version
 import app.logger
 import hook_breaker_ac10a0
@@ -167,15 +177,61 @@ def cuda_malloc_warning():
             logging.warning("\nWARNING: this card most likely does not support cuda-malloc, if you get \"CUDA error\" please run ComfyUI with: --disable-cuda-malloc\n")
 
 
-def prompt_worker(q, server_instance):
+# The server (or PromptWorkerServer) used by the prompt worker running on the current thread
+current_worker = threading.local()
+
+def capture_current_worker():
+    # Nodes running in background threads report their progress to the server of their prompt worker
+    server_instance = getattr(current_worker, "server", None)
+    def restore():
+        if server_instance is not None:
+            current_worker.server = server_instance
+    return restore
+
+comfy_execution.parallel.thread_state_capturers.append(capture_current_worker)
+
+def prompt_worker(q, server_instance, worker_id=None, device_index=None):
+    current_worker.server = server_instance
+    if device_index is not None:
+        comfy.model_management.set_torch_device_for_thread(device_index)
+        logging.info("Prompt worker {} using device: {}".format(worker_id, comfy.model_management.get_torch_device()))
+
+    preferred = None
+    loaded_model_files = set()
+    if worker_id is not None:
+        def preferred(item):
+            model_files = execution.get_prompt_model_files(item[2])
+            return len(model_files) > 0 and model_files.issubset(loaded_model_files)
+
     current_time: float = 0.0
     cache_type = execution.CacheType.CLASSIC
     if args.cache_lru > 0:
         cache_type = execution.CacheType.LRU
     elif args.cache_none:
         cache_type = execution.CacheType.DEPENDENCY_AWARE
-
-    e = execution.PromptExecutor(server_instance, cache_type=cache_type, cache_size=args.cache_lru)
+    elif args.cache_budget > 0:
+        cache_type = execution.CacheType.MEMORY_BUDGET
+
+    cache_size = args.cache_lru
+    cache_vram_size = None
+    if cache_type == execution.CacheType.MEMORY_BUDGET:
+        cache_size = int(args.cache_budget * (1024 ** 3))
+        if args.cache_budget_vram is not None:
+            cache_vram_size = int(args.cache_budget_vram * (1024 ** 3))
+
+    disk_cache = None
+    if args.disk_cache is not None:
+        from comfy_execution.disk_cache import DiskCache
+        disk_cache = DiskCache(os.path.abspath(args.disk_cache), int(args.disk_cache_size * (1024 ** 3)), args.disk_cache_nodes)
+        logging.info("Using disk cache in {} for: {}".format(disk_cache.directory, ", ".join(args.disk_cache_nodes)))
+
+    e = execution.PromptExecutor(server_instance, cache_type=cache_type, cache_size=cache_size, cache_vram_size=cache_vram_size, disk_cache=disk_cache, parallel_nodes=args.parallel_nodes)
+    server_instance.prompt_executor = e
+
+    sampler_batcher = None
+    if args.sampler_batch_size > 1:
+        from comfy_execution.sampler_batching import SamplerBatcher
+        sampler_batcher = SamplerBatcher(args.sampler_batch_size, args.sampler_batch_wait)
     last_gc_collect = 0
     need_gc = False
     gc_collect_interval = 10.0
@@ -185,23 +241,45 @@ def prompt_worker(q, server_instance):
         if need_gc:
             timeout = max(gc_collect_interval - (current_time - last_gc_collect), 0.0)
 
-        queue_item = q.get(timeout=timeout)
+        queue_item = q.get(timeout=timeout, preferred=preferred)
         if queue_item is not None:
             item, item_id = queue_item
             execution_start_time = time.perf_counter()
-            prompt_id = item[1]
-            server_instance.last_prompt_id = prompt_id
-
-            e.execute(item[2], prompt_id, item[3], item[4])
+            server_instance.last_prompt_id = item[1]
+
+            batch = [(item, item_id)]
+            if sampler_batcher is not None:
+                batch = sampler_batcher.collect(q, item, item_id)
+            batch_results = None
+            if len(batch) > 1:
+                batch_results = sampler_batcher.execute(e, batch)
+
+            if batch_results is not None:
+                for (batch_item, batch_item_id), (history_result, messages) in zip(batch, batch_results):
+                    q.task_done(batch_item_id,
+                                history_result,
+                                status=execution.PromptQueue.ExecutionStatus(
+                                    status_str='success' if e.success else 'error',
+                                    completed=e.success,
+                                    messages=messages))
+            else:
+                for batch_item, batch_item_id in batch:
+                    prompt_id = batch_item[1]
+                    server_instance.last_prompt_id = prompt_id
+                    e.execute(batch_item[2], prompt_id, batch_item[3], batch_item[4])
+                    q.task_done(batch_item_id,
+                                e.history_result,
+                                status=execution.PromptQueue.ExecutionStatus(
+                                    status_str='success' if e.success else 'error',
+                                    completed=e.success,
+                                    messages=e.status_messages))
+                    if server_instance.client_id is not None:
+                        server_instance.send_sync("executing", {"node": None, "prompt_id": prompt_id}, server_instance.client_id)
+            # Let the other workers unload or detach the models of the prompt
+            comfy.model_management.release_models_in_use()
             need_gc = True
-            q.task_done(item_id,
-                        e.history_result,
-                        status=execution.PromptQueue.ExecutionStatus(
-                            status_str='success' if e.success else 'error',
-                            completed=e.success,
-                            messages=e.status_messages))
-            if server_instance.client_id is not None:
-                server_instance.send_sync("executing", {"node": None, "prompt_id": prompt_id}, server_instance.client_id)
+            if preferred is not None:
+                loaded_model_files = execution.get_prompt_model_files(item[2])
 
             current_time = time.perf_counter()
             execution_time = current_time - execution_start_time
@@ -213,11 +291,13 @@ def prompt_worker(q, server_instance):
             else:
                 logging.info("Prompt executed in {:.2f} seconds".format(execution_time))
 
-        flags = q.get_flags()
+        flags = q.get_flags(worker_id=worker_id)
         free_memory = flags.get("free_memory", False)
 
         if flags.get("unload_models", free_memory):
             comfy.model_management.unload_all_models()
+            comfy.model_cache.model_file_cache.clear()
+            comfy.conditioning_cache.conditioning_cache.clear()
             need_gc = True
             last_gc_collect = 0
 
@@ -244,8 +324,9 @@ async def run(server_instance, address='', port=8188, verbose=True, call_on_star
         server_instance.start_multi_address(addresses, call_on_start, verbose), server_instance.publish_loop()
     )
 
-def hijack_progress(server_instance):
+def hijack_progress(prompt_server):
     def hook(value, total, preview_image, prompt_id=None, node_id=None):
+        server_instance = getattr(current_worker, "server", prompt_server)
         executing_context = get_executing_context()
         if prompt_id is None and executing_context is not None:
             prompt_id = executing_context.prompt_id
@@ -282,11 +363,17 @@ def cleanup_temp():
         shutil.rmtree(temp_dir, ignore_errors=True)
 
 
-def setup_database():
+def setup_database(prompt_queue):
     try:
-        from app.database.db import init_db, dependencies_available
+        from app.database.db import init_db, dependencies_available, can_create_session
         if dependencies_available():
             init_db()
+        if args.persist_queue:
+            if can_create_session():
+                from app.database.prompt_store import PromptStore
+                prompt_queue.set_store(PromptStore())
+            else:
+                logging.warning("The database is not available, the queue and the history won't be persisted.")
     except Exception as e:
         logging.error(f"Failed to initialize database. Please ensure you have installed the latest requirements. If the error persists, please report this as in future the database will be required: {e}")
 
@@ -322,12 +409,47 @@ def start_comfyui(asyncio_loop=None):
     hook_breaker_ac10a0.restore_functions()
 
     cuda_malloc_warning()
-    setup_database()
-
+    setup_database(prompt_server.prompt_queue)
+
+    prompt_server.prompt_queue.coalesce_prompts = args.coalesce_prompts
+    comfy.model_cache.model_file_cache.set_budget(int(args.model_ram_cache * (1024 ** 3)))
+    comfy.conditioning_cache.conditioning_cache.set_budget(int(args.conditioning_cache * (1024 ** 3)))
+    if args.conditioning_cache_dir is not None:
+        comfy.conditioning_cache.conditioning_cache.set_directory(os.path.abspath(args.conditioning_cache_dir))
+    if args.model_detection_cache:
+        comfy.detection_cache.detection_cache.set_path(os.path.join(folder_paths.get_user_directory(), "model_detection_cache.json"))
+    comfy.eviction.set_policy(args.eviction_policy)
+    comfy.eviction.set_upcoming_provider(lambda: prompt_server.prompt_queue.get_upcoming_model_files(comfy.eviction.LOOKAHEAD_PROMPTS))
+    if args.record_model_loads is not None:
+        comfy.eviction.load_recorder.set_path(args.record_model_loads)
+    if args.learn_memory_usage:
+        comfy.memory_profiler.memory_profiler.set_path(os.path.join(folder_paths.get_user_directory(), "memory_profile.json"))
+    if args.shared_weights is not None:
+        comfy.shared_weights.shared_weights.set_directory(os.path.abspath(args.shared_weights), int(args.shared_weights_size * (1024 ** 3)))
+    if args.sampler_checkpoint is not None:
+        comfy.sampler_checkpoint.sampler_checkpoints.set_directory(os.path.abspath(args.sampler_checkpoint), args.sampler_checkpoint_steps)
+    if args.disk_offload is not None:
+        comfy.disk_offload.disk_offload.set_directory(os.path.abspath(args.disk_offload), int(args.disk_offload_ram * (1024 ** 3)))
+    if args.lora_bake_cache is not None:
+        comfy.baked_patches.baked_patch_cache.set_directory(os.path.abspath(args.lora_bake_cache), int(args.lora_bake_cache_size * (1024 ** 3)))
     prompt_server.add_routes()
     hijack_progress(prompt_server)
 
-    threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, prompt_server,)).start()
+    if args.prompt_workers > 1:
+        server.PromptServer.instance = server.PromptServerRouter(prompt_server, current_worker)
+        device_count = comfy.model_management.get_torch_device_count()
+        for worker_id in range(args.prompt_workers):
+            worker_server = server.PromptWorkerServer(prompt_server, worker_id)
+            prompt_server.worker_servers.append(worker_server)
+            prompt_server.prompt_queue.add_worker(worker_id)
+            device_index = None
+            if args.prompt_worker_devices is not None:
+                device_index = args.prompt_worker_devices[worker_id % len(args.prompt_worker_devices)]
+            elif device_count > 1:
+                device_index = worker_id % device_count
+            threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, worker_server, worker_id, device_index)).start()
+    else:
+        threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, prompt_server,)).start()
 
     if args.quick_test_for_ci:
         exit(0)
@@ -360,7 +482,7 @@ if __name__ == "__main__":
     if sys.version_info.major == 3 and sys.version_info.minor < 10:
         logging.warning("WARNING: You are using a python version older than 3.10, please upgrade to a newer one. 3.12 and above is recommended.")
 
-    event_loop, _, start_all_func = start_comfyui()
+    event_loop, prompt_server, start_all_func = start_comfyui()
     try:
         x = start_all_func()
         app.logger.print_startup_warnings()
@@ -368,4 +490,7 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         logging.info("\nStopped server")
 
+    for worker in [prompt_server] + prompt_server.worker_servers:
+        if worker.prompt_executor is not None:
+            worker.prompt_executor.shutdown()
     cleanup_temp()
@@ -35,6 +35,7 @@ from comfy_api.latest import io, ComfyExtension
 import comfy.clip_vision
 
 import comfy.model_management
+import comfy.model_cache
 from comfy.cli_args import args
 
 import importlib
@@ -46,8 +47,8 @@ import node_helpers
 def before_node_execution():
     comfy.model_management.throw_exception_if_processing_interrupted()
 
-def interrupt_processing(value=True):
-    comfy.model_management.interrupt_current_processing(value)
+def interrupt_processing(value=True, thread_id=None):
+    comfy.model_management.interrupt_current_processing(value, thread_id=thread_id)
 
 MAX_RESOLUTION=16384
 
@@ -467,6 +468,7 @@ class SaveLatent:
     FUNCTION = "save"
 
     OUTPUT_NODE = True
+    EXECUTION_RESOURCE = "IO"
 
     CATEGORY = "_for_testing"
 
@@ -512,6 +514,7 @@ class LoadLatent:
         return {"required": {"latent": [sorted(files), ]}, }
 
     CATEGORY = "_for_testing"
+    EXECUTION_RESOURCE = "IO"
 
     RETURN_TYPES = ("LATENT", )
     FUNCTION = "load"
@@ -675,7 +678,7 @@ class LoraLoader:
             lora = comfy.utils.load_torch_file(lora_path, safe_load=True)
             self.loaded_lora = (lora_path, lora)
 
-        model_lora, clip_lora = comfy.sd.load_lora_for_models(model, clip, lora, strength_model, strength_clip)
+        model_lora, clip_lora = comfy.sd.load_lora_for_models(model, clip, lora, strength_model, strength_clip, source=comfy.model_cache.file_key(lora_path))
         return (model_lora, clip_lora)
 
 class LoraLoaderModelOnly(LoraLoader):
@@ -780,7 +783,11 @@ class VAELoader:
             sd = self.load_taesd(vae_name)
         else:
             vae_path = folder_paths.get_full_path_or_raise("vae", vae_name)
-            sd = comfy.utils.load_torch_file(vae_path)
+            def load():
+                vae = comfy.sd.VAE(sd=comfy.utils.load_torch_file(vae_path))
+                vae.throw_exception_if_invalid()
+                return vae
+            return (comfy.model_cache.model_file_cache.load("vae", [vae_path], {}, load),)
         vae = comfy.sd.VAE(sd=sd)
         vae.throw_exception_if_invalid()
         return (vae,)
@@ -1581,6 +1588,7 @@ class SaveImage:
     FUNCTION = "save_images"
 
     OUTPUT_NODE = True
+    EXECUTION_RESOURCE = "IO"
 
     CATEGORY = "image"
     DESCRIPTION = "Saves the input images to your ComfyUI output directory."
@@ -1638,6 +1646,7 @@ class LoadImage:
                 }
 
     CATEGORY = "image"
+    EXECUTION_RESOURCE = "CPU"
 
     RETURN_TYPES = ("IMAGE", "MASK")
     FUNCTION = "load_image"
@@ -1715,6 +1724,7 @@ class LoadImageMask:
                 }
 
     CATEGORY = "mask"
+    EXECUTION_RESOURCE = "CPU"
 
     RETURN_TYPES = ("MASK",)
     FUNCTION = "load_image"
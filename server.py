@@ -7,6 +7,7 @@ import nodes
 import folder_paths
 import execution
 import uuid
+import time
 import urllib
 import json
 import glob
@@ -26,6 +27,9 @@ import mimetypes
 from comfy.cli_args import args
 import comfy.utils
 import comfy.model_management
+import comfy.model_cache
+import comfy.conditioning_cache
+import comfy.samplers
 from comfy_api import feature_flags
 import node_helpers
 from comfyui_version import __version__
@@ -162,6 +166,42 @@ def create_origin_only_middleware():
 
     return origin_only_middleware
 
+class PromptWorkerServer():
+    """
+    View of the PromptServer used by one prompt worker when several prompts are executed at the same time.
+    It keeps its own client_id/last_node_id/last_prompt_id and forwards everything else to the server.
+    """
+    def __init__(self, server, worker_id):
+        self.server = server
+        self.worker_id = worker_id
+        self.client_id = None
+        self.last_node_id = None
+        self.last_prompt_id = None
+        self.prompt_executor = None
+
+    def __getattr__(self, name):
+        return getattr(self.server, name)
+
+class PromptServerRouter():
+    """
+    Used as PromptServer.instance when there are several prompt workers. Code running in a prompt worker thread
+    (nodes, progress hooks) gets the PromptWorkerServer of that worker, so PromptServer.instance.client_id and
+    last_node_id are the ones of its own prompt. Anything else gets the PromptServer.
+    Code that kept a reference to PromptServer.instance before the workers were started still gets the PromptServer.
+    """
+    def __init__(self, server, current_worker):
+        object.__setattr__(self, "server", server)
+        object.__setattr__(self, "current_worker", current_worker)
+
+    def _target(self):
+        return getattr(self.current_worker, "server", self.server)
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._target(), name, value)
+
 class PromptServer():
     def __init__(self, loop):
         PromptServer.instance = self
@@ -180,6 +220,8 @@ class PromptServer():
         self.messages = asyncio.Queue()
         self.client_session:Optional[aiohttp.ClientSession] = None
         self.number = 0
+        # Time spent validating the prompts posted to /prompt, reported by /system_stats
+        self.validation_stats = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "last_ms": 0.0}
 
         # Bagel middleware imports
         self.bagel_middleware_available = False
@@ -222,6 +264,9 @@ class PromptServer():
         self.routes = routes
         self.last_node_id = None
         self.client_id = None
+        # Set by the prompt worker, the executors of the workers are in their PromptWorkerServer
+        self.prompt_executor = None
+        self.worker_servers = []
 
         self.on_prompt_handlers = []
 
@@ -245,8 +290,9 @@ class PromptServer():
                 # Send initial state to the new client
                 await self.send("status", {"status": self.get_queue_info(), "sid": sid}, sid)
                 # On reconnect if we are the currently executing client send the current node
-                if self.client_id == sid and self.last_node_id is not None:
-                    await self.send("executing", { "node": self.last_node_id }, sid)
+                for worker in [self] + self.worker_servers:
+                    if worker.client_id == sid and worker.last_node_id is not None:
+                        await self.send("executing", { "node": worker.last_node_id }, sid)
 
                 # Flag to track if we've received the first message
                 first_message = True
@@ -617,7 +663,17 @@ class PromptServer():
                         "torch_vram_total": torch_vram_total,
                         "torch_vram_free": torch_vram_free,
                     }
-                ]
+                ],
+                "prompt_validation": {
+                    **self.validation_stats,
+                    "schema_cache_hits": execution.node_schemas.hits,
+                    "schema_cache_misses": execution.node_schemas.misses,
+                },
+                "model_ram_cache": comfy.model_cache.model_file_cache.stats(),
+                "conditioning_cache": comfy.conditioning_cache.conditioning_cache.stats(),
+                "cond_batching": comfy.samplers.cond_batch_stats.stats(),
+                "output_cache": [worker.prompt_executor.caches.get_stats() for worker in [self] + self.worker_servers
+                                 if worker.prompt_executor is not None],
             }
             return web.json_response(system_stats)
 
@@ -669,6 +725,8 @@ class PromptServer():
             with folder_paths.cache_helper:
                 out = {}
                 for x in nodes.NODE_CLASS_MAPPINGS:
+                    if getattr(nodes.NODE_CLASS_MAPPINGS[x], "INTERNAL", False):
+                        continue
                     try:
                         out[x] = node_info(x)
                     except Exception:
@@ -680,7 +738,7 @@ class PromptServer():
         async def get_object_info_node(request):
             node_class = request.match_info.get("node_class", None)
             out = {}
-            if (node_class is not None) and (node_class in nodes.NODE_CLASS_MAPPINGS):
+            if (node_class is not None) and (node_class in nodes.NODE_CLASS_MAPPINGS) and not getattr(nodes.NODE_CLASS_MAPPINGS[node_class], "INTERNAL", False):
                 out[node_class] = node_info(node_class)
             return web.json_response(out)
 
@@ -696,17 +754,37 @@ class PromptServer():
             else:
                 offset = -1
 
+            client_id = request.rel_url.query.get("client_id", None)
+            since = request.rel_url.query.get("since", None)
+            if client_id is not None or since is not None:
+                if self.prompt_queue.store is None:
+                    return web.json_response({"error": "Filtering the history requires --persist-queue"}, status=400)
+                if since is not None:
+                    try:
+                        since = float(since)
+                    except ValueError:
+                        return web.json_response({"error": "since must be a timestamp in seconds"}, status=400)
+                # The store queries the database, keep it off the event loop
+                history = await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: self.prompt_queue.store.get_history(client_id=client_id, since=since, max_items=max_items, offset=offset))
+                return web.json_response(history)
+
             return web.json_response(self.prompt_queue.get_history(max_items=max_items, offset=offset))
 
         @routes.get("/history/{prompt_id}")
         async def get_history_prompt_id(request):
             prompt_id = request.match_info.get("prompt_id", None)
-            return web.json_response(self.prompt_queue.get_history(prompt_id=prompt_id))
+            # Entries that are no longer in memory are read from the store
+            history = await asyncio.get_running_loop().run_in_executor(None, lambda: self.prompt_queue.get_history(prompt_id=prompt_id))
+            return web.json_response(history)
 
         @routes.get("/queue")
         async def get_queue(request):
             queue_info = {}
             current_queue = self.prompt_queue.get_current_queue_volatile()
+            client_id = request.rel_url.query.get("client_id", None)
+            if client_id is not None:
+                current_queue = tuple([x for x in items if x[3].get("client_id", None) == client_id] for items in current_queue)
             queue_info['queue_running'] = current_queue[0]
             queue_info['queue_pending'] = current_queue[1]
             return web.json_response(queue_info)
@@ -735,7 +813,9 @@ class PromptServer():
                 if "partial_execution_targets" in json_data:
                     partial_execution_targets = json_data["partial_execution_targets"]
 
+                validation_start = time.perf_counter()
                 valid = await execution.validate_prompt(prompt_id, prompt, partial_execution_targets)
+                self.record_validation_time((time.perf_counter() - validation_start) * 1000)
                 extra_data = {}
                 if "extra_data" in json_data:
                     extra_data = json_data["extra_data"]
@@ -795,13 +875,22 @@ class PromptServer():
                         break
 
                 if should_interrupt:
-                    nodes.interrupt_processing()
+                    if len(self.worker_servers) > 0:
+                        # Only interrupt the worker running this prompt
+                        for thread_id in self.prompt_queue.get_running_thread_ids(prompt_id):
+                            nodes.interrupt_processing(thread_id=thread_id)
+                    else:
+                        nodes.interrupt_processing()
                 else:
                     logging.info(f"Prompt {prompt_id} is not currently running, skipping interrupt")
             else:
                 # No prompt_id provided, do a global interrupt
                 logging.info("Global interrupt (no prompt_id specified)")
-                nodes.interrupt_processing()
+                if len(self.worker_servers) > 0:
+                    for thread_id in self.prompt_queue.get_running_thread_ids():
+                        nodes.interrupt_processing(thread_id=thread_id)
+                else:
+                    nodes.interrupt_processing()
 
             return web.Response(status=200)
 
@@ -996,6 +1085,14 @@ class PromptServer():
         self.loop.call_soon_threadsafe(
             self.messages.put_nowait, (event, data, sid))
 
+    def record_validation_time(self, ms):
+        stats = self.validation_stats
+        stats["count"] += 1
+        stats["total_ms"] += ms
+        stats["max_ms"] = max(stats["max_ms"], ms)
+        stats["last_ms"] = ms
+        logging.debug("Prompt validated in {:.2f} ms".format(ms))
+
     def queue_updated(self):
         self.send_sync("status", { "status": self.get_queue_info() })
 
@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app.database import prompt_store  # noqa: E402
+from app.database.models import Base  # noqa: E402
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    engine = create_engine("sqlite:///{}".format(tmp_path / "comfyui.db"))
+    Base.metadata.create_all(engine)
+    monkeypatch.setattr(prompt_store, "create_session", sessionmaker(bind=engine))
+    return prompt_store.PromptStore(flush_interval=0.01)
+
+
+def make_item(number, prompt_id, client_id):
+    return (number, prompt_id, {"1": {"class_type": "SaveImage", "inputs": {}}}, {"client_id": client_id}, ["1"])
+
+
+def test_queue_is_restored(store):
+    store.queue_put(make_item(2, "b", "c1"))
+    store.queue_put(make_item(1, "a", "c2"))
+    store.queue_put(make_item(3, "c", "c1"))
+    store.queue_remove("c")
+    assert store.load_queue() == [make_item(1, "a", "c2"), make_item(2, "b", "c1")]
+
+
+def test_history_lookups(store):
+    for i in range(5):
+        item = make_item(i, "p{}".format(i), "c{}".format(i % 2))
+        store.history_put(item[1], {"prompt": item, "outputs": {}, "status": None})
+    store.flush()
+    entry = store.get_history(prompt_id="p3")["p3"]
+    assert entry["prompt"] == make_item(3, "p3", "c1")
+
+    assert list(store.get_history(client_id="c0")) == ["p0", "p2", "p4"]
+    assert list(store.get_history(client_id="c0", max_items=2)) == ["p2", "p4"]
+    assert list(store.get_history(max_items=2, offset=1)) == ["p1", "p2"]
+
+    store.history_remove("p2")
+    assert list(store.get_history(client_id="c0")) == ["p0", "p4"]
+    store.history_clear()
+    assert store.get_history() == {}
+
+
+def test_history_trim(store):
+    for i in range(5):
+        item = make_item(i, "p{}".format(i), "c0")
+        store.history_put(item[1], {"prompt": item, "outputs": {}, "status": None})
+    store.history_trim(2)
+    assert list(store.get_history()) == ["p3", "p4"]
@@ -0,0 +1,44 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("safetensors")
+
+from comfy.baked_patches import BakedPatchCache, patches_key  # noqa: E402
+
+
+def test_patches_key():
+    source = [("checkpoint", ("/models/a.safetensors", 1, 2), {}), (("/loras/b.safetensors", 3, 4), 0.8, 1.0)]
+    patches = {"weight": [(0.8, None, 1.0, None, None)]}
+    key = patches_key(source, patches)
+    assert key == patches_key(list(source), {"weight": [(0.8, None, 1.0, None, None)]})
+    assert key != patches_key(source[:1] + [(source[1][0], 0.5, 1.0)], patches)
+    assert key != patches_key(source, {"weight": [(0.5, None, 1.0, None, None)]})
+    assert key != patches_key(source, {"weight": patches["weight"], "bias": patches["weight"]})
+
+
+def test_save_and_open(tmp_path):
+    cache = BakedPatchCache()
+    assert not cache.enabled()
+    cache.set_directory(str(tmp_path), 1024 * 1024)
+    assert cache.enabled()
+    assert cache.open("key") is None
+
+    cache.save("key", {"a": torch.ones(2)}).join()
+    assert cache.open("key") is not None
+
+    existing = cache.open("key")
+    cache.save("key", {"b": torch.zeros(3)}, existing=existing).join()
+    # Closed before the file is replaced
+    with pytest.raises(Exception, match="closed"):
+        existing.handle.get_tensor("a")
+    sd = cache.open("key")
+    assert torch.equal(sd["a"], torch.ones(2))
+    assert torch.equal(sd["b"], torch.zeros(3))
+
+
+def test_eviction(tmp_path):
+    cache = BakedPatchCache()
+    cache.set_directory(str(tmp_path), 1)
+    cache.save("key", {"a": torch.ones(16)}).join()
+    assert cache.open("key") is None
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,113 @@
+import uuid
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("scipy")
+
+import comfy.conds  # noqa: E402
+import comfy.samplers  # noqa: E402
+
+
+class FakePatcher:
+    def prepare_hook_patches_current_keyframe(self, timestep, hooks, model_options):
+        pass
+
+    def prepare_state(self, timestep):
+        pass
+
+    def apply_hooks(self, hooks):
+        return {}
+
+
+class FakeModel:
+    def __init__(self, memory_per_item):
+        self.current_patcher = FakePatcher()
+        self.memory_per_item = memory_per_item
+        self.memory_required_calls = 0
+        self.calls = []
+
+    def memory_profile_key(self):
+        return "fake"
+
+    def memory_usage_area(self, input_shape, cond_shapes=None):
+        return input_shape[0]
+
+    def memory_required(self, input_shape, cond_shapes=None):
+        self.memory_required_calls += 1
+        return input_shape[0] * self.memory_per_item
+
+    def apply_model(self, x, t, **c):
+        self.calls.append((x.shape[0], c["c_crossattn"]))
+        return x * 2
+
+
+def make_cond(value):
+    return [{"model_conds": {"c_crossattn": comfy.conds.CONDCrossAttn(torch.full((1, 4, 8), value))}, "uuid": uuid.uuid4()}]
+
+
+def run(model, conds, planner, steps=3):
+    x = torch.ones((1, 4, 8, 8))
+    options = {"cond_batch_planner": planner}
+    for step in range(steps):
+        out = comfy.samplers._calc_cond_batch(model, conds, x, torch.tensor([1.0 - step * 0.1]), options)
+        assert torch.allclose(out[0], x * 2)
+
+
+def test_plan_and_conditioning_reused_between_steps():
+    model = FakeModel(memory_per_item=1)
+    planner = comfy.samplers.CondBatchPlanner()
+    run(model, [make_cond(1.0), make_cond(2.0)], planner)
+
+    assert planner.passes == [1, 1, 1]
+    assert model.memory_required_calls == 1
+    assert [n for n, _ in model.calls] == [2, 2, 2]
+    # The concatenated conditioning is the same tensor every step
+    assert model.calls[0][1] is model.calls[1][1] is model.calls[2][1]
+
+
+def test_split_when_memory_is_low():
+    model = FakeModel(memory_per_item=1e30)
+    planner = comfy.samplers.CondBatchPlanner()
+    run(model, [make_cond(1.0), make_cond(2.0)], planner)
+
+    assert planner.passes == [2, 2, 2]
+    assert [n for n, _ in model.calls] == [1] * 6
+
+    stats = comfy.samplers.CondBatchStats()
+    stats.add(planner.passes)
+    stats.add([1, 1])
+    assert stats.stats() == {
+        "runs": 2,
+        "evaluations": 5,
+        "forward_passes": 8,
+        "split_evaluations": 3,
+        "passes_per_evaluation": {"1": 2, "2": 3},
+    }
+
+
+def test_new_plan_when_conds_change():
+    model = FakeModel(memory_per_item=1)
+    planner = comfy.samplers.CondBatchPlanner()
+    cond = make_cond(1.0)
+    # The uncond stops being used after the first step
+    uncond = make_cond(2.0)
+    uncond[0]["timestep_end"] = 0.95
+    run(model, [cond, uncond], planner)
+
+    assert planner.passes == [1, 1, 1]
+    assert [n for n, _ in model.calls] == [2, 1, 1]
+    assert model.memory_required_calls == 2
+
+
+def test_replaced_conds_are_concatenated_again():
+    model = FakeModel(memory_per_item=1)
+    planner = comfy.samplers.CondBatchPlanner()
+    conds = [make_cond(1.0), make_cond(2.0)]
+    run(model, conds, planner, steps=1)
+    conds[1][0]["model_conds"] = {"c_crossattn": comfy.conds.CONDCrossAttn(torch.full((1, 4, 8), 3.0))}
+    run(model, conds, planner, steps=1)
+
+    assert model.calls[0][1] is not model.calls[1][1]
+    # Batches run the conds in reverse order
+    assert torch.all(model.calls[1][1][0] == 3.0)
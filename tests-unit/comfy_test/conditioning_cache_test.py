@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from comfy.conditioning_cache import ConditioningCache, cacheable, tokens_key, weights_key  # noqa: E402
+
+
+def make_patcher(model_files=(), patches={}, patches_source=None):
+    return SimpleNamespace(model=torch.nn.Linear(1, 1), model_files=model_files, patches=patches, patches_source=patches_source,
+                           patches_uuid="uuid", forced_hooks=None, hook_patches={}, object_patches={})
+
+
+def test_tokens_key():
+    tokens = {"l": [[(49406, 1.0), (320, 1.2), (49407, 1.0)]]}
+    assert tokens_key("w", tokens) == tokens_key("w", {"l": [[(49406, 1.0), (320, 1.2), (49407, 1.0)]]})
+    assert tokens_key("w", tokens) != tokens_key("w", {"l": [[(49406, 1.0), (320, 1.0), (49407, 1.0)]]})
+    assert tokens_key("w", tokens) != tokens_key("other", tokens)
+    assert tokens_key([torch.ones(3)]) != tokens_key([torch.zeros(3)])
+
+
+def test_weights_key(tmp_path):
+    path = tmp_path / "t5xxl.safetensors"
+    path.write_bytes(b"weights")
+    key, persistent = weights_key(make_patcher((str(path),)))
+    assert persistent
+    assert weights_key(make_patcher((str(path),)))[0] == key
+    # Patches that can only be identified in this process
+    key, persistent = weights_key(make_patcher((str(path),), patches={"w": []}))
+    assert not persistent and key == "memory:uuid"
+    key, persistent = weights_key(make_patcher((str(path),), patches={"w": [(1.0, None, 1.0, None, None)]}, patches_source=[("lora", 1.0, 1.0)]))
+    assert persistent
+
+    patcher = make_patcher()
+    assert cacheable(patcher)
+    patcher.object_patches = {"x": 1}
+    assert not cacheable(patcher)
+
+
+def test_lru_budget():
+    cache = ConditioningCache(budget=3 * 4 * 100)
+    for i in range(4):
+        cache.put(str(i), (torch.zeros(100), None))
+    assert cache.get("0") is None
+    assert cache.get("3") is not None
+    cache.put("big", (torch.zeros(1000),))
+    assert cache.get("big") is None
+    assert cache.stats()["resident_bytes"] == 3 * 4 * 100
+
+
+def test_persistent_entries(tmp_path):
+    cache = ConditioningCache(budget=1024 ** 2)
+    cache.set_directory(str(tmp_path))
+    value = (torch.arange(4.0), torch.ones(2), {"attention_mask": torch.ones(1, 4)})
+    cache.put("persistent", value, persistent=True)
+    cache.put("memory", value)
+
+    cache = ConditioningCache(budget=1024 ** 2)
+    cache.set_directory(str(tmp_path))
+    assert cache.get("memory", persistent=True) is None
+    cond, pooled, extra = cache.get("persistent", persistent=True)
+    assert torch.equal(cond, value[0])
+    assert torch.equal(extra["attention_mask"], value[2]["attention_mask"])
+
+
+def test_encoder_key():
+    cache = ConditioningCache(budget=1)
+    assert cache.encoder_key() is None
+    with cache.encoder("weights"):
+        assert cache.encoder_key() == "weights"
+        with cache.encoder(None):
+            assert cache.encoder_key() is None
+    assert cache.encoder_key() is None
+    assert ConditioningCache(budget=0).encoder_key() is None
+
+
+def test_sections_are_reused(monkeypatch):
+    pytest.importorskip("transformers")
+    import comfy.conditioning_cache
+    from comfy.sd1_clip import ClipTokenWeightEncoder
+
+    class Encoder(ClipTokenWeightEncoder):
+        special_tokens = {"start": 1, "end": 2, "pad": 2}
+
+        def __init__(self):
+            self.encoded = []
+
+        def encode(self, tokens):
+            self.encoded.append(len(tokens))
+            t = torch.tensor(tokens, dtype=torch.float32)
+            return t.unsqueeze(-1).repeat(1, 1, 4), t.sum(dim=1, keepdim=True)
+
+    monkeypatch.setattr(comfy.conditioning_cache, "conditioning_cache", ConditioningCache(budget=1024 ** 2))
+    first = [(1, 1.0), (5, 1.0), (2, 1.0)]
+    second = [(1, 1.0), (6, 1.5), (2, 1.0)]
+    third = [(1, 1.0), (7, 1.5), (2, 1.0)]
+
+    encoder = Encoder()
+    expected = encoder.encode_token_weights([first, third])
+    with comfy.conditioning_cache.conditioning_cache.encoder("weights"):
+        encoder.encoded = []
+        encoder.encode_token_weights([first, second])
+        assert encoder.encoded == [3]
+        out = encoder.encode_token_weights([first, third])
+        # first and the empty section were encoded before
+        assert encoder.encoded == [3, 1]
+        assert torch.equal(out[0], expected[0])
+        assert torch.equal(out[1], expected[1])
+        encoder.encode_token_weights([first, third])
+        assert encoder.encoded == [3, 1]
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from comfy.detection_cache import DetectionCache, state_dict_fingerprint  # noqa: E402
+
+
+def test_fingerprint_uses_shapes_and_dtypes():
+    sd = {"a.weight": torch.zeros(2, 3), "b.bias": torch.zeros(3)}
+    assert state_dict_fingerprint(sd, "a.") == state_dict_fingerprint(dict(reversed(list(sd.items()))), "a.")
+    assert state_dict_fingerprint(sd, "a.") != state_dict_fingerprint(sd, "b.")
+    assert state_dict_fingerprint(sd) != state_dict_fingerprint({"a.weight": torch.zeros(3, 2), "b.bias": torch.zeros(3)})
+    assert state_dict_fingerprint(sd) != state_dict_fingerprint({"a.weight": torch.zeros(2, 3, dtype=torch.float16), "b.bias": torch.zeros(3)})
+
+
+def test_results_persist(tmp_path):
+    path = str(tmp_path / "cache" / "model_detection_cache.json")
+    unet_config = {"patch_size": (1, 2, 2), "depths": [1, 2], "dtype": torch.float16, "image_model": "wan2.1", "nested": {"x": None}}
+
+    cache = DetectionCache()
+    assert not cache.enabled()
+    cache.set_path(path)
+    assert cache.enabled()
+    cache.put("key", (unet_config, "WAN21_T2V"))
+    assert cache.get("missing") is None
+
+    cache = DetectionCache()
+    cache.set_path(path)
+    config, name = cache.get("key")
+    assert name == "WAN21_T2V"
+    assert config == unet_config
+    assert isinstance(config["patch_size"], tuple)
+    assert isinstance(config["depths"], list)
+
+
+def test_stale_or_invalid_file_is_ignored(tmp_path):
+    path = str(tmp_path / "model_detection_cache.json")
+    with open(path, "w") as f:
+        json.dump({"version": "other", "entries": {"key": [{"__dict__": []}, None]}}, f)
+    cache = DetectionCache()
+    cache.set_path(path)
+    assert cache.get("key") is None
+
+    with open(path, "w") as f:
+        f.write("not json")
+    cache.set_path(path)
+    assert cache.get("key") is None
+    cache.put("key", ({}, None))
+    cache.set_path(path)
+    assert cache.get("key") == ({}, None)
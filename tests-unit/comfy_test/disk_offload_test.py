@@ -0,0 +1,87 @@
+import gc
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from comfy.disk_offload import DiskOffload  # noqa: E402
+
+
+def make_model():
+    return torch.nn.Sequential(torch.nn.Linear(64, 64), torch.nn.Linear(64, 32)).requires_grad_(False)
+
+
+def test_disabled():
+    offload = DiskOffload()
+    model = make_model()
+    offload.register(model)
+    assert offload.enforce_budget() == 0
+    assert len(offload.models) == 0
+
+
+def test_weights_are_mapped_over_budget(tmp_path):
+    offload = DiskOffload()
+    model_size = (64 * 64 + 64 + 64 * 32 + 32) * 4
+    offload.set_directory(str(tmp_path), model_size)
+    old = make_model()
+    expected_old = [p.clone() for p in old.parameters()]
+    offload.register(old)
+    old.disk_offload_last_used = 0
+    # Fits in the budget
+    assert offload.resident_bytes() == model_size
+
+    new = make_model()
+    offload.register(new)
+    assert offload.resident_bytes() == model_size * 2
+    offload.enforce_budget()
+    assert offload.resident_bytes() <= offload.ram_budget
+    # The modules of the least recently used model are offloaded first
+    assert offload.is_mapped(old[0]) and offload.is_mapped(old[1])
+    for p, expected in zip(old.parameters(), expected_old):
+        assert torch.equal(p, expected)
+
+    x = torch.randn(2, 64)
+    assert old(x).shape == (2, 32)
+
+    directory = os.path.join(str(tmp_path), old.disk_offload_id)
+    assert len(os.listdir(directory)) == 4
+    del old, p
+    gc.collect()
+    assert not os.path.exists(directory)
+
+
+def test_modules_moved_back_to_ram_count_as_resident(tmp_path):
+    offload = DiskOffload()
+    offload.set_directory(str(tmp_path), 0)
+    model = make_model()
+    offload.register(model)
+    offload.enforce_budget()
+    assert offload.resident_bytes() == 0
+
+    model[0].weight.data = model[0].weight.data.clone()
+    assert not offload.is_mapped(model[0])
+    assert offload.resident_bytes() == (64 * 64 + 64) * 4
+    offload.enforce_budget()
+    assert offload.resident_bytes() == 0
+    # Only the weight was written again
+    assert len(os.listdir(os.path.join(str(tmp_path), model.disk_offload_id))) == 4
+
+
+def test_weights_are_offloaded_while_loading(tmp_path):
+    offload = DiskOffload()
+    layer_size = (64 * 64 + 64) * 4
+    offload.set_directory(str(tmp_path), layer_size)
+    source = torch.nn.Sequential(*[torch.nn.Linear(64, 64) for _ in range(4)])
+    model = torch.nn.Sequential(*[torch.nn.Linear(64, 64) for _ in range(4)]).requires_grad_(False)
+
+    resident = []
+    with offload.loading(model):
+        for module in model:
+            module.register_load_state_dict_post_hook(lambda module, keys: resident.append(offload.resident_bytes()))
+        model.load_state_dict(source.state_dict())
+    assert max(resident) <= layer_size
+    assert offload.resident_bytes() <= layer_size
+    assert sum(offload.is_mapped(module) for module in model) == 3
+    for p, expected in zip(model.parameters(), source.parameters()):
+        assert torch.equal(p, expected)
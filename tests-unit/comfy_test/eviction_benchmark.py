@@ -0,0 +1,74 @@
+"""
+Compares the eviction policies of comfy.eviction by replaying a sequence of load_models_gpu calls and
+reporting the bytes loaded to the device under each of them.
+
+    python tests-unit/comfy_test/eviction_benchmark.py [trace.jsonl] [--vram GB]
+
+The trace is recorded with --record-model-loads, without one a synthetic queue of prompts that switch
+between a few checkpoints is used.
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import comfy.eviction  # noqa: E402
+
+GB = 1024 ** 3
+
+# name: (diffusion model, text encoder, vae) sizes in GB
+CHECKPOINTS = {
+    "sd15.safetensors": (1.7, 0.25, 0.17),
+    "sdxl.safetensors": (5.1, 1.6, 0.17),
+    "flux.safetensors": (11.9, 9.8, 0.17),
+    "sd3.safetensors": (4.2, 5.6, 0.17),
+}
+
+
+def synthetic_trace(prompts=200, lookahead=comfy.eviction.LOOKAHEAD_PROMPTS, seed=0):
+    rng = random.Random(seed)
+    names = list(CHECKPOINTS.keys())
+    queue = []
+    current = rng.choice(names)
+    for _ in range(prompts):
+        # Users tend to queue several prompts with the same model in a row
+        if rng.random() < 0.3:
+            current = rng.choice(names)
+        queue.append(current)
+
+    trace = []
+    for i, name in enumerate(queue):
+        upcoming = [[n] for n in queue[i:i + lookahead + 1]]
+        files = ["/models/checkpoints/" + name]
+        unet, clip, vae = CHECKPOINTS[name]
+        for part, size, memory_required in (("clip", clip, 0.5), ("unet", unet, 2.0), ("vae", vae, 1.5)):
+            trace.append({
+                "models": [{"id": "{}:{}".format(name, part), "size": int(size * GB), "files": files}],
+                "memory_required": int(memory_required * GB),
+                "upcoming": upcoming,
+            })
+    return trace
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("trace", nargs="?", default=None)
+    parser.add_argument("--vram", type=float, default=None, help="Device memory in GB, defaults to the recorded one or 24.")
+    args = parser.parse_args()
+
+    if args.trace is not None:
+        trace = comfy.eviction.read_trace(args.trace)
+    else:
+        trace = synthetic_trace()
+
+    memory = args.vram * GB if args.vram is not None else trace[0].get("total_memory", 24 * GB)
+    print("{} load calls, {:.1f} GB of device memory".format(len(trace), memory / GB))  # noqa: T201
+    for name, policy in comfy.eviction.POLICIES.items():
+        stats = comfy.eviction.simulate(trace, policy(), memory)
+        print("{:>10}: {:8.1f} GB loaded, {:5} loads, {:5} unloads".format(name, stats["bytes_loaded"] / GB, stats["loads"], stats["unloads"]))  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
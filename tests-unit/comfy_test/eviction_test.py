@@ -0,0 +1,81 @@
+import json
+import os
+
+import comfy.eviction
+from comfy.eviction import DefaultPolicy, EvictionCandidate, LookaheadPolicy, LRUPolicy, LoadRecorder, simulate, uses_files
+
+GB = 1024 ** 3
+
+
+def model_path(name):
+    return os.path.join(os.sep, "models", "checkpoints", name)
+
+
+def test_uses_files():
+    assert uses_files((model_path("a.safetensors"),), {"a.safetensors"})
+    assert uses_files((model_path(os.path.join("sub", "a.safetensors")),), {"sub/a.safetensors"})
+    assert not uses_files((model_path("a.safetensors"),), {"b.safetensors"})
+    assert not uses_files((model_path("aa.safetensors"),), {"a.safetensors"})
+
+
+def test_default_policy_keeps_the_old_order():
+    partial = EvictionCandidate(2, 10, 5)
+    small = EvictionCandidate(0, 1, 1)
+    large = EvictionCandidate(1, 8, 8)
+    referenced = EvictionCandidate(3, 1, 1, refcount=5)
+    assert DefaultPolicy().order([small, large, referenced, partial], []) == [partial, small, large, referenced]
+
+
+def test_lru_policy():
+    recent = EvictionCandidate(0, 1, 1)
+    old = EvictionCandidate(5, 1, 1)
+    assert LRUPolicy().order([recent, old], []) == [old, recent]
+
+
+def test_lookahead_policy_unloads_the_model_needed_last():
+    soon = EvictionCandidate(3, 1, 1, model_files=(model_path("a.safetensors"),))
+    later = EvictionCandidate(0, 1, 1, model_files=(model_path("b.safetensors"),))
+    unused = EvictionCandidate(1, 1, 1, model_files=(model_path("c.safetensors"),))
+    unknown = EvictionCandidate(2, 1, 1)
+    upcoming = [{"a.safetensors"}, {"b.safetensors"}]
+    assert LookaheadPolicy().order([soon, later, unused, unknown], upcoming) == [unused, unknown, later, soon]
+    # Without a queue it is LRU
+    assert LookaheadPolicy().order([later, soon], []) == [soon, later]
+
+
+def test_upcoming_is_only_queried_for_lookahead(monkeypatch):
+    calls = []
+    monkeypatch.setattr(comfy.eviction, "upcoming_provider", lambda: calls.append(1) or [{"a.safetensors"}])
+    monkeypatch.setattr(comfy.eviction, "policy", DefaultPolicy())
+    comfy.eviction.order_candidates([EvictionCandidate(0, 1, 1)])
+    assert calls == []
+    comfy.eviction.set_policy("lookahead")
+    comfy.eviction.order_candidates([EvictionCandidate(0, 1, 1)])
+    assert calls == [1]
+
+
+def load(name, size, upcoming):
+    return {"models": [{"id": name, "size": size * GB, "files": [model_path(name)]}], "memory_required": 0, "upcoming": [[n] for n in upcoming]}
+
+
+def test_simulate_lookahead_loads_less():
+    # a and b fit together, c needs one of them out. a is used again right after c, b isn't.
+    sequence = ["a", "b", "c", "a", "c", "a"]
+    trace = [load(name, 4, sequence[i:]) for i, name in enumerate(sequence)]
+    lru = simulate(trace, LRUPolicy(), 10 * GB)
+    lookahead = simulate(trace, LookaheadPolicy(), 10 * GB)
+    assert lru["bytes_loaded"] == 4 * 4 * GB
+    assert lookahead["bytes_loaded"] == 3 * 4 * GB
+    assert lookahead["loads"] == 3
+
+
+def test_recorded_trace_replays(tmp_path):
+    path = str(tmp_path / "loads" / "trace.jsonl")
+    recorder = LoadRecorder()
+    recorder.set_path(path)
+    recorder.record([(1, GB, (model_path("a.safetensors"),))], 0, 8 * GB, [{"a.safetensors"}])
+    recorder.record([(2, GB, ())], GB, 8 * GB, [])
+    trace = comfy.eviction.read_trace(path)
+    assert trace[0]["models"][0]["id"] == "1"
+    assert json.loads(json.dumps(trace[0]["upcoming"])) == [["a.safetensors"]]
+    assert simulate(trace, DefaultPolicy(), trace[0]["total_memory"])["bytes_loaded"] == 2 * GB
@@ -0,0 +1,63 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("safetensors")
+
+import comfy.utils  # noqa: E402
+
+
+@pytest.fixture
+def checkpoint(tmp_path):
+    path = str(tmp_path / "model.safetensors")
+    sd = {
+        "model.diffusion_model.weight": torch.ones(4, 3),
+        "first_stage_model.weight": torch.zeros(2, dtype=torch.float16),
+        "cond_stage_model.weight": torch.full((5,), 2.0),
+    }
+    comfy.utils.save_torch_file(sd, path, metadata={"format": "pt"})
+    return path
+
+
+def test_lazy_load_reads_on_access(checkpoint):
+    sd, metadata = comfy.utils.load_torch_file(checkpoint, return_metadata=True, lazy=True)
+    assert isinstance(sd, comfy.utils.LazyStateDict)
+    assert metadata == {"format": "pt"}
+    assert len(sd) == 3
+    assert "first_stage_model.weight" in sd
+
+    assert isinstance(sd.info("model.diffusion_model.weight"), comfy.utils.TensorInfo)
+    assert comfy.utils.calculate_parameters(sd) == 19
+    assert comfy.utils.weight_dtype(sd, "first_stage_model.") == torch.float16
+    assert comfy.utils.state_dict_info(sd)["model.diffusion_model.weight"].shape == (4, 3)
+    assert all(isinstance(sd.info(k), comfy.utils.TensorInfo) for k in sd)
+
+    assert torch.equal(sd["model.diffusion_model.weight"], torch.ones(4, 3))
+    assert isinstance(sd.info("model.diffusion_model.weight"), torch.Tensor)
+
+
+def test_prefix_filter_does_not_read(checkpoint):
+    sd = comfy.utils.load_torch_file(checkpoint, lazy=True)
+    vae_sd = comfy.utils.state_dict_prefix_replace(sd, {"first_stage_model.": ""}, filter_keys=True)
+    assert isinstance(vae_sd, comfy.utils.LazyStateDict)
+    assert list(vae_sd.keys()) == ["weight"]
+    assert "first_stage_model.weight" not in sd
+    assert isinstance(vae_sd.info("weight"), comfy.utils.TensorInfo)
+    assert torch.equal(vae_sd["weight"], torch.zeros(2, dtype=torch.float16))
+
+    comfy.utils.state_dict_key_replace(sd, {"cond_stage_model.weight": "clip.weight"})
+    assert isinstance(sd.info("clip.weight"), comfy.utils.TensorInfo)
+
+    out = {}
+    comfy.utils.move_key(sd, "clip.weight", out, "w")
+    assert torch.equal(out["w"], torch.full((5,), 2.0))
+
+
+def test_close(checkpoint):
+    with comfy.utils.load_torch_file(checkpoint, lazy=True) as sd:
+        weight = sd["model.diffusion_model.weight"]
+        vae_sd = comfy.utils.state_dict_prefix_replace(sd, {"first_stage_model.": ""}, filter_keys=True)
+    assert torch.equal(weight, torch.ones(4, 3))
+    with pytest.raises(Exception, match="closed"):
+        vae_sd["weight"]
+    comfy.utils.close_state_dict(sd)
+    comfy.utils.close_state_dict({})
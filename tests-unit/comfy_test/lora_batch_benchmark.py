@@ -0,0 +1,64 @@
+"""
+CPU benchmark of comfy.lora.batch_lora_patches against patching one key at a time.
+
+    python tests-unit/comfy_test/lora_batch_benchmark.py
+"""
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+import comfy.lora  # noqa: E402
+from comfy.weight_adapter import LoRAAdapter  # noqa: E402
+
+# (out_features, in_features, count): the attention and feed forward linears patched by typical LoRAs
+MODELS = {
+    "sdxl": [(640, 640, 40), (1280, 1280, 140), (640, 2048, 20), (1280, 2048, 70), (5120, 640, 10), (640, 2560, 10), (10240, 1280, 35), (1280, 5120, 35)],
+    "flux": [(9216, 3072, 38), (3072, 3072, 76), (12288, 3072, 76), (3072, 12288, 38), (21504, 3072, 38), (3072, 15360, 38)],
+}
+
+
+def make_patches(shapes, rank):
+    key_patches = {}
+    weight_shapes = {}
+    for out_features, in_features, count in shapes:
+        for i in range(count):
+            key = "{}x{}.{}.weight".format(out_features, in_features, i)
+            up = torch.randn(out_features, rank, dtype=torch.float16)
+            down = torch.randn(rank, in_features, dtype=torch.float16)
+            key_patches[key] = [(1.0, LoRAAdapter(set(), (up, down, float(rank), None, None, None)), 1.0, None, None)]
+            weight_shapes[key] = torch.Size((out_features, in_features))
+    return key_patches, weight_shapes
+
+
+def patch_all(key_patches, weight_shapes, batched):
+    start = time.perf_counter()
+    keys = list(key_patches.keys())
+    batch_bytes = 256 * 1024 * 1024
+    i = 0
+    while i < len(keys):
+        batch = []
+        size = 0
+        while i < len(keys) and size < batch_bytes:
+            batch.append(keys[i])
+            size += weight_shapes[keys[i]].numel() * 4
+            i += 1
+        patches = {}
+        if batched:
+            patches = comfy.lora.batch_lora_patches({k: key_patches[k] for k in batch}, weight_shapes, torch.device("cpu"))
+        for k in batch:
+            weight = torch.zeros(weight_shapes[k])
+            comfy.lora.calculate_weight(patches.get(k, key_patches[k]), weight, k)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    torch.manual_seed(0)
+    for name, shapes in MODELS.items():
+        key_patches, weight_shapes = make_patches(shapes, 32)
+        per_key = patch_all(key_patches, weight_shapes, False)
+        batched = patch_all(key_patches, weight_shapes, True)
+        print("{}: {} keys, per key {:.2f}s, batched {:.2f}s, speedup {:.2f}x".format(name, len(key_patches), per_key, batched, per_key / batched))  # noqa: T201
@@ -0,0 +1,49 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+import comfy.lora  # noqa: E402
+from comfy.weight_adapter import LoRAAdapter  # noqa: E402
+
+
+def lora_patch(out_features, in_features, rank, alpha=None, strength=0.7):
+    up = torch.randn(out_features, rank, dtype=torch.float16)
+    down = torch.randn(rank, in_features, dtype=torch.float16)
+    adapter = LoRAAdapter(set(), (up, down, alpha, None, None, None))
+    return (strength, adapter, 1.0, None, None)
+
+
+def test_batched_patches_match_calculate_weight():
+    torch.manual_seed(0)
+    shapes = {"a.weight": (64, 32), "b.weight": (64, 32), "c.weight": (16, 8), "d.weight": (64, 32)}
+    key_patches = {
+        "a.weight": [lora_patch(64, 32, 4, alpha=2.0)],
+        "b.weight": [lora_patch(64, 32, 4), lora_patch(64, 32, 4, strength=-0.3)],
+        "c.weight": [lora_patch(16, 8, 4)],
+        "d.weight": [lora_patch(64, 32, 8)],
+    }
+    weights = {k: torch.randn(s) for k, s in shapes.items()}
+
+    batched = comfy.lora.batch_lora_patches(key_patches, {k: torch.Size(s) for k, s in shapes.items()}, torch.device("cpu"))
+    # c and d have no other patch with the same shapes to batch with
+    assert set(batched.keys()) == {"a.weight", "b.weight"}
+    assert all(len(p[1]) == 1 for p in batched["b.weight"])
+
+    for k in key_patches:
+        expected = comfy.lora.calculate_weight(key_patches[k], weights[k].clone(), k)
+        result = comfy.lora.calculate_weight(batched.get(k, key_patches[k]), weights[k].clone(), k)
+        torch.testing.assert_close(result, expected, rtol=1e-4, atol=1e-4)
+
+
+def test_conv_lora_batches():
+    torch.manual_seed(0)
+    up = [torch.randn(8, 4, 1, 1) for _ in range(2)]
+    down = [torch.randn(4, 3, 3, 3) for _ in range(2)]
+    key_patches = {"{}.weight".format(i): [(1.0, LoRAAdapter(set(), (up[i], down[i], None, None, None, None)), 1.0, None, None)] for i in range(2)}
+    shape = torch.Size((8, 3, 3, 3))
+    batched = comfy.lora.batch_lora_patches(key_patches, {k: shape for k in key_patches}, torch.device("cpu"))
+    for k in key_patches:
+        weight = torch.randn(shape)
+        expected = comfy.lora.calculate_weight(key_patches[k], weight.clone(), k)
+        result = comfy.lora.calculate_weight(batched[k], weight.clone(), k)
+        torch.testing.assert_close(result, expected, rtol=1e-4, atol=1e-4)
@@ -0,0 +1,67 @@
+import pytest
+
+pytest.importorskip("torch")
+
+import comfy.model_management  # noqa: E402
+from comfy.memory_profiler import MARGIN, MemoryProfiler, fit  # noqa: E402
+
+
+def test_fit_is_above_every_sample():
+    samples = [(100, 1100), (200, 2300), (400, 4100)]
+    a, b = fit(samples)
+    for x, y in samples:
+        assert a + b * x >= y
+    assert fit([]) is None
+    assert fit([(100, 500)]) == (0.0, 5.0)
+
+
+def test_estimate_falls_back_when_not_measured(tmp_path):
+    profiler = MemoryProfiler()
+    profiler.set_path(str(tmp_path / "memory_profile.json"))
+    assert profiler.estimate("key", 100) is None
+    profiler.record("key", 100, 1000)
+    assert profiler.estimate("key", 100) == pytest.approx(1000 * MARGIN)
+    assert profiler.estimate("key", 150) == pytest.approx(1500 * MARGIN)
+    # Too far from what was measured
+    assert profiler.estimate("key", 1000) is None
+    assert profiler.estimate("other", 100) is None
+
+
+def test_measurements_persist(tmp_path):
+    path = str(tmp_path / "user" / "memory_profile.json")
+    profiler = MemoryProfiler()
+    profiler.set_path(path)
+    profiler.record("key", 100, 1000)
+    profiler.record("key", 100, 900)
+    profiler.record("key", 200, 1800)
+
+    profiler = MemoryProfiler()
+    profiler.set_path(path)
+    assert profiler.samples["key"] == {100: 1000, 200: 1800}
+    assert profiler.estimate("key", 200) >= 1800
+
+
+def test_measure_records_peak_above_start(tmp_path, monkeypatch):
+    stats = {"allocated": 500, "peak": 500}
+    monkeypatch.setattr(comfy.model_management, "memory_allocated", lambda dev: stats["allocated"] if dev == "gpu" else None)
+    monkeypatch.setattr(comfy.model_management, "reset_peak_memory", lambda dev: stats.update(peak=stats["allocated"]))
+    monkeypatch.setattr(comfy.model_management, "peak_memory_allocated", lambda dev: stats["peak"])
+
+    profiler = MemoryProfiler()
+    with profiler.measure("key", 100, "gpu"):
+        stats["peak"] = 1500
+    assert profiler.estimate("key", 100) is None
+
+    profiler.set_path(str(tmp_path / "memory_profile.json"))
+    with profiler.measure("key", 100, "gpu"):
+        stats["peak"] = 1500
+    assert profiler.samples["key"] == {100: 1000}
+
+    with profiler.measure("key", 200, "cpu"):
+        pass
+    assert 200 not in profiler.samples["key"]
+
+    with pytest.raises(RuntimeError):
+        with profiler.measure("key", 300, "gpu"):
+            raise RuntimeError("out of memory")
+    assert 300 not in profiler.samples["key"]
@@ -0,0 +1,98 @@
+import pytest
+
+import comfy.model_cache
+from comfy.model_cache import ModelFileCache
+
+
+@pytest.fixture(autouse=True)
+def device(monkeypatch):
+    device = ["cuda:0"]
+    monkeypatch.setattr(comfy.model_cache, "device_key", lambda: device[0])
+    return device
+
+
+class FakePatcher:
+    def __init__(self, size, parent=None):
+        self.size = size
+        self.parent = parent
+
+    def model_size(self):
+        return self.size
+
+    def clone(self):
+        return FakePatcher(self.size, parent=self)
+
+
+def make_file(tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b"weights")
+    return str(path)
+
+
+def test_disabled_cache_always_loads(tmp_path):
+    cache = ModelFileCache()
+    path = make_file(tmp_path, "a.safetensors")
+    loads = []
+    cache.load("checkpoint", [path], {}, lambda: loads.append(1))
+    cache.load("checkpoint", [path], {}, lambda: loads.append(1))
+    assert len(loads) == 2
+
+
+def test_hit_returns_clone(tmp_path):
+    cache = ModelFileCache(budget=100)
+    path = make_file(tmp_path, "a.safetensors")
+    first = cache.load("checkpoint", [path], {"dtype": None}, lambda: (FakePatcher(10), None))
+    second = cache.load("checkpoint", [path], {"dtype": None}, lambda: (FakePatcher(10), None))
+    assert first[0].parent is second[0].parent
+    assert first[0] is not second[0]
+    assert second[1] is None
+    assert cache.stats() == {"entries": 1, "resident_bytes": 10, "budget_bytes": 100, "hits": 1, "misses": 1}
+
+
+def test_key_includes_options_and_file_version(tmp_path):
+    cache = ModelFileCache(budget=100)
+    path = make_file(tmp_path, "a.safetensors")
+    cache.load("checkpoint", [path], {"dtype": "fp16"}, lambda: FakePatcher(10))
+    cache.load("checkpoint", [path], {"dtype": "fp8"}, lambda: FakePatcher(10))
+    assert cache.misses == 2
+
+    with open(path, "ab") as f:
+        f.write(b"changed")
+    cache.load("checkpoint", [path], {"dtype": "fp16"}, lambda: FakePatcher(10))
+    assert cache.misses == 3
+
+
+def test_key_includes_device(tmp_path, device):
+    cache = ModelFileCache(budget=100)
+    path = make_file(tmp_path, "a.safetensors")
+    cache.load("checkpoint", [path], {}, lambda: FakePatcher(10))
+    device[0] = "cuda:1"
+    cache.load("checkpoint", [path], {}, lambda: FakePatcher(10))
+    assert cache.misses == 2
+    device[0] = "cuda:0"
+    cache.load("checkpoint", [path], {}, lambda: FakePatcher(10))
+    assert cache.hits == 1
+
+
+def test_lru_eviction(tmp_path):
+    cache = ModelFileCache(budget=25)
+    paths = [make_file(tmp_path, "{}.safetensors".format(i)) for i in range(3)]
+    cache.load("unet", [paths[0]], {}, lambda: FakePatcher(10))
+    cache.load("unet", [paths[1]], {}, lambda: FakePatcher(10))
+    cache.load("unet", [paths[0]], {}, lambda: FakePatcher(10))
+    cache.load("unet", [paths[2]], {}, lambda: FakePatcher(10))
+    assert cache.resident_bytes == 20
+    assert cache.hits == 1
+
+    cache.load("unet", [paths[0]], {}, lambda: FakePatcher(10))
+    assert cache.hits == 2
+    cache.load("unet", [paths[1]], {}, lambda: FakePatcher(10))
+    assert cache.misses == 4
+
+    # Too large for the budget, returned without being cached
+    big = cache.load("unet", [paths[1]], {"dtype": "fp32"}, lambda: FakePatcher(50))
+    assert big.parent is None
+    assert cache.resident_bytes == 20
+
+    cache.set_budget(0)
+    assert cache.stats()["entries"] == 0
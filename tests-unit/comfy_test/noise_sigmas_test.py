@@ -0,0 +1,84 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("scipy")
+
+import comfy.sample  # noqa: E402
+import comfy.samplers  # noqa: E402
+import comfy.model_sampling  # noqa: E402
+
+
+def latent(batch_size):
+    return torch.zeros((batch_size, 4, 8, 8))
+
+
+def test_counter_noise_matches_legacy_for_single_item():
+    legacy = comfy.sample.prepare_noise(latent(1), 42, seeding="legacy")
+    counter = comfy.sample.prepare_noise(latent(1), 42, seeding="counter")
+    assert torch.equal(legacy, counter)
+
+
+def test_counter_noise_jumps_to_batch_index():
+    full = comfy.sample.prepare_noise(latent(6), 7, seeding="counter")
+    assert full.shape == (6, 4, 8, 8)
+    picked = comfy.sample.prepare_noise(latent(3), 7, noise_inds=[5, 2, 5], seeding="counter")
+    assert torch.equal(picked[0], full[5])
+    assert torch.equal(picked[1], full[2])
+    assert torch.equal(picked[2], full[5])
+    assert not torch.equal(full[0], full[1])
+
+
+def test_counter_noise_depends_on_seed():
+    a = comfy.sample.prepare_noise(latent(2), 1, seeding="counter")
+    b = comfy.sample.prepare_noise(latent(2), 2, seeding="counter")
+    assert not torch.equal(a[1], b[1])
+
+
+def test_legacy_noise_is_unchanged():
+    generator = torch.manual_seed(3)
+    expected = [torch.randn((1, 4, 8, 8), generator=generator) for _ in range(4)]
+    noise = comfy.sample.prepare_noise(latent(2), 3, noise_inds=[3, 1], seeding="legacy")
+    assert torch.equal(noise[0], expected[3][0])
+    assert torch.equal(noise[1], expected[1][0])
+
+
+def test_sigmas_cache_returns_copies(monkeypatch):
+    cache = comfy.samplers.SigmasCache()
+    monkeypatch.setattr(comfy.samplers, "sigmas_cache", cache)
+    model_sampling = comfy.model_sampling.ModelSamplingDiscrete()
+
+    first = comfy.samplers.calculate_sigmas(model_sampling, "beta", 10)
+    first[-1] = 5.0
+    second = comfy.samplers.calculate_sigmas(model_sampling, "beta", 10)
+    assert cache.hits == 1
+    assert second[-1] == 0
+    assert torch.equal(second[:-1], first[:-1])
+
+
+def test_sigmas_cache_key():
+    a = comfy.model_sampling.ModelSamplingDiscrete()
+    b = comfy.model_sampling.ModelSamplingDiscrete()
+    assert comfy.samplers.model_sampling_key(a) == comfy.samplers.model_sampling_key(b)
+
+    c = comfy.model_sampling.ModelSamplingDiscrete(zsnr=True)
+    assert comfy.samplers.model_sampling_key(a) != comfy.samplers.model_sampling_key(c)
+
+    d = comfy.model_sampling.ModelSamplingDiscreteFlow()
+    e = comfy.model_sampling.ModelSamplingDiscreteFlow()
+    e.set_parameters(shift=3.0)
+    assert comfy.samplers.model_sampling_key(d) != comfy.samplers.model_sampling_key(e)
+
+
+def test_sigmas_cache_key_is_remembered_until_changed(monkeypatch):
+    model_sampling = comfy.model_sampling.ModelSamplingDiscrete()
+    key = comfy.samplers.model_sampling_key(model_sampling)
+
+    hashed = []
+    sha256 = comfy.samplers.hashlib.sha256
+    monkeypatch.setattr(comfy.samplers.hashlib, "sha256", lambda: hashed.append(1) or sha256())
+    assert comfy.samplers.model_sampling_key(model_sampling) == key
+    assert hashed == []
+
+    model_sampling.sigmas[0] += 1.0
+    assert comfy.samplers.model_sampling_key(model_sampling) != key
+    assert hashed == [1]
@@ -0,0 +1,128 @@
+import concurrent.futures
+import threading
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+import comfy.model_management  # noqa: E402
+from comfy.prefetch import PrefetchScheduler  # noqa: E402
+
+
+class SlowCopyDevice:
+    """Simulated device with copies that take time and run in the background."""
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.copies = 0
+
+    def begin_copy(self, pairs):
+        def copy():
+            time.sleep(self.delay)
+            for src, dst in pairs:
+                dst.copy_(src)
+            self.copies += 1
+        return self.executor.submit(copy)
+
+    def wait_copy(self, handle):
+        if handle is not None:
+            handle.result()
+
+
+def make_modules(count):
+    torch.manual_seed(0)
+    return [torch.nn.Linear(8, 8).requires_grad_(False) for _ in range(count)]
+
+
+def run_step(scheduler, modules, dtype=torch.float16):
+    outputs = []
+    for m in modules:
+        weight, bias = scheduler.cast(m, dtype, torch.device("cpu"))
+        outputs.append((weight.clone(), bias.clone()))
+    return outputs
+
+
+def test_casts_are_prefetched_after_the_first_step():
+    device = SlowCopyDevice()
+    scheduler = PrefetchScheduler(device.begin_copy, device.wait_copy, depth=2)
+    modules = make_modules(6)
+
+    outputs = run_step(scheduler, modules)
+    assert scheduler.hits == 0
+    for m, (weight, bias) in zip(modules, outputs):
+        assert weight.dtype == torch.float16
+        assert torch.equal(weight, m.weight.half())
+        assert torch.equal(bias, m.bias.half())
+
+    for _ in range(3):
+        outputs = run_step(scheduler, modules)
+        for m, (weight, bias) in zip(modules, outputs):
+            assert torch.equal(weight, m.weight.half())
+    # The module after the last one is only learned at the start of the second step
+    assert scheduler.hits == 3 * 6 - 1
+
+
+def test_changed_weights_are_cast_again():
+    device = SlowCopyDevice()
+    scheduler = PrefetchScheduler(device.begin_copy, device.wait_copy, depth=1)
+    modules = make_modules(3)
+    run_step(scheduler, modules)
+    run_step(scheduler, modules[:1])
+
+    modules[1].weight.add_(1.0)
+    weight, _ = scheduler.cast(modules[1], torch.float16, torch.device("cpu"))
+    assert torch.equal(weight, modules[1].weight.half())
+
+    scheduler.cast(modules[2], torch.float32, torch.device("cpu"))
+    weight, _ = scheduler.cast(modules[2], torch.float16, torch.device("cpu"))
+    assert weight.dtype == torch.float16
+
+
+def test_buffers_are_reused():
+    device = SlowCopyDevice()
+    scheduler = PrefetchScheduler(device.begin_copy, device.wait_copy, depth=2)
+    modules = make_modules(8)
+    run_step(scheduler, modules)
+    pointers = set()
+    for _ in range(3):
+        for m in modules:
+            weight, bias = scheduler.cast(m, torch.float16, torch.device("cpu"))
+            pointers.add(weight.data_ptr())
+    # depth prefetched + the one in use + the one being released
+    assert len(pointers) <= 2 + 2
+
+
+def test_copies_overlap_with_compute():
+    delay = 0.02
+    device = SlowCopyDevice(delay)
+    scheduler = PrefetchScheduler(device.begin_copy, device.wait_copy, depth=1)
+    modules = make_modules(10)
+
+    def step():
+        start = time.perf_counter()
+        for m in modules:
+            scheduler.cast(m, torch.float16, torch.device("cpu"))
+            time.sleep(delay)  # compute
+        return time.perf_counter() - start
+
+    first = step()
+    second = step()
+    assert second < first * 0.8
+
+
+def test_each_thread_has_its_own_scheduler(monkeypatch):
+    monkeypatch.setattr(comfy.model_management.args, "prefetch_modules", 2)
+    monkeypatch.setattr(comfy.model_management, "is_device_cuda", lambda device: True)
+    monkeypatch.setattr(torch.cuda, "Stream", MagicMock())
+    monkeypatch.setattr(comfy.model_management, "PREFETCH_SCHEDULERS", {})
+    device = torch.device("cuda", 0)
+
+    scheduler = comfy.model_management.get_prefetch_scheduler(device)
+    assert comfy.model_management.get_prefetch_scheduler(device) is scheduler
+    other = []
+    thread = threading.Thread(target=lambda: other.append(comfy.model_management.get_prefetch_scheduler(device)))
+    thread.start()
+    thread.join()
+    assert other[0] is not None and other[0] is not scheduler
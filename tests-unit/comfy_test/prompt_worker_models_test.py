@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+import comfy.model_management  # noqa: E402
+import comfy.model_patcher  # noqa: E402
+
+
+@pytest.fixture
+def patcher():
+    device = torch.device("cpu")
+    patcher = comfy.model_patcher.ModelPatcher(torch.nn.Linear(4, 4), load_device=device, offload_device=device)
+    yield patcher
+    comfy.model_management.release_models_in_use()
+    comfy.model_management.unload_all_models()
+    comfy.model_management.models_in_use.clear()
+
+
+def test_clone_waits_until_other_worker_is_done(patcher):
+    loaded = threading.Event()
+    release = threading.Event()
+
+    def other_worker():
+        comfy.model_management.load_models_gpu([patcher])
+        loaded.set()
+        release.wait(timeout=10)
+        comfy.model_management.release_models_in_use()
+
+    thread = threading.Thread(target=other_worker)
+    thread.start()
+    assert loaded.wait(timeout=10)
+    in_use = comfy.model_management.current_loaded_models[0]
+    assert comfy.model_management.used_by_other_thread(in_use)
+
+    # Unloading everything keeps the model the other worker is using
+    comfy.model_management.free_memory(1e30, patcher.load_device)
+    assert in_use in comfy.model_management.current_loaded_models
+
+    done = threading.Event()
+    def load_clone():
+        comfy.model_management.load_models_gpu([patcher.clone()])
+        done.set()
+    clone_thread = threading.Thread(target=load_clone)
+    clone_thread.start()
+    assert not done.wait(timeout=0.2)
+
+    release.set()
+    thread.join(timeout=10)
+    assert done.wait(timeout=10)
+    clone_thread.join(timeout=10)
+    assert not comfy.model_management.used_by_other_thread(in_use)
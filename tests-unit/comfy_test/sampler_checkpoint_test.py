@@ -0,0 +1,138 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("scipy")
+pytest.importorskip("torchsde")
+
+import comfy.k_diffusion.sampling  # noqa: E402
+import comfy.model_sampling  # noqa: E402
+import comfy.sampler_checkpoint  # noqa: E402
+import comfy.samplers  # noqa: E402
+
+
+class Interrupted(Exception):
+    pass
+
+
+class FakeSampling(comfy.model_sampling.ModelSamplingDiscrete, comfy.model_sampling.EPS):
+    pass
+
+
+class FakeInner:
+    def __init__(self):
+        self.model_sampling = FakeSampling()
+
+
+class FakePatcher:
+    def __init__(self, model_sampling):
+        self.model_sampling = model_sampling
+
+    def get_model_object(self, name):
+        return getattr(self, name)
+
+
+class FakeGuider:
+    """Denoises to half of the input, raises Interrupted on the call number interrupt_at."""
+    def __init__(self, interrupt_at=None):
+        self.inner_model = FakeInner()
+        self.model_patcher = FakePatcher(self.inner_model.model_sampling)
+        self.interrupt_at = interrupt_at
+        self.calls = 0
+
+    def __call__(self, x, sigma, model_options={}, seed=None):
+        if self.calls == self.interrupt_at:
+            raise Interrupted()
+        self.calls += 1
+        return x * 0.5
+
+
+@pytest.fixture
+def checkpoints(tmp_path, monkeypatch):
+    checkpoints = comfy.sampler_checkpoint.SamplerCheckpoints()
+    checkpoints.set_directory(str(tmp_path), 2)
+    monkeypatch.setattr(checkpoints, "run_key", lambda *args: "run")
+    monkeypatch.setattr(comfy.sampler_checkpoint, "sampler_checkpoints", checkpoints)
+    return checkpoints
+
+
+def sample(sampler_name, guider, steps=8):
+    sampler = comfy.samplers.ksampler(sampler_name)
+    sigmas = comfy.samplers.calculate_sigmas(guider.inner_model.model_sampling, "karras", steps)
+    noise = torch.randn((1, 4, 8, 8), generator=torch.manual_seed(0))
+    extra_args = {"seed": 5, "model_options": {}}
+    return sampler.sample(guider, sigmas, extra_args, None, noise, latent_image=torch.zeros_like(noise), disable_pbar=True)
+
+
+@pytest.mark.parametrize("sampler_name", ["euler", "euler_ancestral"])
+def test_resume_matches_uninterrupted_run(checkpoints, sampler_name):
+    expected = sample(sampler_name, FakeGuider())
+    assert checkpoints.load("run") is None
+
+    with pytest.raises(Interrupted):
+        sample(sampler_name, FakeGuider(interrupt_at=5))
+    # Saved every 2 steps with the x before the step
+    saved = checkpoints.load("run")
+    assert saved["step"] == 4
+
+    guider = FakeGuider()
+    resumed = sample(sampler_name, guider)
+    assert guider.calls == 8 - 4
+    assert torch.equal(resumed, expected)
+    assert checkpoints.load("run") is None
+
+
+def test_brownian_bounds_restored(checkpoints):
+    with pytest.raises(Interrupted):
+        sample("dpmpp_sde", FakeGuider(interrupt_at=5))
+    saved = checkpoints.load("run")
+    assert saved["step"] == 2
+    assert len(saved["noise_samplers"]["bounds"]) == 1
+
+    state = comfy.sampler_checkpoint.NoiseSamplerState(saved["noise_samplers"])
+    assert state.brownian_bounds(0.5, 1.0) == tuple(saved["noise_samplers"]["bounds"][0])
+    assert state.state()["bounds"] == saved["noise_samplers"]["bounds"]
+
+
+def test_noise_sampler_state_restored():
+    x = torch.zeros((2, 3))
+    state = comfy.sampler_checkpoint.NoiseSamplerState()
+    with comfy.sampler_checkpoint.track_noise_samplers(state):
+        noise_sampler = comfy.k_diffusion.sampling.default_noise_sampler(x, seed=1)
+    noise_sampler(1.0, 0.5)
+    saved = state.state()
+    expected = noise_sampler(0.5, 0.1)
+
+    resumed = comfy.sampler_checkpoint.NoiseSamplerState(saved)
+    with comfy.sampler_checkpoint.track_noise_samplers(resumed):
+        noise_sampler = comfy.k_diffusion.sampling.default_noise_sampler(x, seed=1)
+    assert torch.equal(noise_sampler(0.5, 0.1), expected)
+
+
+def test_unhashable_inputs():
+    h = comfy.sampler_checkpoint.hashlib.sha256()
+    comfy.sampler_checkpoint.update_hash(h, {"a": [1, 2.0, "b", None, torch.ones(2)]})
+    with pytest.raises(comfy.sampler_checkpoint.Unhashable):
+        comfy.sampler_checkpoint.update_hash(h, {"f": lambda x: x})
+
+
+def test_evict(tmp_path, monkeypatch):
+    monkeypatch.setattr(comfy.sampler_checkpoint, "MAXIMUM_CHECKPOINTS", 2)
+    checkpoints = comfy.sampler_checkpoint.SamplerCheckpoints()
+    checkpoints.set_directory(str(tmp_path), 1)
+    for i in range(4):
+        checkpoints.save("run{}".format(i), 1, torch.ones(1), {"generators": [], "bounds": []})
+    assert len(list(tmp_path.iterdir())) == 2
+    assert checkpoints.load("run3")["step"] == 1
+
+
+@pytest.mark.parametrize("sampler_name", ["dpmpp_2m", "dpmpp_3m_sde", "deis", "res_multistep", "heunpp2", "dpm_fast"])
+def test_multistep_samplers_are_not_resumed(checkpoints, sampler_name):
+    assert not comfy.samplers.ksampler(sampler_name).resumable
+    with pytest.raises(Interrupted):
+        sample(sampler_name, FakeGuider(interrupt_at=5))
+    assert checkpoints.load("run") is None
+
+
+def test_churn_is_not_resumed():
+    assert comfy.samplers.ksampler("euler").resumable
+    assert not comfy.samplers.ksampler("euler", {"s_churn": 1.0}).resumable
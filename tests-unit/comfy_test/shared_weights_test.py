@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from comfy.shared_weights import SharedWeights, layout  # noqa: E402
+
+
+def make_model():
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Linear(8, 16), torch.nn.Linear(16, 3).to(torch.float16))
+    return model.requires_grad_(False)
+
+
+def shared_files(directory):
+    return [n for n in os.listdir(directory) if n.endswith(".bin")]
+
+
+def test_processes_share_one_file(tmp_path):
+    shared = SharedWeights()
+    shared.set_directory(str(tmp_path), 1024 ** 3)
+    first = make_model()
+    second = make_model()
+    expected = {k: v.clone() for k, v in first.state_dict().items()}
+
+    assert shared.share(first, "key") > 0
+    assert shared.share(second, "key") > 0
+    assert len(shared_files(tmp_path)) == 1
+    for k, v in second.state_dict().items():
+        assert torch.equal(v, expected[k])
+        assert v.dtype == expected[k].dtype
+    assert shared.is_shared(first, first[0])
+
+    # Different options or dtypes use another file
+    shared.share(make_model().to(torch.float64), "key")
+    shared.share(make_model(), "other")
+    assert len(shared_files(tmp_path)) == 3
+
+
+def test_writes_are_copy_on_write(tmp_path):
+    shared = SharedWeights()
+    shared.set_directory(str(tmp_path), 1024 ** 3)
+    first = make_model()
+    second = make_model()
+    shared.share(first, "key")
+    shared.share(second, "key")
+    original = second[0].weight.clone()
+
+    first[0].weight.add_(1.0)
+    assert torch.equal(second[0].weight, original)
+    third = make_model()
+    shared.share(third, "key")
+    assert torch.equal(third[0].weight, original)
+
+
+def test_weights_are_attached_again(tmp_path):
+    shared = SharedWeights()
+    shared.set_directory(str(tmp_path), 1024 ** 3)
+    model = make_model()
+    shared.share(model, "key")
+
+    # Moving to another device and back makes private copies
+    model[0].weight.data = model[0].weight.data.clone()
+    model[1].weight.data = model[1].weight.data.clone() + 1
+    model[1].bias.data = model[1].bias.data.clone()
+    assert not shared.is_shared(model, model[0])
+    shared.attach(model, changed={"1.weight", "1.bias"})
+    assert shared.is_shared(model, model[0])
+    # Changed weights stay private
+    assert not shared.is_shared(model, model[1])
+    assert model[1].bias.data_ptr() in model.shared_weight_ptrs
+
+
+def test_least_recently_used_files_are_removed(tmp_path):
+    shared = SharedWeights()
+    _, file_size = layout(list(make_model().named_parameters()))
+    shared.set_directory(str(tmp_path), file_size * 2)
+    for key in ("a", "b", "c"):
+        shared.share(make_model(), key)
+    assert len(shared_files(tmp_path)) == 2
+
+
+def test_disabled_does_nothing():
+    model = make_model()
+    assert SharedWeights().share(model, "key") == 0
+    assert not hasattr(model, "shared_weight_views")
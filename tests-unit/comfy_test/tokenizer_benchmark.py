@@ -0,0 +1,62 @@
+"""
+Benchmark of SDTokenizer.tokenize_with_weights on a corpus of long prompts, with cold caches (every
+prompt is new) and warm caches (the same prompts are queued again with small edits).
+
+    python tests-unit/comfy_test/tokenizer_benchmark.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from comfy.sd1_clip import SDTokenizer, parse_prompt_weights  # noqa: E402
+
+SUBJECTS = ["a portrait of an old fisherman", "a cyberpunk city street at night", "a cozy cabin in a snowy forest", "a majestic dragon flying over mountains"]
+DETAILS = ["highly detailed", "intricate", "sharp focus", "volumetric lighting", "8k", "film grain", "bokeh", "golden hour",
+           "dramatic clouds", "reflections", "rim light", "octane render", "trending on artstation", "cinematic composition",
+           "soft shadows", "vivid colors", "depth of field", "ultra realistic", "wide angle", "matte painting"]
+
+
+def make_prompt(rng):
+    parts = [rng.choice(SUBJECTS)]
+    for _ in range(rng.randint(20, 60)):
+        detail = rng.choice(DETAILS)
+        r = rng.random()
+        if r < 0.2:
+            detail = "({}:{:.1f})".format(detail, rng.uniform(0.5, 1.5))
+        elif r < 0.3:
+            detail = "(({}))".format(detail)
+        parts.append(detail)
+    return ", ".join(parts)
+
+
+def run(tokenizer, prompts):
+    start = time.perf_counter()
+    for prompt in prompts:
+        tokenizer.tokenize_with_weights(prompt)
+    return (time.perf_counter() - start) / len(prompts) * 1000
+
+
+def main():
+    rng = random.Random(0)
+    prompts = [make_prompt(rng) for _ in range(200)]
+    tokenizer = SDTokenizer()
+
+    tokenizer.word_tokens.clear()
+    parse_prompt_weights.cache_clear()
+    cold = run(tokenizer, prompts)
+    warm = run(tokenizer, prompts)
+    # Edits in the middle of a known prompt only change a few segments
+    edited = [p.replace(DETAILS[0], DETAILS[1], 1) + ", (new detail:1.1)" for p in prompts]
+    parse_prompt_weights.cache_clear()
+    partial = run(tokenizer, edited)
+    print("{} prompts, avg {:.0f} characters".format(len(prompts), sum(map(len, prompts)) / len(prompts)))  # noqa: T201
+    print("cold:   {:.3f} ms/prompt".format(cold))  # noqa: T201
+    print("warm:   {:.3f} ms/prompt".format(warm))  # noqa: T201
+    print("edited: {:.3f} ms/prompt".format(partial))  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
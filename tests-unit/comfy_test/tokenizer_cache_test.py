@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import comfy.sd1_clip  # noqa: E402
+from comfy.sd1_clip import SDTokenizer, load_embed, parse_prompt_weights, token_weights  # noqa: E402
+
+PROMPTS = [
+    "a photo of a cat, (masterpiece:1.2), ((best quality)), [blurry]",
+    "(a (very (deeply) nested):0.8) prompt with \\(escaped\\) parentheses",
+    "a very long prompt " + ", ".join("detail number {}".format(i) for i in range(60)),
+]
+
+
+def uncached_tokens(tokenizer, text):
+    tokenizer.word_tokens.clear()
+    parse_prompt_weights.cache_clear()
+    return tokenizer.tokenize_with_weights(text, return_word_ids=True)
+
+
+def test_cached_tokens_are_the_same():
+    tokenizer = SDTokenizer()
+    for text in PROMPTS:
+        expected = uncached_tokens(tokenizer, text)
+        assert tokenizer.tokenize_with_weights(text, return_word_ids=True) == expected
+        assert tokenizer.tokenize_with_weights(text, return_word_ids=True) == expected
+
+
+def test_words_are_tokenized_like_single_calls():
+    tokenizer = SDTokenizer()
+    words = ["a photo of a cat", "masterpiece", "a photo of a cat", "árbol"]
+    for word, ids in zip(words, tokenizer.tokenize_words(words)):
+        assert list(ids) == tokenizer.tokenizer(word)["input_ids"][1:-1]
+
+
+def test_parse_prompt_weights():
+    for text in PROMPTS:
+        assert list(parse_prompt_weights(text)) == token_weights(text, 1.0)
+
+
+def test_embeddings_are_cached_until_the_file_changes(tmp_path):
+    comfy.sd1_clip.embedding_cache.clear()
+    path = tmp_path / "style.pt"
+    torch.save({"string_to_param": {"*": torch.ones(2, 768)}}, str(path))
+    first = load_embed("style", str(tmp_path), 768)
+    assert torch.equal(first, torch.ones(2, 768))
+    assert load_embed("style", str(tmp_path), 768) is first
+
+    torch.save({"string_to_param": {"*": torch.zeros(3, 768)}}, str(path))
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+    assert torch.equal(load_embed("style", str(tmp_path), 768), torch.zeros(3, 768))
+    assert load_embed("missing", str(tmp_path), 768) is None
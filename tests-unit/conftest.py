@@ -0,0 +1,5 @@
+def pytest_configure(config):
+    # comfy.model_management picks the device when it is first imported. Run every unit test on the CPU so the
+    # tests work the same with or without a GPU, set once here before any test module is collected.
+    from comfy.cli_args import args
+    args.cpu = True
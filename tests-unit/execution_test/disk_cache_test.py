@@ -0,0 +1,59 @@
+import os
+import torch
+
+from comfy_execution.disk_cache import DiskCache, signature_hash
+
+
+def test_signature_hash_is_order_independent():
+    a = frozenset([(0, "CLIPTextEncode"), (1, frozenset([("text", "a cat"), ("clip", 1.5)]))])
+    b = frozenset([(1, frozenset([("clip", 1.5), ("text", "a cat")])), (0, "CLIPTextEncode")])
+    assert signature_hash(a) == signature_hash(b)
+    assert signature_hash(a) != signature_hash(frozenset([(0, "CLIPTextEncode")]))
+
+
+def test_signature_hash_rejects_nan():
+    assert signature_hash(frozenset([(0, "LoadImage"), (1, float("NaN"))])) is None
+
+
+def test_round_trip(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024 * 1024, ["CLIPTextEncode"])
+    cond = torch.randn(1, 77, 16)
+    pooled = torch.randn(1, 16)
+    value = [[[[cond, {"pooled_output": pooled, "strength": 1.0}]]]]
+    key = frozenset([(0, "CLIPTextEncode"), (1, "a photo")])
+    assert cache.get(key) is None
+    assert cache.set(key, value)
+
+    loaded = DiskCache(str(tmp_path), 1024 * 1024, ["CLIPTextEncode"]).get(key)
+    c, extra = loaded[0][0][0]
+    assert torch.equal(c, cond)
+    assert torch.equal(extra["pooled_output"], pooled)
+    assert extra["strength"] == 1.0
+
+
+def test_shared_storage_is_saved(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024 * 1024, ["VAEEncode"])
+    samples = torch.randn(2, 4, 8, 8)
+    key = frozenset([(0, "VAEEncode")])
+    assert cache.set(key, [[{"samples": samples, "first": samples[:1]}]])
+    loaded = cache.get(key)[0][0]
+    assert torch.equal(loaded["first"], samples[:1])
+
+
+def test_unserializable_values_are_skipped(tmp_path):
+    cache = DiskCache(str(tmp_path), 1024 * 1024, ["CLIPTextEncode"])
+    assert not cache.set(frozenset([(0, "x")]), [[object()]])
+
+
+def test_evicts_least_recently_used(tmp_path):
+    entry_size = 4096 * 4
+    cache = DiskCache(str(tmp_path), int(entry_size * 2.5), ["VAEEncode"])
+    keys = [frozenset([(0, str(i))]) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.set(key, [[torch.zeros(4096)]])
+        path = cache._path(signature_hash(key))
+        os.utime(path, (i, i))
+    cache.set(frozenset([(0, "new")]), [[torch.zeros(4096)]])
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is not None
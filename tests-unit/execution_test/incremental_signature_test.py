@@ -0,0 +1,70 @@
+import asyncio
+from unittest.mock import patch, MagicMock
+
+# Mock nodes module to prevent CUDA initialization during import
+mock_nodes = MagicMock()
+
+with patch.dict('sys.modules', {'nodes': mock_nodes}):
+    from comfy_execution import caching
+    from comfy_execution.caching import CacheKeySetInputSignature, HierarchicalCache
+    from comfy_execution.graph import DynamicPrompt
+
+
+class Node:
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {"required": {}}
+
+
+class FakeIsChangedCache:
+    def __init__(self, values=None):
+        self.values = values or {}
+        self.is_changed = {}
+
+    async def get(self, node_id):
+        self.is_changed[node_id] = self.values.get(node_id, False)
+        return self.is_changed[node_id]
+
+
+def make_prompt(seed, text="a cat"):
+    return {
+        "1": {"class_type": "Node", "inputs": {"ckpt_name": "model.safetensors"}},
+        "2": {"class_type": "Node", "inputs": {"clip": ["1", 1], "text": text}},
+        "3": {"class_type": "Node", "inputs": {"model": ["1", 0], "positive": ["2", 0], "seed": seed}},
+        "4": {"class_type": "Node", "inputs": {"samples": ["3", 0]}},
+    }
+
+
+def run_prompt(cache, prompt, is_changed_cache=None):
+    asyncio.run(cache.set_prompt(DynamicPrompt(prompt), prompt.keys(), is_changed_cache or FakeIsChangedCache()))
+    return dict(cache.cache_key_set.keys)
+
+
+def test_only_the_changed_cone_is_recomputed():
+    mock_nodes.NODE_CLASS_MAPPINGS = {"Node": Node}
+    caching.NODE_CLASS_CONTAINS_UNIQUE_ID.clear()
+    cache = HierarchicalCache(CacheKeySetInputSignature)
+    first = run_prompt(cache, make_prompt(1))
+
+    with patch.object(CacheKeySetInputSignature, "get_node_signature", autospec=True,
+                      side_effect=CacheKeySetInputSignature.get_node_signature) as get_node_signature:
+        second = run_prompt(cache, make_prompt(2))
+    assert sorted(call.args[2] for call in get_node_signature.call_args_list) == ["3", "4"]
+    assert second["1"] is first["1"]
+    assert second["2"] is first["2"]
+    assert second["3"] != first["3"]
+    assert second["4"] != first["4"]
+
+    # The reused and recomputed signatures are the same as computing all of them again.
+    fresh = HierarchicalCache(CacheKeySetInputSignature)
+    assert run_prompt(fresh, make_prompt(2)) == second
+
+
+def test_is_changed_result_marks_the_node_changed():
+    mock_nodes.NODE_CLASS_MAPPINGS = {"Node": Node}
+    cache = HierarchicalCache(CacheKeySetInputSignature)
+    first = run_prompt(cache, make_prompt(1), FakeIsChangedCache({"1": "hash_a"}))
+    second = run_prompt(cache, make_prompt(1), FakeIsChangedCache({"1": "hash_b"}))
+    assert all(second[node_id] != first[node_id] for node_id in ["1", "2", "3", "4"])
+    third = run_prompt(cache, make_prompt(1), FakeIsChangedCache({"1": "hash_b"}))
+    assert all(third[node_id] is second[node_id] for node_id in ["1", "2", "3", "4"])
@@ -0,0 +1,74 @@
+import asyncio
+import torch
+from unittest.mock import patch, MagicMock
+
+# Mock nodes module to prevent CUDA initialization during import
+mock_nodes = MagicMock()
+
+with patch.dict('sys.modules', {'nodes': mock_nodes}):
+    from comfy_execution.caching import CacheKeySetID, MemoryBudgetCache, estimate_output_size
+    from comfy_execution.graph import DynamicPrompt
+
+
+def make_prompt(node_ids):
+    return DynamicPrompt({node_id: {"class_type": "EmptyImage", "inputs": {}} for node_id in node_ids})
+
+
+def run_prompt(cache, node_ids):
+    asyncio.run(cache.set_prompt(make_prompt(node_ids), node_ids, None))
+    cache.clean_unused()
+
+
+def test_estimate_output_size_counts_shared_storage_once():
+    t = torch.zeros((4, 256), dtype=torch.float32)
+    latent = {"samples": t, "noise_mask": t[:2]}
+    ram, vram = estimate_output_size([[latent], (t,)])
+    assert ram == t.nbytes
+    assert vram == 0
+
+
+def test_estimate_output_size_ignores_unknown_objects():
+    assert estimate_output_size([object(), 5, None]) == (0, 0)
+
+
+def test_evicts_by_bytes_not_entries():
+    tensor_bytes = 1024 * 4
+    cache = MemoryBudgetCache(CacheKeySetID, ram_budget=tensor_bytes * 2)
+    run_prompt(cache, ["1", "2", "3"])
+    for node_id in ["1", "2", "3"]:
+        cache.set(node_id, [[torch.zeros(1024)]])
+    # Everything in the current prompt is kept even when over budget
+    assert cache.get_stats()["entries"] == 3
+
+    run_prompt(cache, ["4"])
+    stats = cache.get_stats()
+    assert stats["ram_used"] <= tensor_bytes * 2
+    assert stats["evictions"] == 1
+    assert stats["evicted_bytes"] == tensor_bytes
+
+
+def test_prefers_evicting_cheap_large_entries():
+    cache = MemoryBudgetCache(CacheKeySetID, ram_budget=1024 * 4 * 2)
+    run_prompt(cache, ["big", "small"])
+    cache.compute_times[("big", "EmptyImage")] = 1.0
+    cache.set("big", [[torch.zeros(1024 * 2)]])
+    cache.set("small", [[torch.zeros(16)]])
+    cache.compute_times[("small", "EmptyImage")] = 1.0
+
+    run_prompt(cache, ["other"])
+    assert cache.get("small") is None  # not part of the current prompt
+    assert ("small", "EmptyImage") in cache.cache
+    assert ("big", "EmptyImage") not in cache.cache
+
+
+def test_counts_hits_and_misses():
+    cache = MemoryBudgetCache(CacheKeySetID, ram_budget=1024 * 1024)
+    run_prompt(cache, ["1"])
+    assert cache.lookup("1") is None
+    cache.set("1", [[torch.zeros(8)]])
+    assert cache.lookup("1") is not None
+    # Probes while building the execution list are not counted
+    assert cache.get("1") is not None
+    stats = cache.get_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
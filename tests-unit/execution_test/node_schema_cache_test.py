@@ -0,0 +1,61 @@
+import folder_paths
+from comfy_execution.validation import NodeSchemaCache
+
+
+class FileNode:
+    files = ["a.safetensors"]
+    calls = 0
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        cls.calls += 1
+        return {"required": {"name": (list(cls.files),), "strength": ("FLOAT", {"default": 1.0})}}
+
+
+def make_cache(monkeypatch, fingerprint):
+    monkeypatch.setattr(folder_paths, "get_directories_fingerprint", lambda: fingerprint[0])
+    cache = NodeSchemaCache()
+    cache.refresh()
+    return cache
+
+
+def test_schema_is_resolved_once(monkeypatch):
+    FileNode.calls = 0
+    cache = make_cache(monkeypatch, [("models", 1.0)])
+    schema, cached = cache.get("FileNode", FileNode)
+    assert not cached
+    assert schema.valid_inputs == {"name", "strength"}
+    assert cache.get("FileNode", FileNode) == (schema, True)
+    cache.refresh()
+    assert cache.get("FileNode", FileNode) == (schema, True)
+    assert FileNode.calls == 1
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_schema_is_invalidated_when_directories_change(monkeypatch):
+    fingerprint = [("models", 1.0)]
+    cache = make_cache(monkeypatch, fingerprint)
+    schema, _ = cache.get("FileNode", FileNode)
+    fingerprint[0] = ("models", 2.0)
+    cache.refresh()
+    new_schema, cached = cache.get("FileNode", FileNode)
+    assert not cached and new_schema is not schema
+
+
+def test_combo_contains(monkeypatch):
+    cache = make_cache(monkeypatch, [()])
+    schema, _ = cache.get("FileNode", FileNode)
+    options = schema.class_inputs["required"]["name"][0]
+    assert schema.combo_contains("name", options, "a.safetensors")
+    assert not schema.combo_contains("name", options, "b.safetensors")
+    assert not schema.combo_contains("name", options, ["1", 0])
+
+
+def test_directories_fingerprint(tmp_path, monkeypatch):
+    monkeypatch.setattr(folder_paths, "folder_names_and_paths", {"checkpoints": ([str(tmp_path / "checkpoints")], set())})
+    monkeypatch.setattr(folder_paths, "filename_list_cache", {})
+    monkeypatch.setattr(folder_paths, "get_input_directory", lambda: str(tmp_path))
+    missing = folder_paths.get_directories_fingerprint()
+    assert (str(tmp_path / "checkpoints"), None) in missing
+    (tmp_path / "checkpoints").mkdir()
+    assert folder_paths.get_directories_fingerprint() != missing
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+
+from comfy_execution.parallel import NodeThreadPool, get_node_resource, thread_state_capturers
+
+
+class GpuNode:
+    pass
+
+
+class CpuNode:
+    EXECUTION_RESOURCE = "CPU"
+
+
+class IoNode:
+    EXECUTION_RESOURCE = "IO"
+
+
+def test_node_resource():
+    assert get_node_resource(GpuNode) == "GPU"
+    assert get_node_resource(CpuNode()) == "CPU"
+
+    pool = NodeThreadPool(2)
+    assert not pool.can_run(GpuNode)
+    assert pool.can_run(CpuNode) and pool.can_run(IoNode)
+    pool.shutdown()
+
+
+def test_cpu_nodes_overlap():
+    pool = NodeThreadPool(2)
+    barrier = threading.Barrier(2, timeout=5)
+
+    def f(value):
+        barrier.wait()  # Only passes if both calls run at the same time
+        return (value,)
+
+    async def run():
+        tasks = [pool.submit(CpuNode, f, {"value": i}) for i in range(2)]
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(run()) == [(0,), (1,)]
+    pool.shutdown()
+
+
+def test_io_nodes_run_in_order_one_at_a_time():
+    pool = NodeThreadPool(4)
+    running = []
+    order = []
+
+    def f(value):
+        running.append(value)
+        assert len(running) == 1
+        time.sleep(0.01)
+        order.append(value)
+        running.remove(value)
+        return (value,)
+
+    async def run():
+        tasks = [pool.submit(IoNode, f, {"value": i}) for i in range(4)]
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    assert order == [0, 1, 2, 3]
+    pool.shutdown()
+
+
+def test_thread_state_is_restored():
+    local = threading.local()
+
+    def capture():
+        value = getattr(local, "value", None)
+        def restore():
+            local.value = value
+        return restore
+
+    thread_state_capturers.append(capture)
+    try:
+        pool = NodeThreadPool(1)
+        local.value = "worker"
+        prefix = []
+
+        async def run():
+            return await pool.submit(CpuNode, lambda: (local.value, threading.get_ident()), {}, pre_execute_cb=lambda: prefix.append(threading.get_ident()))
+
+        value, thread_id = asyncio.run(run())
+        assert value == "worker"
+        assert thread_id != threading.get_ident()
+        assert prefix == [thread_id]
+        pool.shutdown()
+    finally:
+        thread_state_capturers.remove(capture)
+
+
+def test_background_nodes_see_the_worker_interrupt():
+    import comfy.model_management
+    pool = NodeThreadPool(1)
+
+    async def run():
+        return await pool.submit(CpuNode, comfy.model_management.processing_interrupted, {})
+
+    assert not asyncio.run(run())
+    comfy.model_management.interrupt_current_processing(thread_id=threading.get_ident())
+    try:
+        assert asyncio.run(run())
+    finally:
+        comfy.model_management.interrupt_current_processing(False, thread_id=threading.get_ident())
+    pool.shutdown()
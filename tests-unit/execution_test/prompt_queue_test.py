@@ -0,0 +1,274 @@
+import copy
+import json
+import pickle
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+
+import execution
+from comfy_execution.frozen import freeze
+
+
+def make_item(number, model_name):
+    prompt = {"1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": model_name}}}
+    return (number, "prompt_{}".format(number), prompt, {}, ["1"])
+
+
+def make_queue(*items):
+    queue = execution.PromptQueue(MagicMock())
+    for item in items:
+        queue.put(item)
+    return queue
+
+
+def prefers(model_name):
+    return lambda item: model_name in execution.get_prompt_model_files(item[2])
+
+
+def test_get_prompt_model_files():
+    prompt = {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "sd15.safetensors"}},
+        "2": {"class_type": "LoraLoader", "inputs": {"lora_name": "style.safetensors", "model": ["1", 0], "strength_model": 1.0}},
+        "3": {"class_type": "CLIPTextEncode", "inputs": {"text": "a photo of a cat"}},
+    }
+    assert execution.get_prompt_model_files(prompt) == {"sd15.safetensors", "style.safetensors"}
+
+
+def test_get_without_preference_is_fifo():
+    queue = make_queue(make_item(0, "a.safetensors"), make_item(1, "b.safetensors"))
+    item, _ = queue.get()
+    assert item[0] == 0
+
+
+def test_get_prefers_matching_prompt():
+    queue = make_queue(make_item(0, "a.safetensors"), make_item(1, "b.safetensors"), make_item(2, "a.safetensors"))
+    item, _ = queue.get(preferred=prefers("b.safetensors"))
+    assert item[0] == 1
+    item, _ = queue.get()
+    assert item[0] == 0
+
+
+def test_skipped_prompt_is_not_starved():
+    items = [make_item(0, "a.safetensors")] + [make_item(i, "b.safetensors") for i in range(1, 10)]
+    queue = make_queue(*items)
+    taken = []
+    for _ in range(execution.MAXIMUM_AFFINITY_SKIPS + 1):
+        item, _ = queue.get(preferred=prefers("b.safetensors"))
+        taken.append(item[0])
+    assert taken[-1] == 0
+
+
+def test_worker_flags():
+    queue = make_queue()
+    queue.add_worker(0)
+    queue.add_worker(1)
+    queue.set_flag("free_memory", True)
+    assert queue.get_flags(worker_id=0) == {"free_memory": True}
+    assert queue.get_flags(worker_id=0) == {}
+    assert queue.get_flags(worker_id=1) == {"free_memory": True}
+
+
+def test_running_thread_ids():
+    queue = make_queue(make_item(0, "a.safetensors"))
+    _, item_id = queue.get()
+    assert len(queue.get_running_thread_ids("prompt_0")) == 1
+    assert queue.get_running_thread_ids("prompt_1") == []
+    queue.task_done(item_id, {}, None)
+    assert queue.get_running_thread_ids() == []
+
+
+def test_upcoming_model_files():
+    queue = make_queue(make_item(0, "a.safetensors"), make_item(1, "b.safetensors"), make_item(2, "c.safetensors"))
+    queue.get()
+    assert queue.get_upcoming_model_files(1) == [{"a.safetensors"}, {"b.safetensors"}]
+    assert queue.get_upcoming_model_files(5) == [{"a.safetensors"}, {"b.safetensors"}, {"c.safetensors"}]
+
+
+def run_to_history(queue, count):
+    for i in range(count):
+        queue.put((i, "prompt_{}".format(i), {"1": {"class_type": "SaveImage", "inputs": {"images": ["2", 0]}}}, {"client_id": "c", "api_key_comfy_org": "secret"}, ["1"]))
+        item, item_id = queue.get()
+        queue.task_done(item_id, {"outputs": {"1": {"images": [i]}}, "meta": {}}, status=None)
+
+
+def test_queue_items_are_shared_and_frozen():
+    queue = make_queue(make_item(0, "a.safetensors"))
+    item, _ = queue.get()
+    running, _ = queue.get_current_queue()
+    assert running[0] is item
+    with pytest.raises(TypeError):
+        item[2]["1"]["inputs"]["ckpt_name"] = "b.safetensors"
+    with pytest.raises(TypeError):
+        item[4].append("2")
+    assert json.loads(json.dumps(item))[2]["1"]["inputs"]["ckpt_name"] == "a.safetensors"
+
+
+def test_history_removes_sensitive_data():
+    queue = execution.PromptQueue(MagicMock())
+    run_to_history(queue, 1)
+    entry = queue.get_history(prompt_id="prompt_0")["prompt_0"]
+    assert entry["prompt"][3] == {"client_id": "c"}
+    assert entry["outputs"] == {"1": {"images": [0]}}
+    assert entry is queue.get_history(prompt_id="prompt_0")["prompt_0"]
+
+
+def test_history_pagination():
+    queue = execution.PromptQueue(MagicMock())
+    run_to_history(queue, 10)
+    assert list(queue.get_history(max_items=3)) == ["prompt_7", "prompt_8", "prompt_9"]
+    assert list(queue.get_history(max_items=3, offset=2)) == ["prompt_2", "prompt_3", "prompt_4"]
+    assert list(queue.get_history(offset=8)) == ["prompt_8", "prompt_9"]
+    assert len(queue.get_history()) == 10
+
+    queue.delete_history_item("prompt_3")
+    assert list(queue.get_history(max_items=3, offset=2)) == ["prompt_2", "prompt_4", "prompt_5"]
+
+
+def test_history_pagination_after_eviction(monkeypatch):
+    monkeypatch.setattr(execution, "MAXIMUM_HISTORY_SIZE", 4)
+    queue = execution.PromptQueue(MagicMock())
+    run_to_history(queue, 20)
+    assert list(queue.get_history()) == ["prompt_16", "prompt_17", "prompt_18", "prompt_19"]
+    assert list(queue.get_history(max_items=2, offset=1)) == ["prompt_17", "prompt_18"]
+    queue.delete_history_item("prompt_17")
+    assert list(queue.get_history(max_items=2, offset=1)) == ["prompt_18", "prompt_19"]
+
+
+def test_store_is_trimmed_with_the_history(monkeypatch):
+    monkeypatch.setattr(execution, "MAXIMUM_HISTORY_SIZE", 4)
+    queue = execution.PromptQueue(MagicMock())
+    queue.store = MagicMock()
+    run_to_history(queue, 20)
+    queue.store.history_trim.assert_called_with(execution.MAXIMUM_STORED_HISTORY_SIZE)
+
+
+def test_history_store_is_read_without_the_mutex():
+    queue = execution.PromptQueue(MagicMock())
+    store = MagicMock()
+    def get_history(prompt_id=None):
+        # Another thread can still use the queue while the store is read
+        acquired = []
+        def try_acquire():
+            acquired.append(queue.mutex.acquire(blocking=False))
+            if acquired[0]:
+                queue.mutex.release()
+        thread = threading.Thread(target=try_acquire)
+        thread.start()
+        thread.join()
+        assert acquired == [True]
+        return {prompt_id: {"outputs": {}}}
+    store.get_history.side_effect = get_history
+    queue.store = store
+    assert queue.get_history(prompt_id="old") == {"old": {"outputs": {}}}
+
+
+def test_history_of_queued_prompt_is_not_read_from_the_store():
+    queue = make_queue(make_item(1, "a.safetensors"))
+    queue.store = MagicMock()
+    assert queue.get_history(prompt_id="prompt_1") == {}
+    queue.get(timeout=0)
+    assert queue.get_history(prompt_id="prompt_1") == {}
+    queue.store.get_history.assert_not_called()
+
+
+def test_frozen_copies_are_mutable():
+    frozen = freeze({"1": {"inputs": {"images": ["2", 0]}}})
+    thawed = copy.deepcopy(frozen)
+    thawed["1"]["inputs"]["images"][0] = "3"
+    assert frozen["1"]["inputs"]["images"] == ["2", 0]
+    assert pickle.loads(pickle.dumps(frozen)) == frozen
+
+
+def make_coalescing_queue():
+    queue = execution.PromptQueue(MagicMock())
+    queue.coalesce_prompts = True
+    return queue
+
+
+def make_client_item(number, client_id, text="a cat"):
+    prompt = {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "a.safetensors"}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"clip": ["1", 1], "text": text}},
+        "3": {"class_type": "PreviewAny", "inputs": {"source": ["2", 0]}},
+    }
+    return (number, "prompt_{}".format(number), prompt, {"client_id": client_id}, ["3"])
+
+
+def test_coalescing_key_ignores_unused_nodes_and_client():
+    a = make_client_item(0, "client_a")
+    b = make_client_item(1, "client_b")
+    b[2]["4"] = {"class_type": "CLIPTextEncode", "inputs": {"clip": ["1", 1], "text": "unused"}}
+    assert execution.get_coalescing_key(a) == execution.get_coalescing_key(b)
+    assert execution.get_coalescing_key(a) != execution.get_coalescing_key(make_client_item(2, "client_a", text="a dog"))
+
+
+def test_identical_prompts_are_executed_once():
+    queue = make_coalescing_queue()
+    queue.put(make_client_item(0, "client_a"))
+    queue.put(make_client_item(1, "client_b"))
+    queue.put(make_client_item(2, "client_a", text="a dog"))
+    assert queue.get_tasks_remaining() == 3
+
+    item, item_id = queue.get()
+    assert item[1] == "prompt_0"
+    # Submitted while the first one is running
+    queue.put(make_client_item(3, "client_c"))
+    assert sorted(x[1] for x in queue.get_current_queue()[1]) == ["prompt_1", "prompt_2", "prompt_3"]
+
+    status = execution.PromptQueue.ExecutionStatus(status_str="success", completed=True, messages=[("execution_success", {"prompt_id": "prompt_0"})])
+    queue.task_done(item_id, {"outputs": {"3": {"text": ["x"]}}, "meta": {"3": {"display_node": "3"}}}, status=status)
+    for prompt_id in ["prompt_0", "prompt_1", "prompt_3"]:
+        assert queue.get_history(prompt_id=prompt_id)[prompt_id]["outputs"] == {"3": {"text": ["x"]}}
+    assert queue.get_history(prompt_id="prompt_1")["prompt_1"]["prompt"][3] == {"client_id": "client_b"}
+
+    sent = [(c.args[0], c.args[1]["prompt_id"], c.args[2]) for c in queue.server.send_sync.call_args_list]
+    assert ("executed", "prompt_1", "client_b") in sent
+    assert ("execution_success", "prompt_3", "client_c") in sent
+
+    item, _ = queue.get()
+    assert item[1] == "prompt_2"
+    assert queue.get_tasks_remaining() == 1
+
+
+def test_deleting_a_coalesced_prompt_promotes_the_next_one():
+    queue = make_coalescing_queue()
+    queue.put(make_client_item(0, "client_a"))
+    queue.put(make_client_item(1, "client_b"))
+    queue.put(make_client_item(2, "client_c"))
+    assert queue.delete_queue_item(lambda item: item[1] == "prompt_0")
+    item, item_id = queue.get()
+    assert item[1] == "prompt_1"
+    queue.task_done(item_id, {"outputs": {}, "meta": {}}, status=None)
+    assert list(queue.get_history()) == ["prompt_1", "prompt_2"]
+
+
+def test_interrupted_prompt_promotes_the_next_one():
+    queue = make_coalescing_queue()
+    queue.put(make_client_item(0, "client_a"))
+    queue.put(make_client_item(1, "client_b"))
+    queue.put(make_client_item(2, "client_c"))
+    item, item_id = queue.get()
+    status = execution.PromptQueue.ExecutionStatus(status_str="error", completed=False, messages=[("execution_interrupted", {"prompt_id": "prompt_0"})])
+    queue.task_done(item_id, {"outputs": {}, "meta": {}}, status=status)
+    assert list(queue.get_history()) == ["prompt_0"]
+    assert queue.server.send_sync.call_count == 0
+
+    item, item_id = queue.get()
+    assert item[1] == "prompt_1"
+    status = execution.PromptQueue.ExecutionStatus(status_str="success", completed=True, messages=[])
+    queue.task_done(item_id, {"outputs": {}, "meta": {}}, status=status)
+    assert list(queue.get_history()) == ["prompt_0", "prompt_1", "prompt_2"]
+    assert queue.get_history(prompt_id="prompt_2")["prompt_2"]["status"]["completed"]
+
+
+def test_coalesced_prompts_dont_grow_the_history(monkeypatch):
+    monkeypatch.setattr(execution, "MAXIMUM_HISTORY_SIZE", 3)
+    queue = make_coalescing_queue()
+    for i in range(4):
+        for j in range(3):
+            queue.put(make_client_item(i * 3 + j, "client_{}".format(j), text="prompt {}".format(i)))
+        item, item_id = queue.get()
+        queue.task_done(item_id, {"outputs": {}, "meta": {}}, status=None)
+        assert len(queue.history) <= 3
+    assert list(queue.get_history()) == ["prompt_9", "prompt_10", "prompt_11"]
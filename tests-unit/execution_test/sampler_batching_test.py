@@ -0,0 +1,132 @@
+import asyncio
+from unittest.mock import MagicMock
+
+import torch
+
+import execution
+from comfy_execution import sampler_batching
+
+
+def make_prompt(text="a cat", seed=0, sampler_name="euler"):
+    return {
+        "1": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "sd15.safetensors"}},
+        "2": {"class_type": "CLIPTextEncode", "inputs": {"text": text, "clip": ["1", 1]}},
+        "3": {"class_type": "CLIPTextEncode", "inputs": {"text": "blurry", "clip": ["1", 1]}},
+        "4": {"class_type": "EmptyLatentImage", "inputs": {"width": 512, "height": 512, "batch_size": 1}},
+        "5": {"class_type": "KSampler", "inputs": {
+            "model": ["1", 0], "positive": ["2", 0], "negative": ["3", 0], "latent_image": ["4", 0],
+            "seed": seed, "steps": 20, "cfg": 8.0, "sampler_name": sampler_name, "scheduler": "normal", "denoise": 1.0,
+        }},
+        "6": {"class_type": "VAEDecode", "inputs": {"samples": ["5", 0], "vae": ["1", 2]}},
+        "7": {"class_type": "SaveImage", "inputs": {"images": ["6", 0], "filename_prefix": "ComfyUI"}},
+    }
+
+
+def test_batch_key_ignores_seed_and_text():
+    a = sampler_batching.get_batch_key(make_prompt("a cat", 1), ["7"])
+    b = sampler_batching.get_batch_key(make_prompt("a dog", 2), ["7"])
+    assert a is not None
+    assert a == b
+
+
+def test_batch_key_differs_for_other_inputs():
+    a = make_prompt()
+    b = make_prompt()
+    b["5"]["inputs"]["steps"] = 30
+    assert sampler_batching.get_batch_key(a, ["7"]) != sampler_batching.get_batch_key(b, ["7"])
+    assert sampler_batching.get_batch_key(a, ["7"]) != sampler_batching.get_batch_key(a, ["6"])
+
+
+def test_batch_key_rejects_ancestral_samplers():
+    assert sampler_batching.get_batch_key(make_prompt(sampler_name="euler_ancestral"), ["7"]) is None
+
+
+def test_batch_key_rejects_multiple_samplers():
+    prompt = make_prompt()
+    prompt["8"] = dict(prompt["5"])
+    assert sampler_batching.get_batch_key(prompt, ["7"]) is None
+
+
+def test_fuse_prompts():
+    prompts = [make_prompt("a cat", 1), make_prompt("a dog", 2)]
+    fused, outputs, node_maps = sampler_batching.fuse_prompts(prompts, ["7"])
+
+    # The loader, negative prompt and latent are shared, the positive prompt and everything after the sampler is not
+    for node_id in ("1", "3", "4"):
+        assert fused[node_id] == prompts[0][node_id]
+    assert "2" not in fused and "6" not in fused and "7" not in fused
+    assert fused["2.batch0"]["inputs"]["text"] == "a cat"
+    assert fused["2.batch1"]["inputs"]["text"] == "a dog"
+
+    sampler = fused["5"]
+    assert sampler["class_type"] == sampler_batching.FUSED_SAMPLER_CLASS
+    assert sampler["inputs"]["positive_0"] == ["2.batch0", 0]
+    assert sampler["inputs"]["positive_1"] == ["2.batch1", 0]
+    assert sampler["inputs"]["negative_1"] == ["3", 0]
+    assert sampler["inputs"]["seed_0"] == 1
+    assert sampler["inputs"]["seed_1"] == 2
+    assert fused["6.batch1"]["inputs"]["samples"] == ["5", 1]
+
+    assert sorted(outputs) == ["7.batch0", "7.batch1"]
+    assert node_maps[1] == {"2.batch1": "2", "6.batch1": "6", "7.batch1": "7"}
+
+
+def test_batch_conditioning():
+    conds = [[[torch.ones(1, 77, 8), {"pooled_output": torch.ones(1, 4)}]],
+             [[torch.zeros(1, 154, 8), {"pooled_output": torch.zeros(1, 4)}]]]
+    batched = sampler_batching._batch_conditioning(conds, 2)
+    assert batched[0][0].shape == (4, 154, 8)
+    assert batched[0][1]["pooled_output"].shape == (4, 4)
+    assert torch.all(batched[0][0][:2] == 1)
+    assert torch.all(batched[0][0][2:] == 0)
+
+
+def test_batch_conditioning_rejects_mismatched_extras():
+    conds = [[[torch.ones(1, 77, 8), {"pooled_output": torch.ones(1, 4)}]],
+             [[torch.ones(1, 77, 8), {}]]]
+    assert sampler_batching._batch_conditioning(conds, 1) is None
+
+
+def test_get_compatible():
+    queue = execution.PromptQueue(MagicMock())
+    for i, text in enumerate(["a cat", "a dog", "a bird"]):
+        prompt = make_prompt(text)
+        if i == 1:
+            prompt["5"]["inputs"]["steps"] = 30
+        queue.put((i, "prompt_{}".format(i), prompt, {}, ["7"]))
+
+    item, _ = queue.get()
+    key = sampler_batching.get_batch_key(item[2], item[4])
+    found = queue.get_compatible(lambda x: sampler_batching.get_batch_key(x[2], x[4]) == key, 4, 0)
+    assert [x[0][1] for x in found] == ["prompt_2"]
+    running, queued = queue.get_current_queue()
+    assert len(running) == 2
+    assert [x[1] for x in queued] == ["prompt_1"]
+    assert queue.get_tasks_remaining() == 3
+
+
+def test_fused_sampler_is_internal():
+    sampler_batching.SamplerBatcher(4, 0)
+    prompt = {"1": {"class_type": sampler_batching.FUSED_SAMPLER_CLASS, "inputs": {}}}
+    valid, error, _, _ = asyncio.run(execution.validate_prompt("prompt", prompt, None))
+    assert not valid and error["type"] == "invalid_prompt"
+    valid, error, _, _ = asyncio.run(execution.validate_prompt("prompt", prompt, None, allow_internal=True))
+    assert error["type"] == "prompt_no_outputs"
+
+
+def test_failed_fused_prompts_are_executed_one_at_a_time(monkeypatch):
+    async def validate_prompt(*args, **kwargs):
+        return (True, None, [], {})
+    monkeypatch.setattr(execution, "validate_prompt", validate_prompt)
+    batcher = sampler_batching.SamplerBatcher(4, 0)
+    batch = [((i, "prompt_{}".format(i), make_prompt(text, i), {}, ["7"]), i) for i, text in enumerate(["a cat", "a dog"])]
+    executor = MagicMock()
+    executor.success = False
+    executor.status_messages = [("execution_error", {"prompt_id": "prompt_0", "node_id": "5"})]
+    assert batcher.execute(executor, batch) is None
+
+    # Interrupted prompts are not executed again, each prompt gets the interruption
+    executor.status_messages = [("execution_interrupted", {"prompt_id": "prompt_0", "node_id": "5"})]
+    executor.history_result = {"outputs": {}, "meta": {}}
+    results = batcher.execute(executor, batch)
+    assert [messages[0][1]["prompt_id"] for _, messages in results] == ["prompt_0", "prompt_1"]